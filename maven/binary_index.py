@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+A compact binary form of the index built with `build_index.py`, which is read through `mmap` without parsing or copying
+it. The blob numbers, sizes, and checksums are kept in fixed-width arrays, and the names are kept sorted and
+front-coded: since Maven paths share very long prefixes, each name only stores the number of leading bytes it shares
+with the previous name plus the bytes that differ. Every `RESTART_INTERVAL`-th name is stored in full, so that any name
+can be found by a binary search over those names followed by a short scan.
+
+The file layout (all integers little-endian) is a header followed by these sections, each starting at an offset given
+in the header:
+
+    ids       uint64[count]                     blob numbers
+    sizes     uint64[count]                     sizes in bytes
+    md5s      16 bytes[count]                   md5 sums (all zeros when unknown)
+    crc32cs   uint32[count]                     crc32c checksums (zero when unknown)
+    flags     uint8[count]                      bit 0: md5 is known; bit 1: crc32c is known
+    restarts  uint64[ceil(count / interval)]    offset of every full name within the names section
+    names     front-coded names                 varint shared length, varint suffix length, suffix bytes
+
+Use `read_index` from `iterate_index.py` to read either form of the index transparently.
+"""
+
+import array
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from iterate_index import INDEX_FILE, IndexEntry, read_index
+
+MAGIC = b'JADEIDX\0'
+VERSION = 1
+RESTART_INTERVAL = 16
+# magic, version, restart interval, count, then the offsets of the ids, sizes, md5s, crc32cs, flags, restarts, and names
+# sections, then the length of the names section.
+HEADER = struct.Struct('<8sIIQQQQQQQQQ')
+MD5_KNOWN = 1
+CRC32C_KNOWN = 2
+# The number of rows buffered in memory for each section while converting.
+CONVERT_BUFFER_ROWS = 65536
+
+########
+# Varints
+####
+
+
+def encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(buffer, pos: int) -> Tuple[int, int]:
+    """
+    :param buffer: the buffer to read from
+    :param pos: the position of the varint within the buffer
+    :return: the value of the varint, and the position just past it
+    """
+    byte = buffer[pos]
+    if byte < 0x80:
+        # The common case, since Maven path components are short.
+        return byte, pos + 1
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+########
+# Converting from the TSV index
+####
+
+
+def common_prefix_length(a: bytes, b: bytes) -> int:
+    limit = min(len(a), len(b))
+    i = 0
+    while i < limit and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def copy_section(out: BinaryIO, section_file: BinaryIO) -> int:
+    """
+    Appends a section to the output, padded to a multiple of 8 bytes so that every section is aligned.
+
+    :param out: the binary index being written
+    :param section_file: the temporary file holding the section
+    :return: the offset of the section within the output
+    """
+    offset = out.tell()
+    section_file.seek(0)
+    shutil.copyfileobj(section_file, out)
+    out.write(b'\0' * (-out.tell() % 8))
+    return offset
+
+
+def convert_index(index_file: str, binary_file: str, restart_interval: int=RESTART_INTERVAL):
+    """
+    Converts an index into the binary format. The index must be sorted by name, as `build_index.py` writes it. Each
+    section is streamed to a temporary file while the index is read, so memory use does not grow with the index.
+
+    :param index_file: the index to convert, in either format
+    :param binary_file: the binary index to write
+    :param restart_interval: how often to store a name in full
+    """
+    count = 0
+    names_size = 0
+    previous_name = b''
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(binary_file))) as tmp_dir:
+        sections = {section: open(os.path.join(tmp_dir, section), 'w+b')
+                    for section in ['ids', 'sizes', 'md5s', 'crc32cs', 'flags', 'restarts', 'names']}
+        try:
+            ids, sizes, crc32cs, restarts = array.array('Q'), array.array('Q'), array.array('I'), array.array('Q')
+            md5s, flags, names = bytearray(), bytearray(), bytearray()
+
+            def flush():
+                for section, buffer in [('ids', ids), ('sizes', sizes), ('crc32cs', crc32cs), ('restarts', restarts),
+                                        ('md5s', md5s), ('flags', flags), ('names', names)]:
+                    sections[section].write(buffer)
+                    del buffer[:]
+
+            for entry in read_index(index_file):
+                name = entry.name.encode('utf-8')
+                if count and name <= previous_name:
+                    raise RuntimeError(f"Index is not sorted by name at {entry.name} in: {index_file}.")
+                if count % restart_interval == 0:
+                    restarts.append(names_size)
+                    shared = 0
+                else:
+                    shared = common_prefix_length(previous_name, name)
+                encoded = encode_varint(shared) + encode_varint(len(name) - shared) + name[shared:]
+                names += encoded
+                names_size += len(encoded)
+                previous_name = name
+                ids.append(int(entry.blob_id))
+                sizes.append(int(entry.size))
+                md5s += bytes.fromhex(entry.md5) if entry.md5 else bytes(16)
+                crc32cs.append(int(entry.crc32c, 16) if entry.crc32c else 0)
+                flags.append((MD5_KNOWN if entry.md5 else 0) | (CRC32C_KNOWN if entry.crc32c else 0))
+                count += 1
+                if len(ids) == CONVERT_BUFFER_ROWS:
+                    flush()
+            flush()
+            with open(binary_file + '.tmp', 'wb') as out:
+                out.write(b'\0' * HEADER.size)
+                offsets = [copy_section(out, sections[section])
+                           for section in ['ids', 'sizes', 'md5s', 'crc32cs', 'flags', 'restarts', 'names']]
+                out.seek(0)
+                out.write(HEADER.pack(MAGIC, VERSION, restart_interval, count, *offsets, names_size))
+            os.replace(binary_file + '.tmp', binary_file)
+        finally:
+            for section_file in sections.values():
+                section_file.close()
+
+
+########
+# Reading
+####
+
+
+def is_binary_index(index_file: str) -> bool:
+    with open(index_file, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class BinaryIndex:
+    """
+    A memory-mapped binary index. Entries are addressed by their position in name order, and the `ids` and `sizes`
+    arrays are zero-copy views of the file.
+    """
+    def __init__(self, binary_file: str):
+        if sys.byteorder != 'little':
+            raise RuntimeError("The binary index format can only be memory-mapped on little-endian machines.")
+        with open(binary_file, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.restart_interval, self.count, ids_offset, sizes_offset, md5s_offset, crc32cs_offset,
+         flags_offset, restarts_offset, names_offset, names_size) = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f"Not a binary index: {binary_file}.")
+        if version != VERSION:
+            raise ValueError(f"Unsupported binary index version {version} in: {binary_file}.")
+        self.view = view = memoryview(self.mmap)
+        n = self.count
+        restart_count = -(-n // self.restart_interval)
+        self.ids = view[ids_offset:ids_offset + 8 * n].cast('Q')
+        self.sizes = view[sizes_offset:sizes_offset + 8 * n].cast('Q')
+        self.md5s = view[md5s_offset:md5s_offset + 16 * n]
+        self.crc32cs = view[crc32cs_offset:crc32cs_offset + 4 * n].cast('I')
+        self.flags = view[flags_offset:flags_offset + n]
+        self.restarts = view[restarts_offset:restarts_offset + 8 * restart_count].cast('Q')
+        self.names = view[names_offset:names_offset + names_size]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self):
+        for view in [self.ids, self.sizes, self.md5s, self.crc32cs, self.flags, self.restarts, self.names, self.view]:
+            view.release()
+        self.mmap.close()
+
+    def __enter__(self) -> 'BinaryIndex':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def iter_raw_names(self, start: int=0, stop: Optional[int]=None) -> Iterator[bytes]:
+        """
+        Decodes the UTF-8 names of the entries from position `start` up to (but not including) `stop`, in order.
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        if start >= stop:
+            return
+        block_start = start - start % self.restart_interval
+        names = self.names
+        pos = self.restarts[block_start // self.restart_interval]
+        name = b''
+        for i in range(block_start, stop):
+            shared, pos = decode_varint(names, pos)
+            length, pos = decode_varint(names, pos)
+            name = name[:shared] + names[pos:pos + length].tobytes()
+            pos += length
+            if i >= start:
+                yield name
+
+    def raw_name(self, i: int) -> bytes:
+        return next(self.iter_raw_names(i, i + 1))
+
+    def name(self, i: int) -> str:
+        return self.raw_name(i).decode('utf-8')
+
+    def make_entry(self, i: int, raw_name: bytes) -> IndexEntry:
+        flags = self.flags[i]
+        md5 = self.md5s[16 * i:16 * i + 16].hex() if flags & MD5_KNOWN else None
+        crc32c = f"{self.crc32cs[i]:08x}" if flags & CRC32C_KNOWN else None
+        return IndexEntry(str(self.ids[i]), raw_name.decode('utf-8'), str(self.sizes[i]), md5, crc32c)
+
+    def entry(self, i: int) -> IndexEntry:
+        return self.make_entry(i, self.raw_name(i))
+
+    def __iter__(self) -> Iterator[IndexEntry]:
+        for i, raw_name in enumerate(self.iter_raw_names()):
+            yield self.make_entry(i, raw_name)
+
+    def bisect_left(self, name: str) -> int:
+        """
+        :param name: a name to search for
+        :return: the position of the first entry whose name is not less than `name`
+        """
+        key = name.encode('utf-8')
+        # Binary search over the full names at the start of each block, then scan the block.
+        lo, hi = 0, len(self.restarts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.raw_name(mid * self.restart_interval) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = max(lo - 1, 0) * self.restart_interval
+        for i, raw_name in enumerate(self.iter_raw_names(start, lo * self.restart_interval), start=start):
+            if raw_name >= key:
+                return i
+        return min(lo * self.restart_interval, self.count)
+
+    def find(self, name: str) -> Optional[int]:
+        """
+        :param name: a blob name
+        :return: the position of the entry with that name, or `None` if there is none
+        """
+        i = self.bisect_left(name)
+        if i < self.count and self.raw_name(i) == name.encode('utf-8'):
+            return i
+        return None
+
+    def lookup(self, name: str) -> Optional[IndexEntry]:
+        i = self.find(name)
+        return None if i is None else self.entry(i)
+
+    def prefix_range(self, prefix: str) -> Tuple[int, int]:
+        """
+        :param prefix: a prefix of blob names
+        :return: the range of positions of the entries whose names start with `prefix`
+        """
+        start = self.bisect_left(prefix)
+        key = prefix.encode('utf-8')
+        # The matching names are contiguous, so bisect for the first one after `start` that does not match.
+        lo, hi = start, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.raw_name(mid).startswith(key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('index_file', nargs='?', default=INDEX_FILE)
+    parser.add_argument('binary_file', nargs='?', default=INDEX_FILE + '.bin')
+    parser.add_argument('--restart-interval', type=int, default=RESTART_INTERVAL)
+    args = parser.parse_args()
+
+    convert_index(args.index_file, args.binary_file, args.restart_interval)
@@ -1,46 +1,395 @@
 #!/usr/bin/env python3
 
-from os.path import isfile
-from google.cloud import storage
+import base64
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import shutil
+
+from concurrent.futures import ThreadPoolExecutor
+from iterate_index import IndexEntry, format_index_row, read_index
+from os.path import isdir, isfile, join
+from typing import TYPE_CHECKING, Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    from google.cloud import storage
 
 MAVEN_BUCKET = 'maven-central'
+# The number of blobs requested per page of the listing. Each shard's progress is checkpointed after every page.
+PAGE_SIZE = 1000
+WORK_DIR_SUFFIX = '.shards'
+PLAN_FILE = 'plan.json'
+ADDED_FILE = 'added.tsv'
+REMOVED_FILE = 'removed.tsv'
+CHANGED_FILE = 'changed.tsv'
+
+
+########
+# Types
+####
+
 
+class BlobInfo(NamedTuple):
+    name: str
+    size: int
+    md5: str
+    crc32c: str
 
-def get_maven_bucket(auth_file: str) -> storage.Bucket:
+
+class Page(NamedTuple):
+    blobs: List[BlobInfo]
+    prefixes: List[str]
+    next_page_token: Optional[str]
+
+
+class Shard(NamedTuple):
+    """
+    A part of the bucket to list: every blob whose name starts with `prefix`, or, if `direct` is set, only those with no
+    further `/` after the prefix.
+    """
+    prefix: str
+    direct: bool
+
+
+########
+# Storage backends
+####
+
+
+def get_maven_bucket(auth_file: str) -> 'storage.Bucket':
     """
     Obtains a connection to the Maven bucket on Google Storage.
 
     :param auth_file: a `.json` file containing the Google Storage authentication
     :return: a Bucket object
     """
+    # Imported here so that the local stand-in can be used without the Google Storage library installed.
+    from google.cloud import storage
     client = storage.Client.from_service_account_json(auth_file)
     return client.get_bucket(MAVEN_BUCKET)
 
 
-def index_blobs(auth_file: str, index_file: str, max_results: int=None):
+def base64_to_hex(value: Optional[str]) -> str:
     """
-    Iterates through up to `max_results` blobs in the Maven bucket and writes their information to file.
+    Converts a base64-encoded checksum, as reported by Google Storage, into the hexadecimal form used by Maven's `.md5`
+    files.
 
-    :param auth_file: a `.json` file containing the Google Storage authentication
+    :param value: the base64-encoded checksum, or `None` if the object does not have one
+    :return: the hexadecimal checksum, or an empty string if there was none
+    """
+    if not value:
+        return ''
+    return base64.b64decode(value).hex()
+
+
+class GcsBucket:
+    """
+    Lists the Maven bucket on Google Storage.
+    """
+    def __init__(self, auth_file: str):
+        self.bucket = get_maven_bucket(auth_file)
+
+    def list_page(self, prefix: str, delimiter: Optional[str], page_token: Optional[str]) -> Page:
+        iterator = self.bucket.list_blobs(prefix=prefix, delimiter=delimiter, page_token=page_token,
+                                          page_size=PAGE_SIZE)
+        page = next(iterator.pages)
+        blobs = [BlobInfo(blob.name, blob.size, base64_to_hex(blob.md5_hash), base64_to_hex(blob.crc32c))
+                 for blob in page]
+        return Page(blobs, sorted(page.prefixes), iterator.next_page_token)
+
+
+class LocalBucket:
+    """
+    A stand-in for the Maven bucket, backed by a local directory, for testing. Blob names are file paths relative to the
+    directory. The md5 sums are computed from the files, but no crc32c checksums are given.
+    """
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        names = []
+        for dir_path, _, file_names in os.walk(root_dir):
+            rel_dir = os.path.relpath(dir_path, root_dir)
+            for file_name in file_names:
+                names.append(file_name if rel_dir == '.' else f"{rel_dir}/{file_name}".replace(os.sep, '/'))
+        self.names = sorted(names)
+
+    def list_page(self, prefix: str, delimiter: Optional[str], page_token: Optional[str]) -> Page:
+        if page_token is None:
+            start = bisect.bisect_left(self.names, prefix)
+        else:
+            start = bisect.bisect_right(self.names, page_token)
+        blobs = []
+        prefixes = set()
+        for name in itertools.takewhile(lambda name: name.startswith(prefix), self.names[start:]):
+            remainder = name[len(prefix):]
+            if delimiter is not None and delimiter in remainder:
+                prefixes.add(prefix + remainder[:remainder.index(delimiter) + 1])
+                continue
+            if len(blobs) == PAGE_SIZE:
+                return Page(blobs, sorted(prefixes), blobs[-1].name)
+            path = join(self.root_dir, name)
+            with open(path, 'rb') as f:
+                md5 = hashlib.md5(f.read()).hexdigest()
+            blobs.append(BlobInfo(name, os.path.getsize(path), md5, ''))
+        return Page(blobs, sorted(prefixes), None)
+
+
+def get_bucket_factory(source: str) -> Callable[[], object]:
+    """
+    :param source: a local directory to use as a stand-in for the bucket, or else a `.json` file containing the Google
+                   Storage authentication
+    :return: a function that opens a new connection to the bucket, with a `list_page` method like `GcsBucket`
+    """
+    if isdir(source):
+        bucket = LocalBucket(source)
+        return lambda: bucket
+    return lambda: GcsBucket(source)
+
+
+########
+# Listing shards
+####
+
+
+def list_all_pages(bucket, prefix: str, delimiter: Optional[str]) -> Iterator[Page]:
+    page_token = None
+    while True:
+        page = bucket.list_page(prefix, delimiter, page_token)
+        yield page
+        page_token = page.next_page_token
+        if page_token is None:
+            return
+
+
+def plan_shards(bucket, prefix: str, depth: int) -> List[Shard]:
+    """
+    Splits the part of the bucket under `prefix` into shards by descending `depth` levels of `/`-separated directories.
+    Each directory at that depth becomes a shard, as do the blobs directly inside each directory above it.
+
+    :param bucket: a connection to the bucket
+    :param prefix: the prefix of the blob names to list
+    :param depth: how many levels of directories to split the listing by
+    :return: the shards, which together cover every blob under `prefix` exactly once
+    """
+    if depth == 0:
+        return [Shard(prefix, False)]
+    shards = [Shard(prefix, True)]
+    for page in list_all_pages(bucket, prefix, '/'):
+        for sub_prefix in page.prefixes:
+            shards.extend(plan_shards(bucket, sub_prefix, depth - 1))
+    return shards
+
+
+def write_checkpoint(checkpoint_file: str, offset: int, count: int, page_token: Optional[str], done: bool):
+    tmp_file = checkpoint_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'offset': offset, 'count': count, 'page_token': page_token, 'done': done}, f)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def list_shard(bucket_factory: Callable[[], object], shard: Shard, shard_file: str, max_results: Optional[int]=None):
+    """
+    Lists one shard into `shard_file`, one `name\\tsize\\tmd5\\tcrc32c` line per blob, in the bucket's (sorted) order.
+
+    After every page, the file is flushed to disk and a checkpoint recording its length, the number of blobs listed so
+    far, and the next page token is saved next to it. If a checkpoint already exists, the listing resumes from it,
+    discarding anything written after it.
+
+    :param bucket_factory: a function that opens a new connection to the bucket
+    :param shard: the shard to list
+    :param shard_file: the file to write the shard's blobs to
+    :param max_results: the maximum number of blobs to list, or `None` to list them all
+    """
+    checkpoint_file = shard_file + '.checkpoint'
+    offset = 0
+    count = 0
+    page_token = None
+    if isfile(checkpoint_file):
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+        if checkpoint['done']:
+            return
+        offset = checkpoint['offset']
+        count = checkpoint['count']
+        page_token = checkpoint['page_token']
+    bucket = bucket_factory()
+    delimiter = '/' if shard.direct else None
+    with open(shard_file, 'a+') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        while True:
+            page = bucket.list_page(shard.prefix, delimiter, page_token)
+            for blob in page.blobs:
+                if max_results is not None and count == max_results:
+                    break
+                count += 1
+                f.write(f"{blob.name}\t{blob.size}\t{blob.md5}\t{blob.crc32c}\n")
+            f.flush()
+            os.fsync(f.fileno())
+            page_token = page.next_page_token
+            done = page_token is None or (max_results is not None and count == max_results)
+            write_checkpoint(checkpoint_file, f.tell(), count, page_token, done)
+            if done:
+                return
+
+
+def read_shard(shard_file: str) -> Iterator[Tuple[str, str]]:
+    with open(shard_file) as f:
+        for line in f:
+            yield line.split('\t', 1)[0], line
+
+
+def merge_shards(shard_files: List[str], index_file: str):
+    """
+    Merges the sorted shard files into a single index, numbering the blobs in name order. Since the bucket lists blobs
+    in name order, the numbering is the same as that of a single serial listing.
+
+    :param shard_files: the files written by `list_shard`
+    :param index_file: the index file to write
+    """
+    tmp_file = index_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        merged = heapq.merge(*map(read_shard, shard_files), key=lambda item: item[0])
+        for blob_no, (_, line) in enumerate(merged, start=1):
+            f.write(f"{blob_no}\t{line}")
+    os.replace(tmp_file, index_file)
+
+
+########
+# Diffing snapshots
+####
+
+
+def read_sorted_index(index_file: str) -> Iterator[IndexEntry]:
+    previous_name = None
+    for entry in read_index(index_file):
+        if previous_name is not None and entry.name <= previous_name:
+            raise RuntimeError(f"Index is not sorted by name at {entry.name} in: {index_file}.")
+        previous_name = entry.name
+        yield entry
+
+
+def is_changed(old: IndexEntry, new: IndexEntry) -> bool:
+    if old.size != new.size:
+        return True
+    # Older indexes do not have checksums, so they can only be compared when both snapshots have them.
+    return old.md5 is not None and new.md5 is not None and old.md5 != new.md5
+
+
+def diff_indexes(old_index_file: str, new_index_file: str, delta_dir: str):
+    """
+    Compares two snapshots of the index and writes the differences into three files in `delta_dir`, each in the index
+    format: `added.tsv` holds blobs only in the new snapshot, `removed.tsv` those only in the old one, and `changed.tsv`
+    those whose size or md5 sum changed. Added and changed blobs are written as they are in the new snapshot, so those
+    files can be used directly as work lists for `download_blobs.py` and the other tools.
+
+    Both snapshots are streamed through a sorted merge (the index is sorted by name), so neither is loaded into memory.
+
+    :param old_index_file: the previous snapshot of the index
+    :param new_index_file: the current snapshot of the index
+    :param delta_dir: the directory to write the differences into
+    """
+    os.makedirs(delta_dir, exist_ok=True)
+    old_it = read_sorted_index(old_index_file)
+    new_it = read_sorted_index(new_index_file)
+    old = next(old_it, None)
+    new = next(new_it, None)
+    with open(join(delta_dir, ADDED_FILE), 'w') as added, open(join(delta_dir, REMOVED_FILE), 'w') as removed, \
+            open(join(delta_dir, CHANGED_FILE), 'w') as changed:
+        while old is not None or new is not None:
+            if new is None or (old is not None and old.name < new.name):
+                removed.write(format_index_row(old))
+                old = next(old_it, None)
+            elif old is None or new.name < old.name:
+                added.write(format_index_row(new))
+                new = next(new_it, None)
+            else:
+                if is_changed(old, new):
+                    changed.write(format_index_row(new))
+                old = next(old_it, None)
+                new = next(new_it, None)
+
+
+########
+# Primary implementation
+####
+
+
+def index_blobs(source: str, index_file: str, max_results: int=None, jobs: int=1, shard_depth: int=0,
+                prefix: str=''):
+    """
+    Iterates through up to `max_results` blobs in the Maven bucket and writes their information to file. Each line holds
+    the blob's number, name, size, md5 sum, and crc32c checksum, separated by tabs. The checksums are written in
+    hexadecimal and are left empty for objects that do not have them (such as composite objects, which have no md5).
+
+    The listing is split into shards by name prefix (see `plan_shards`), which are listed by `jobs` concurrent workers.
+    The shards are kept in a work directory next to the index while the listing runs, and each checkpoints its
+    progress, so an interrupted run picks up where it left off when it is started again. Once every shard is listed,
+    they are merged into the index and the work directory is removed.
+
+    :param source: a `.json` file containing the Google Storage authentication, or a local directory to use instead
     :param index_file: the file name to write the output to
-    :param max_results: maximum number of blobs to index; give `None` to index all blobs
+    :param max_results: maximum number of blobs to index; give `None` to index all blobs (requires a single shard)
+    :param jobs: the number of shards to list concurrently
+    :param shard_depth: how many levels of directories to split the listing by
+    :param prefix: only index blobs whose names start with this prefix
     """
     if isfile(index_file):
         raise RuntimeError(f"Index file already exists at: {index_file}.")
-    bucket = get_maven_bucket(auth_file)
-    blob_no = 0
-    with open(index_file, 'w') as f:
-        for blob in bucket.list_blobs(max_results=max_results):
-            blob_no += 1
-            f.write(f"{blob_no}\t{blob.name}\t{blob.size}\n")
+    if max_results is not None and shard_depth != 0:
+        raise ValueError("A maximum number of results can only be given when the listing is not sharded.")
+    bucket_factory = get_bucket_factory(source)
+    work_dir = index_file + WORK_DIR_SUFFIX
+    plan_file = join(work_dir, PLAN_FILE)
+    # The plan is saved so that a resumed run uses the same shards as the original run.
+    if isfile(plan_file):
+        with open(plan_file) as f:
+            shards = [Shard(*shard) for shard in json.load(f)]
+    else:
+        os.makedirs(work_dir, exist_ok=True)
+        shards = plan_shards(bucket_factory(), prefix, shard_depth)
+        with open(plan_file + '.tmp', 'w') as f:
+            json.dump(shards, f)
+        os.replace(plan_file + '.tmp', plan_file)
+    shard_files = [join(work_dir, f"shard-{shard_no}.tsv") for shard_no in range(len(shards))]
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = [executor.submit(list_shard, bucket_factory, shard, shard_file, max_results)
+                   for shard, shard_file in zip(shards, shard_files)]
+        for future in futures:
+            future.result()
+    merge_shards(shard_files, index_file)
+    shutil.rmtree(work_dir)
 
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('auth_file')
-    parser.add_argument('index_file', nargs='?', default='index.tsv')
+    parser.add_argument('auth_file', nargs='?', default=None,
+                        help="The GCS authentication file, or a local directory to list instead. It is not needed with "
+                             "--diff-only, in which case the only positional argument is the index file.")
+    parser.add_argument('index_file', nargs='?', default=None)
     parser.add_argument('--max-results', type=int, default=None)
+    parser.add_argument('--jobs', '-j', type=int, default=1)
+    parser.add_argument('--shard-depth', type=int, default=0)
+    parser.add_argument('--prefix', default='')
+    parser.add_argument('--previous-index', default=None)
+    parser.add_argument('--delta-dir', default='delta')
+    parser.add_argument('--diff-only', action='store_true')
     args = parser.parse_args()
+    if args.diff_only:
+        # Diffing two local snapshots needs no credentials.
+        if args.index_file is None:
+            args.index_file = args.auth_file
+        if args.previous_index is None:
+            parser.error("--diff-only requires --previous-index")
+    elif args.auth_file is None:
+        parser.error("the auth_file argument is required unless --diff-only is given")
+    if args.index_file is None:
+        args.index_file = 'index.tsv'
 
-    index_blobs(args.auth_file, args.index_file, args.max_results)
+    if not args.diff_only:
+        index_blobs(args.auth_file, args.index_file, args.max_results, args.jobs, args.shard_depth, args.prefix)
+    if args.previous_index is not None:
+        diff_indexes(args.previous_index, args.index_file, args.delta_dir)
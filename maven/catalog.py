@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Loads the index built with `build_index.py` into an SQLite catalog, so that questions about the repository can be asked
+in SQL instead of with a custom loop over the index. Each blob's path is split into its Maven coordinates, following
+the repository layout:
+
+    group/id/parts/artifactId/version/artifactId-version[-classifier].extension
+
+The catalog has a single `blobs` table with the columns `name`, `blob_no`, `size`, `md5`, `crc32c`, `group_id` (with
+dots, as in a POM), `artifact_id`, `version`, `classifier`, and `extension` (everything after the first dot following
+the version, such as `jar` or `jar.sha1`). The coordinates that do not apply to a blob are `NULL`: the artifact-level
+`maven-metadata.xml` files have no version, and files outside the layout have only an extension.
+
+Re-running the load with a newer index updates the catalog in place. The index and the catalog are both read in order
+of name and merged, and only the rows that were added, changed, or removed are written, so re-running the load on an
+unchanged index writes nothing. Alternatively, the differences that `build_index.py` writes to its `--delta-dir` can be
+applied directly, without reading either the index or the catalog. Since blob numbers are positions in the index, the
+blobs that did not change then keep their numbers from the index they were loaded from.
+"""
+
+import re
+import sqlite3
+import sys
+
+from build_index import ADDED_FILE, CHANGED_FILE, REMOVED_FILE, read_sorted_index
+from download_blobs import eshow
+from iterate_index import INDEX_FILE, IndexEntry, read_index
+from os.path import join
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+
+CATALOG_FILE = 'catalog.sqlite'
+DATA_PREFIX = 'repos/central/data/'
+METADATA_FILE = 'maven-metadata.xml'
+SNAPSHOT_SUFFIX = '-SNAPSHOT'
+# Snapshot files replace `SNAPSHOT` in the version with a timestamp and build number.
+SNAPSHOT_TIMESTAMP = re.compile(r'\d{8}\.\d{6}-\d+')
+INSERT_BATCH_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    name TEXT PRIMARY KEY,
+    blob_no INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    md5 TEXT,
+    crc32c TEXT,
+    group_id TEXT,
+    artifact_id TEXT,
+    version TEXT,
+    classifier TEXT,
+    extension TEXT
+) WITHOUT ROWID;
+"""
+
+# Created after the first load rather than before it, since building them once is much faster than updating them for
+# every row.
+INDEXES = """
+CREATE INDEX IF NOT EXISTS blobs_coordinates ON blobs (group_id, artifact_id, version);
+CREATE INDEX IF NOT EXISTS blobs_artifact_id ON blobs (artifact_id);
+CREATE INDEX IF NOT EXISTS blobs_extension ON blobs (extension, classifier);
+CREATE INDEX IF NOT EXISTS blobs_size ON blobs (size);
+"""
+
+# The columns that come from the index as they are. The rest are derived from the name, so they never change.
+INDEX_COLUMNS = ['name', 'blob_no', 'size', 'md5', 'crc32c']
+
+UPSERT = """
+INSERT INTO blobs (name, blob_no, size, md5, crc32c, group_id, artifact_id, version, classifier, extension)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (name) DO UPDATE SET
+    blob_no = excluded.blob_no,
+    size = excluded.size,
+    md5 = excluded.md5,
+    crc32c = excluded.crc32c
+"""
+UPDATE = 'UPDATE blobs SET blob_no = ?, size = ?, md5 = ?, crc32c = ? WHERE name = ?'
+DELETE = 'DELETE FROM blobs WHERE name = ?'
+SELECT_INDEX_COLUMNS = f"SELECT {', '.join(INDEX_COLUMNS)} FROM blobs ORDER BY name"
+
+LARGEST_GROUPS = """
+SELECT group_id, COUNT(*), SUM(size)
+FROM blobs
+WHERE group_id IS NOT NULL
+GROUP BY group_id
+ORDER BY SUM(size) DESC
+LIMIT ?
+"""
+
+NO_SOURCES = """
+SELECT DISTINCT group_id, artifact_id, version
+FROM blobs AS b
+WHERE extension = 'jar' AND classifier IS NULL AND NOT EXISTS (
+    SELECT 1
+    FROM blobs AS s
+    WHERE s.group_id = b.group_id AND s.artifact_id = b.artifact_id AND s.version = b.version
+      AND s.extension = 'jar' AND s.classifier = 'sources'
+)
+ORDER BY group_id, artifact_id, version
+"""
+
+
+class Coordinates(NamedTuple):
+    group_id: Optional[str] = None
+    artifact_id: Optional[str] = None
+    version: Optional[str] = None
+    classifier: Optional[str] = None
+    extension: Optional[str] = None
+
+
+def split_extension(file_name: str) -> Optional[str]:
+    _, dot, extension = file_name.partition('.')
+    return extension if dot else None
+
+
+def match_version_prefix(file_name: str, artifact_id: str, version: str) -> Optional[int]:
+    """
+    Checks whether a file name starts with `artifactId-version`, allowing for the timestamped versions of snapshots.
+
+    :param file_name: the name of the file, without its directory
+    :param artifact_id: the artifactId of the directory the file is in
+    :param version: the version of the directory the file is in
+    :return: the length of the matching prefix, or `None` if the file name does not match
+    """
+    prefix = f"{artifact_id}-{version}"
+    if file_name.startswith(prefix):
+        return len(prefix)
+    if version.endswith(SNAPSHOT_SUFFIX):
+        prefix = f"{artifact_id}-{version[:-len(SNAPSHOT_SUFFIX)]}-"
+        if file_name.startswith(prefix):
+            match = SNAPSHOT_TIMESTAMP.match(file_name, len(prefix))
+            if match:
+                return match.end()
+    return None
+
+
+def decompose(name: str) -> Coordinates:
+    """
+    Splits a blob's path into its Maven coordinates. See the module documentation for details.
+
+    :param name: the name of the blob
+    :return: the coordinates of the blob, with `None` for those that do not apply
+    """
+    if name.startswith(DATA_PREFIX):
+        name = name[len(DATA_PREFIX):]
+    parts = name.split('/')
+    file_name = parts[-1]
+    if file_name.startswith(METADATA_FILE) and len(parts) >= 3:
+        # Metadata is usually artifact-level (`group/artifact/`), except in the directories of snapshot versions.
+        extension = split_extension(file_name)
+        if len(parts) >= 4 and parts[-2].endswith(SNAPSHOT_SUFFIX):
+            return Coordinates('.'.join(parts[:-3]), parts[-3], parts[-2], None, extension)
+        return Coordinates('.'.join(parts[:-2]), parts[-2], None, None, extension)
+    if len(parts) >= 4:
+        artifact_id, version = parts[-3], parts[-2]
+        end = match_version_prefix(file_name, artifact_id, version)
+        if end is not None and end < len(file_name) and file_name[end] in '-.':
+            rest = file_name[end:]
+            if rest.startswith('-'):
+                classifier, dot, extension = rest[1:].partition('.')
+                if not dot:
+                    extension = None
+            else:
+                classifier, extension = None, rest[1:]
+            return Coordinates('.'.join(parts[:-3]), artifact_id, version, classifier or None, extension or None)
+    return Coordinates(extension=split_extension(file_name))
+
+
+def make_row(entry: IndexEntry) -> Tuple:
+    return (entry.name, int(entry.blob_id), int(entry.size), entry.md5, entry.crc32c, *decompose(entry.name))
+
+
+def index_columns(entry: IndexEntry) -> Tuple:
+    return entry.name, int(entry.blob_id), int(entry.size), entry.md5, entry.crc32c
+
+
+def diff_catalog(index_file: str, rows: Iterator[Tuple]) -> Iterator[Tuple[str, Tuple]]:
+    """
+    Compares an index with the rows of the catalog, both in order of name, in a single merge.
+
+    :param index_file: the index, which must be sorted by name
+    :param rows: the `INDEX_COLUMNS` of the catalog's rows, in order of name
+    :return: an iterator over the statements needed to update the catalog to match the index, as `UPSERT` with a new
+             row, `UPDATE` with the changed columns, or `DELETE` with the name
+    """
+    entries = read_sorted_index(index_file)
+    entry = next(entries, None)
+    row = next(rows, None)
+    while entry is not None or row is not None:
+        if entry is None or (row is not None and row[0] < entry.name):
+            yield DELETE, (row[0],)
+            row = next(rows, None)
+        elif row is None or entry.name < row[0]:
+            yield UPSERT, make_row(entry)
+            entry = next(entries, None)
+        else:
+            columns = index_columns(entry)
+            if columns != tuple(row):
+                yield UPDATE, (*columns[1:], entry.name)
+            entry = next(entries, None)
+            row = next(rows, None)
+
+
+def read_delta(delta_dir: str) -> Iterator[Tuple[str, Tuple]]:
+    """
+    :param delta_dir: the differences between two snapshots of the index, as written by `build_index.py`
+    :return: an iterator over the statements that apply the differences to a catalog of the older snapshot
+    """
+    for entry in read_index(join(delta_dir, REMOVED_FILE)):
+        yield DELETE, (entry.name,)
+    for delta_file in [ADDED_FILE, CHANGED_FILE]:
+        for entry in read_index(join(delta_dir, delta_file)):
+            yield UPSERT, make_row(entry)
+
+
+def execute_batched(connection: sqlite3.Connection, statements: Iterable[Tuple[str, Tuple]]) -> Dict[str, int]:
+    """
+    Executes statements in batches of each kind. The statements must not depend on each other's order.
+
+    :return: the number of statements of each kind that were executed
+    """
+    batches: Dict[str, List[Tuple]] = {UPSERT: [], UPDATE: [], DELETE: []}
+    counts = dict.fromkeys(batches, 0)
+    for statement, parameters in statements:
+        batch = batches[statement]
+        batch.append(parameters)
+        if len(batch) == INSERT_BATCH_SIZE:
+            connection.executemany(statement, batch)
+            counts[statement] += len(batch)
+            batch.clear()
+    for statement, batch in batches.items():
+        connection.executemany(statement, batch)
+        counts[statement] += len(batch)
+    return counts
+
+
+def connect(catalog_file: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(catalog_file, isolation_level=None)
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def update_catalog(catalog_file: str, statements: Callable[[sqlite3.Connection], Iterable[Tuple[str, Tuple]]]):
+    """
+    Applies changes to the catalog in a single transaction, then indexes it if it was empty, and reports the changes.
+
+    :param catalog_file: the SQLite catalog to create or update
+    :param statements: a function of a connection to the catalog, returning the statements to apply
+    """
+    connection = connect(catalog_file)
+    try:
+        # The catalog can be rebuilt from the index, so durability is traded for a faster load.
+        connection.execute('PRAGMA synchronous = OFF')
+        empty = connection.execute('SELECT 1 FROM blobs LIMIT 1').fetchone() is None
+        connection.execute('BEGIN')
+        counts = execute_batched(connection, statements(connection))
+        connection.execute('COMMIT')
+        connection.executescript(INDEXES)
+        if empty:
+            connection.execute('ANALYZE')
+        else:
+            # Only gathers statistics again if the changes were large enough to matter.
+            connection.execute('PRAGMA optimize')
+        total = connection.execute('SELECT COUNT(*) FROM blobs').fetchone()[0]
+        eshow(f"Catalog has {total} blobs: {counts[UPSERT]} added or replaced, {counts[UPDATE]} updated, "
+              f"{counts[DELETE]} removed.")
+    finally:
+        connection.close()
+
+
+def build_catalog(index_file: str, catalog_file: str):
+    """
+    Loads an index into the catalog, or updates the catalog to match a newer index, writing only the rows that differ.
+
+    :param index_file: the index built with `build_index.py`, in any of the forms accepted by `read_index`, which
+                       must be sorted by name
+    :param catalog_file: the SQLite catalog to create or update
+    """
+    def statements(connection: sqlite3.Connection) -> Iterator[Tuple[str, Tuple]]:
+        # The catalog is read through a second connection, which keeps seeing the catalog as it was before the changes
+        # (SQLite's ordering of text is by UTF-8 bytes, which is the same as Python's ordering of strings).
+        reader = sqlite3.connect(catalog_file, isolation_level=None)
+        try:
+            reader.execute('BEGIN')
+            yield from diff_catalog(index_file, iter(reader.execute(SELECT_INDEX_COLUMNS)))
+            reader.execute('COMMIT')
+        finally:
+            reader.close()
+
+    update_catalog(catalog_file, statements)
+
+
+def apply_delta(delta_dir: str, catalog_file: str):
+    """
+    Updates the catalog with the differences between two snapshots of the index, as written by `build_index.py` with
+    `--delta-dir`, rather than with the whole of the newer snapshot.
+
+    :param delta_dir: the directory holding `added.tsv`, `removed.tsv`, and `changed.tsv`
+    :param catalog_file: the SQLite catalog of the older snapshot
+    """
+    update_catalog(catalog_file, lambda connection: read_delta(delta_dir))
+
+
+def show_rows(rows: Iterator[Tuple]):
+    for row in rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+
+
+def run_query(catalog_file: str, query: str, parameters: Tuple=()):
+    connection = connect(catalog_file)
+    try:
+        show_rows(connection.execute(query, parameters))
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--catalog-file', '-c', default=CATALOG_FILE)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    build_parser = subparsers.add_parser('build', help="Load or update the catalog from an index.")
+    build_parser.add_argument('index_file', nargs='?', default=INDEX_FILE)
+    update_parser = subparsers.add_parser('update', help="Update the catalog with the differences written by "
+                                                         "`build_index.py --delta-dir`.")
+    update_parser.add_argument('delta_dir')
+    sql_parser = subparsers.add_parser('sql', help="Run an SQL query and print the results as TSV.")
+    sql_parser.add_argument('query')
+    largest_groups_parser = subparsers.add_parser('largest-groups', help="List the groups with the most bytes.")
+    largest_groups_parser.add_argument('--limit', '-n', type=int, default=20)
+    subparsers.add_parser('no-sources', help="List the versions that have a jar but no sources jar.")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'build':
+            build_catalog(args.index_file, args.catalog_file)
+        elif args.command == 'update':
+            apply_delta(args.delta_dir, args.catalog_file)
+        elif args.command == 'sql':
+            run_query(args.catalog_file, args.query)
+        elif args.command == 'largest-groups':
+            run_query(args.catalog_file, LARGEST_GROUPS, (args.limit,))
+        elif args.command == 'no-sources':
+            run_query(args.catalog_file, NO_SOURCES)
+    except sqlite3.Error as e:
+        eshow(f"SQLite error: {e}")
+        sys.exit(1)
@@ -1,48 +1,24 @@
 #!/usr/bin/env python3
 
+import sys
+
+from merge_join import merge_join, read_keys
+
 
 def check_basenames(all_files_file: str, basenames_file: str):
-    af = open(all_files_file)
-    bf = open(basenames_file)
-
-    a_line = ''
-    b_line = ''
-
-    def adv_a():
-        nonlocal a_line
-        a_line = af.readline()
-
-    def adv_b():
-        nonlocal b_line
-        b_line = bf.readline()
-
-    adv_a()
-    adv_b()
-
-    while True:
-        if a_line == '':
-            # We've reached the end of the all-names file. Print the remainder of the basenames.
-            while b_line != '':
-                print(b_line.rstrip())
-                adv_b()
-            # And quit.
-            break
-        elif b_line == '':
-            # We've reached the end of the basenames file, so we're done.
-            break
-        elif a_line == b_line:
-            # The lines match.
-            adv_a()
-            adv_b()
-        elif a_line < b_line:
-            # We haven't found the match yet.
-            adv_a()
-        elif a_line > b_line:
-            # We passed the match --- meaning it doesn't exist.
-            print(b_line.rstrip())
-            adv_b()
-        else:
-            raise RuntimeError
+    """
+    Prints the names in `basenames_file` that are not in `all_files_file`. Both files must be sorted. This is the
+    two-input special case of `merge_join.py`.
+
+    :param all_files_file: the sorted file of all names
+    :param basenames_file: the sorted file of names that are expected to be among them
+    """
+    out = sys.stdout.buffer
+    for key, members in merge_join([read_keys(all_files_file), read_keys(basenames_file)]):
+        if members == 0b10:
+            # The name is only in the basenames file.
+            out.write(key + b'\n')
+    out.flush()
 
 
 if __name__ == '__main__':
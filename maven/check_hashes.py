@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Finds the problems with the checksum and signature files in the Maven repository in a single pass over the index, with
+no intermediate files. This replaces stripping the hash extensions from every name, sorting the result with
+`uniqsemisort.py`, and comparing it against the full listing with `check_basenames.py`.
+
+Every file in the repository may have "sidecar" files next to it, named by appending a suffix to its name: checksums
+(`.md5`, `.sha1`, `.sha256`, `.sha512`) and a signature (`.asc`). Sidecars can have sidecars of their own, as in
+`foo.jar.asc.md5`. Three reports can be written:
+
+* missing-base: the files that have sidecars but do not exist themselves
+* orphan-hashes: the sidecars of those missing files
+* missing-hashes: the sidecars that should exist (by default, `.md5` and `.sha1`) for the files that do exist, other
+  than checksums themselves
+
+Since the index is sorted by name, all of the files whose names start with a given name are next to each other. In
+particular, a file and all of its sidecars (and their sidecars) form one contiguous range. The index is read in order
+while keeping a stack of the "open" files whose ranges contain the current name. When a name is reached that no longer
+starts with the file on top of the stack, that file's range is over and it is reported. The stack is never deeper than
+the number of nested suffixes, so memory use does not depend on the size of the index.
+
+Each file is reported when its range ends, so a file's sidecars are reported before the file itself, and the reports
+are only nearly sorted. Pipe them through `uniqsemisort.py` if sorted output is needed.
+"""
+
+import sys
+
+from download_blobs import MavenIndexingException, eshow
+from iterate_index import INDEX_FILE, iterate_index_batches
+from typing import List, Optional, Set, TextIO
+
+
+HASH_SUFFIXES = ['.md5', '.sha1', '.sha256', '.sha512']
+SIGNATURE_SUFFIX = '.asc'
+SIDECAR_SUFFIXES = HASH_SUFFIXES + [SIGNATURE_SUFFIX]
+REQUIRED_HASH_SUFFIXES = ['.md5', '.sha1']
+
+
+class UnsortedIndexException(MavenIndexingException):
+    def __init__(self, name: str):
+        super().__init__(f"Index is not sorted by name at: {name}.")
+
+
+class OpenFile:
+    """
+    A file whose range of the index has not been passed yet, along with what is known about it so far.
+    """
+    def __init__(self, name: str, exists: bool):
+        self.name = name
+        self.exists = exists
+        self.sidecar_suffixes: Set[str] = set()
+
+
+def split_sidecar(name: str) -> Optional[str]:
+    """
+    :param name: the name of a file
+    :return: the sidecar suffix the name ends with, or `None` if it is not a sidecar
+    """
+    for suffix in SIDECAR_SUFFIXES:
+        if name.endswith(suffix):
+            return suffix
+    return None
+
+
+class HashReport:
+    def __init__(self, required_hash_suffixes: List[str], missing_base: Optional[TextIO],
+                 orphan_hashes: Optional[TextIO], missing_hashes: Optional[TextIO]):
+        self.required_hash_suffixes = required_hash_suffixes
+        self.missing_base = missing_base
+        self.orphan_hashes = orphan_hashes
+        self.missing_hashes = missing_hashes
+        self.missing_base_count = 0
+        self.orphan_hash_count = 0
+        self.missing_hash_count = 0
+
+    def close_file(self, open_file: OpenFile):
+        """
+        Reports a file once every name that could be one of its sidecars has been seen.
+        """
+        if not open_file.exists:
+            self.missing_base_count += 1
+            self.orphan_hash_count += len(open_file.sidecar_suffixes)
+            if self.missing_base is not None:
+                self.missing_base.write(f"{open_file.name}\n")
+            if self.orphan_hashes is not None:
+                for suffix in sorted(open_file.sidecar_suffixes):
+                    self.orphan_hashes.write(f"{open_file.name}{suffix}\n")
+        elif split_sidecar(open_file.name) not in HASH_SUFFIXES:
+            for suffix in self.required_hash_suffixes:
+                if suffix not in open_file.sidecar_suffixes:
+                    self.missing_hash_count += 1
+                    if self.missing_hashes is not None:
+                        self.missing_hashes.write(f"{open_file.name}{suffix}\n")
+
+
+def check_hashes(index_file: str, required_hash_suffixes: List[str], missing_base: Optional[TextIO],
+                 orphan_hashes: Optional[TextIO], missing_hashes: Optional[TextIO]) -> HashReport:
+    """
+    Writes the reports described in the module documentation.
+
+    :param index_file: the index built with `build_index.py`, in any of the forms accepted by `read_index`
+    :param required_hash_suffixes: the suffixes of the checksums every file should have
+    :param missing_base: where to write the names of the files that have sidecars but do not exist, if anywhere
+    :param orphan_hashes: where to write the names of the sidecars of those files, if anywhere
+    :param missing_hashes: where to write the names of the checksums that should exist but do not, if anywhere
+    :return: the report, with its counts
+    """
+    report = HashReport(required_hash_suffixes, missing_base, orphan_hashes, missing_hashes)
+    # Each file on the stack is a prefix of the one above it.
+    stack: List[OpenFile] = []
+    previous = ''
+    for batch in iterate_index_batches(index_file):
+        for name in batch.names:
+            if name <= previous:
+                raise UnsortedIndexException(name)
+            previous = name
+            while stack and not name.startswith(stack[-1].name):
+                report.close_file(stack.pop())
+            suffix = split_sidecar(name)
+            if suffix is None:
+                stack.append(OpenFile(name, True))
+                continue
+            base = name[:-len(suffix)]
+            # The base is a prefix of the name, so it is either on the stack already or belongs at some point in it.
+            i = len(stack)
+            while i > 0 and len(stack[i - 1].name) > len(base):
+                i -= 1
+            if i > 0 and stack[i - 1].name == base:
+                stack[i - 1].sidecar_suffixes.add(suffix)
+            else:
+                # The base file does not exist, since it would have come before its sidecars.
+                base_file = OpenFile(base, False)
+                base_file.sidecar_suffixes.add(suffix)
+                stack.insert(i, base_file)
+            # The sidecar itself may have sidecars.
+            stack.append(OpenFile(name, True))
+    while stack:
+        report.close_file(stack.pop())
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('index_file', nargs='?', default=INDEX_FILE)
+    parser.add_argument('--missing-base', default=None)
+    parser.add_argument('--orphan-hashes', default=None)
+    parser.add_argument('--missing-hashes', default=None)
+    parser.add_argument('--required-hashes', default=','.join(suffix[1:] for suffix in REQUIRED_HASH_SUFFIXES),
+                        help="The comma-separated checksum extensions that every file should have.")
+    args = parser.parse_args()
+
+    outputs = {}
+    try:
+        for report_name in ['missing_base', 'orphan_hashes', 'missing_hashes']:
+            report_file = getattr(args, report_name)
+            if report_file is not None:
+                outputs[report_name] = sys.stdout if report_file == '-' else open(report_file, 'w')
+        required = ['.' + extension for extension in args.required_hashes.split(',') if extension]
+        result = check_hashes(args.index_file, required, outputs.get('missing_base'), outputs.get('orphan_hashes'),
+                              outputs.get('missing_hashes'))
+    finally:
+        for output in outputs.values():
+            if output is not sys.stdout:
+                output.close()
+    eshow(f"{result.missing_base_count} missing base files, {result.orphan_hash_count} orphaned sidecars, "
+          f"{result.missing_hash_count} missing checksums.")
@@ -1,21 +1,59 @@
 #!/usr/bin/env python3
 
+import collections
 import contextlib
+import functools
 import hashlib
+import io
+import itertools
+import json
+import mmap
 import os
+import random
 import re
 import requests
+import sqlite3
 import sys
+import threading
+import time
 
-from os.path import abspath, dirname, isfile, join
-from typing import Callable, Optional
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from iterate_index import parse_index_row
+from os.path import abspath, dirname, isfile, join, relpath
+from requests.adapters import HTTPAdapter
+from typing import (TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple,
+                    TypeVar, Union)
+
+if TYPE_CHECKING:
+    from name_filter import NameFilter
 
 MAVEN_BUCKET = 'maven-central'
 BASE_URL = f'https://storage.googleapis.com/{MAVEN_BUCKET}/'
 MD5_RE = re.compile(rb'[0-9a-fA-F]{32}')
 OUTPUT = sys.stdout
 ERR_OUTPUT = sys.stderr
-CHUNK_SIZE = 4096
+CHUNK_SIZE = 1024 * 1024
+# Downloads are written to a file with this suffix and only renamed into place once they are complete and verified.
+PART_SUFFIX = '.part'
+# Hard links into the content-addressed store are made with this suffix and then renamed into place.
+LINK_SUFFIX = '.link'
+# The number of tasks each worker may have queued up ahead of the line currently being reported.
+IN_FLIGHT_PER_WORKER = 4
+# The journal of finished blobs is kept in this file at the top of the download directory.
+JOURNAL_FILE = '.download-journal.sqlite'
+JOURNAL_COMMIT_INTERVAL = 1000
+VERIFIED = 'verified'
+# The number of blobs handed to a verification process at a time.
+VERIFY_BATCH_SIZE = 256
+# Responses with these statuses are transient, so the request is retried after a backoff.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# The number of seconds to wait for a connection, and for each read from it, before giving up on (and retrying) the
+# request. The read timeout also cuts off a transfer that stalls partway, which is then resumed with a Range request.
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 60.0
+
+T = TypeVar('T')
+R = TypeVar('R')
 
 
 ########
@@ -42,6 +80,22 @@ class NoSuchMd5BlobException(DownloadException):
         super().__init__(f"Could not download md5 blob: {name}.")
 
 
+class NotInIndexException(DownloadException):
+    def __init__(self):
+        super().__init__("Could not find blob in index.")
+
+
+class UnexpectedStatusException(DownloadException):
+    def __init__(self, url: str, status_code: int):
+        super().__init__(f"Unexpected HTTP status {status_code} for: {url}.")
+
+
+class RetryableStatusException(UnexpectedStatusException):
+    def __init__(self, url: str, status_code: int, retry_after: Optional[float]):
+        super().__init__(url, status_code)
+        self.retry_after = retry_after
+
+
 class RegexException(MavenIndexingException):
     pass
 
@@ -56,11 +110,180 @@ class BrokenMatchException(RegexException):
         super().__init__("Regex match broken.")
 
 
+class MissingFileException(MavenIndexingException):
+    pass
+
+
+class MissingBlobFileException(MissingFileException):
+    def __init__(self):
+        super().__init__("Could not find downloaded blob.")
+
+
+class MissingMd5FileException(MissingFileException):
+    def __init__(self):
+        super().__init__("Could not find md5 file.")
+
+
 class MismatchedMd5Exception(MavenIndexingException):
     def __init__(self, actual: str, expected: str):
         super().__init__(f"Actual md5 ({actual}) did not match expected md5 ({expected}).")
 
 
+class MalformedLineException(MavenIndexingException):
+    def __init__(self, columns: int):
+        super().__init__(f"Expected a blob name or an index line with 3 or 5 columns, but found {columns} columns.")
+
+
+########
+# Types
+####
+
+
+class WorkItem(NamedTuple):
+    name: str
+    md5: Optional[str] = None
+
+
+class BlobOutcome(NamedTuple):
+    name: str
+    errors: str
+    md5: Optional[str] = None
+    size: Optional[int] = None
+    missing: Optional[str] = None
+
+
+class VerifyFailure(NamedTuple):
+    name: str
+    exception: str
+    message: str
+
+
+class RetryPolicy(NamedTuple):
+    max_retries: int = 5
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+
+    def delay(self, attempt: int, retry_after: Optional[float]=None) -> float:
+        """
+        Computes how long to wait before the next attempt, using exponential backoff with full jitter so that many
+        workers failing at once do not retry in lockstep. A server-provided `Retry-After` is honored as a minimum.
+
+        :param attempt: the number of attempts that have failed so far, minus one
+        :param retry_after: the number of seconds the server asked us to wait, if any
+        :return: the number of seconds to wait
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class RateLimiter:
+    """
+    A thread-safe token bucket which limits some quantity (requests or bytes) to `rate` per second, while allowing
+    bursts of up to one second's worth. A rate of `None` disables the limit.
+    """
+    def __init__(self, rate: Optional[float]):
+        self.rate = rate
+        self.tokens = rate or 0.0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: float=1):
+        """
+        Takes `amount` tokens from the bucket, sleeping until the bucket has refilled if that overdraws it. Amounts
+        larger than the bucket are allowed; they just take proportionally longer to pay back.
+
+        :param amount: the number of tokens to take
+        """
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class DownloadSession(requests.Session):
+    """
+    An HTTP session which also carries the retry policy, rate limits, and `(connect, read)` timeouts to apply to
+    everything downloaded through it.
+    """
+    def __init__(self, retry_policy: RetryPolicy, request_limiter: RateLimiter, byte_limiter: RateLimiter,
+                 timeout: Tuple[float, float]=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        super().__init__()
+        self.retry_policy = retry_policy
+        self.request_limiter = request_limiter
+        self.byte_limiter = byte_limiter
+        self.timeout = timeout
+
+
+class DownloadJournal:
+    """
+    A persistent record of the blobs that have been downloaded and verified, along with those that are known not to
+    exist (i.e., the server responded with a 404 for the blob or its `.md5` file). This allows an interrupted run to
+    skip finished blobs with a single indexed lookup rather than re-hashing them.
+
+    Records are committed in batches, so an interruption may lose the last few; those blobs are simply verified again.
+    """
+    def __init__(self, journal_file: str):
+        self.connection = sqlite3.connect(journal_file)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS blobs '
+                                '(name TEXT PRIMARY KEY, status TEXT NOT NULL, size INTEGER, md5 TEXT) WITHOUT ROWID')
+        self.uncommitted = 0
+
+    def lookup(self, name: str) -> Optional[str]:
+        """
+        Looks up the recorded status of a blob.
+
+        :param name: the name of a blob
+        :return: `VERIFIED` if the blob has been verified, the name of the exception raised if it is known to be
+                 missing, or `None` if it has not been recorded
+        """
+        row = self.connection.execute('SELECT status FROM blobs WHERE name = ?', (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def lookup_md5(self, name: str) -> Optional[str]:
+        """
+        :param name: the name of a blob
+        :return: the md5 sum the blob was verified against when it was downloaded, or `None` if it was not
+        """
+        row = self.connection.execute('SELECT md5 FROM blobs WHERE name = ?', (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def should_skip(self, name: str, retry_missing: bool) -> bool:
+        status = self.lookup(name)
+        if status is None:
+            return False
+        return status == VERIFIED or not retry_missing
+
+    def record(self, outcome: BlobOutcome):
+        if outcome.md5 is not None:
+            row = (outcome.name, VERIFIED, outcome.size, outcome.md5)
+        elif outcome.missing is not None:
+            row = (outcome.name, outcome.missing, None, None)
+        else:
+            return
+        self.connection.execute('INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)', row)
+        self.uncommitted += 1
+        if self.uncommitted >= JOURNAL_COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
 ########
 # Custom printing functions
 ####
@@ -80,7 +303,7 @@ def eshow(*args, **kwargs):
 
 
 @contextlib.contextmanager
-def error_context(name: str):
+def error_context(name: str, err_output: Optional[TextIO]=None):
     """
     Catches errors raised within the context and prints their messages with the given name prepended. Intended for use
     in a `with` statement, such as:
@@ -91,35 +314,60 @@ def error_context(name: str):
     An error raised within the `bar()` function call would be caught, and its message would be printed via `eshow` as:
 
         > foo\tError message.
+
+    If `err_output` is given, the message is written there instead. This lets concurrent workers capture their messages
+    so they can be reported in input order.
     """
+    def report(message: str):
+        if err_output is None:
+            eshow(message)
+        else:
+            print(message, file=err_output)
+
     try:
         yield
     except KeyboardInterrupt:
         # Allow a deliberate KeyboardInterrupt to terminate program execution.
         raise
     except MavenIndexingException as e:
-        eshow(f"{name}\t{e.message}")
+        report(f"{name}\t{e.message}")
     except Exception as e:
         message = type(e).__name__
         if len(e.args) >= 1:
             message += ": " + str(e.args[0])
-        eshow(f"{name}\t{message}")
+        report(f"{name}\t{message}")
 
 
 def compute_md5_for_file(file_name: str) -> str:
     """
-    Given a file, computes that file's md5 sum. Reads the file one chunk at a time.
+    Given a file, computes that file's md5 sum. Small files are read in one call, and larger files are memory-mapped and
+    hashed without copying them through Python.
 
     :param file_name: the name of file to hash
     :return: a string containing the md5 sum
     """
     md5_hash = hashlib.md5()
-    with open(file_name, 'rb') as f:
-        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
-            md5_hash.update(chunk)
+    update_hash_from_file(md5_hash, file_name)
     return md5_hash.hexdigest()
 
 
+def update_hash_from_file(file_hash: 'hashlib._Hash', file_name: str):
+    """
+    Feeds the contents of a file into a hash object, as `compute_md5_for_file` does.
+
+    :param file_hash: the hash object to update
+    :param file_name: the name of the file to read
+    """
+    with open(file_name, 'rb') as f:
+        if os.fstat(f.fileno()).st_size <= CHUNK_SIZE:
+            file_hash.update(f.read())
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if hasattr(m, 'madvise'):
+                    m.madvise(mmap.MADV_SEQUENTIAL)
+                file_hash.update(m)
+
+
 def read_md5_from_md5_file(file_name: str) -> str:
     """
     Reads an md5 value from a `.md5` file on Maven. A file `foo.md5` contains the md5 sum for the file `foo` in the same
@@ -139,20 +387,87 @@ def read_md5_from_md5_file(file_name: str) -> str:
     return expected_md5
 
 
-def get_from_url(session: requests.Session, url: str) -> requests.Response:
+def get_from_url(session: DownloadSession, url: str, stream: bool=False,
+                 headers: Optional[Dict[str, str]]=None) -> requests.Response:
     """
-    Produces an HTTP response object obtained by issuing a GET request to the designated URL.
+    Produces an HTTP response object obtained by issuing a GET request to the designated URL. The request counts against
+    the session's request rate limit, and is abandoned with a `requests.Timeout` (or, once the body is being streamed, a
+    `requests.ConnectionError`) if the server does not respond within the session's timeouts.
 
     :param session: the current open HTTP session
     :param url: the URL to fetch from
+    :param stream: whether to defer downloading the response body until it is iterated over
+    :param headers: any extra headers to send with the request
     :return: a requests.Response object
     """
-    request = requests.Request('GET', url)
-    prepare = request.prepare()
-    response = session.send(prepare)
+    session.request_limiter.acquire()
+    request = requests.Request('GET', url, headers=headers)
+    prepare = session.prepare_request(request)
+    response = session.send(prepare, stream=stream, timeout=session.timeout)
     return response
 
 
+def make_session(pool_size: int, retry_policy: RetryPolicy=RetryPolicy(), requests_per_second: Optional[float]=None,
+                 bytes_per_second: Optional[float]=None,
+                 timeout: Tuple[float, float]=(CONNECT_TIMEOUT, READ_TIMEOUT)) -> DownloadSession:
+    """
+    Produces an HTTP session whose connection pool can hold `pool_size` open connections per host, so that that many
+    workers can share the session without discarding connections. The rate limits apply across all of those workers.
+
+    :param pool_size: the number of connections to keep open per host
+    :param retry_policy: how to retry requests that fail transiently
+    :param requests_per_second: the maximum rate of requests, or `None` for no limit
+    :param bytes_per_second: the maximum rate of downloaded bytes, or `None` for no limit
+    :param timeout: the number of seconds to wait for a connection and for each read, respectively
+    :return: a DownloadSession object
+    """
+    session = DownloadSession(retry_policy, RateLimiter(requests_per_second), RateLimiter(bytes_per_second), timeout)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def map_ordered(executor: Executor, func: Callable[[T], R], items: Iterable[T], window: int) -> Iterator[R]:
+    """
+    Like `executor.map`, but only submits up to `window` items ahead of the result currently being yielded. Results are
+    yielded in the same order as the items, and the input is consumed lazily so it may be arbitrarily long.
+
+    :param executor: the executor to run `func` in
+    :param func: the function to apply to each item
+    :param items: the items to process
+    :param window: the maximum number of submitted but not yet yielded items
+    :return: an iterator over the results of `func`, in input order
+    """
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    Splits the items into lists of (at most) the given size, consuming them lazily.
+
+    :param items: the items to split up
+    :param size: the number of items in each list
+    :return: an iterator over the lists of items
+    """
+    it = iter(items)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
 def make_dirs_for_path(path: str):
     """
     An emulation of `mkdir -p`. If the designated directory (or any directory between the current directory and that
@@ -163,36 +478,172 @@ def make_dirs_for_path(path: str):
     os.makedirs(path, exist_ok=True)
 
 
-def download_file(session: requests.Session, url: str, dest_file: str, on_error: Callable[[], None]):
+def remove_if_exists(path: str):
+    """
+    Removes the designated file, doing nothing if it does not exist.
+
+    :param path: the file to remove
+    """
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def parse_retry_after(response: requests.Response) -> Optional[float]:
+    """
+    :param response: an HTTP response asking us to back off
+    :return: the number of seconds given by its `Retry-After` header, or `None` if there is none we understand
+    """
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return None
+
+
+def parse_content_range_start(response: requests.Response) -> Optional[int]:
+    """
+    :param response: a 206 (Partial Content) HTTP response
+    :return: the offset of the first byte in the response, according to its `Content-Range` header
+    """
+    match = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+    return None if match is None else int(match.group(1))
+
+
+def download_file(session: DownloadSession, url: str, dest_file: str, on_error: Callable[[], None],
+                  check_md5: Optional[Callable[[str], None]]=None) -> str:
     """
     Downloads the contents of a given URL and saves them into the designated file. If the status code of the HTTP
-    request is anything other than 200, `on_error` will be called. (It is suggested that `on_error` raises an error.)
+    request is 404, `on_error` will be called. (It is suggested that `on_error` raises an error.) Any other status
+    besides 200 raises an `UnexpectedStatusException`, since it does not mean that the file is missing.
+
+    The contents are streamed in binary chunks into a `.part` file next to `dest_file` while their md5 sum is computed.
+    If given, `check_md5` is called with that sum before the file is renamed into place, so raising an error from it
+    leaves no file behind. An interrupted download likewise never leaves a partial file at `dest_file`.
+
+    If the `.part` file already exists (from an earlier interrupted attempt or run), the download resumes from its end
+    with an HTTP Range request. Connection errors, timeouts (including a transfer that stalls partway), and transient
+    statuses (such as 429 and 503) are retried according to the session's retry policy, resuming where the failed
+    attempt left off.
 
     :param session: the current open HTTP session
     :param url: the URL to download the contents of
     :param dest_file: the file to save those contents to
-    :param on_error: a function to call if the status code does not equal 200
+    :param on_error: a function to call if the status code is 404
+    :param check_md5: a function to call with the md5 sum of the contents before committing them
+    :return: the md5 sum of the downloaded contents
     """
-    response = get_from_url(session, url)
-    if response.status_code != 200:
-        on_error()
-    make_dirs_for_path(dirname(dest_file))
-    with open(dest_file, 'w') as df:
-        df.write(response.text)
+    part_file = dest_file + PART_SUFFIX
+    md5_hash = hashlib.md5()
+    offset = 0
+    if isfile(part_file):
+        update_hash_from_file(md5_hash, part_file)
+        offset = os.path.getsize(part_file)
+    attempt = 0
+    while True:
+        # Ask for just the remainder of the file, and make sure the server does not compress it, since a compressed
+        # range cannot be decoded on its own.
+        headers = {'Range': f'bytes={offset}-', 'Accept-Encoding': 'identity'} if offset else None
+        try:
+            with contextlib.closing(get_from_url(session, url, stream=True, headers=headers)) as response:
+                status = response.status_code
+                if status == 404:
+                    on_error()
+                if status in RETRY_STATUS_CODES:
+                    raise RetryableStatusException(url, status, parse_retry_after(response))
+                if status == 416 and offset:
+                    # The part file is at least as long as the whole file. It cannot be trusted, so start over.
+                    md5_hash = hashlib.md5()
+                    offset = 0
+                    remove_if_exists(part_file)
+                    continue
+                if status == 206 and parse_content_range_start(response) == offset:
+                    mode = 'ab'
+                elif status == 200:
+                    # Either this is a fresh download, or the server ignored our Range header.
+                    md5_hash = hashlib.md5()
+                    offset = 0
+                    mode = 'wb'
+                else:
+                    raise UnexpectedStatusException(url, status)
+                make_dirs_for_path(dirname(dest_file))
+                with open(part_file, mode) as df:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        session.byte_limiter.acquire(len(chunk))
+                        df.write(chunk)
+                        md5_hash.update(chunk)
+                        offset += len(chunk)
+            break
+        except (RetryableStatusException, requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            if attempt >= session.retry_policy.max_retries:
+                raise
+            time.sleep(session.retry_policy.delay(attempt, getattr(e, 'retry_after', None)))
+            attempt += 1
+    actual_md5 = md5_hash.hexdigest()
+    try:
+        if check_md5 is not None:
+            check_md5(actual_md5)
+        os.replace(part_file, dest_file)
+    except BaseException:
+        # The download finished, so the part file is of no use for resuming. Don't leave it around.
+        remove_if_exists(part_file)
+        raise
+    return actual_md5
 
 
-def verify_downloaded_blob(blob_file: str, md5_file: str):
+def compare_md5(actual_md5: str, expected_md5: str):
+    """
+    Compares two md5 sums, ignoring case. Raises an error if the sums do not match.
+
+    :param actual_md5: the md5 sum computed for a blob
+    :param expected_md5: the md5 sum the blob is expected to have
+    """
+    if actual_md5.lower() != expected_md5.lower():
+        raise MismatchedMd5Exception(actual_md5, expected_md5)
+
+
+def verify_md5(actual_md5: str, md5_file: str):
+    """
+    Reads the expected md5 sum from the given `.md5` file and compares it to the given sum. Raises an error if the sums
+    do not match.
+
+    :param actual_md5: the md5 sum computed for a blob
+    :param md5_file: the file to read an expected md5 sum from
+    """
+    compare_md5(actual_md5, read_md5_from_md5_file(md5_file))
+
+
+def verify_downloaded_blob(blob_file: str, md5_file: str) -> str:
     """
     Computes the md5 sum for a file and reads the expected md5 sum from the given `.md5` file and compares the two.
     Raises an error if the sums do not match.
 
     :param blob_file: the file to compute the md5 sum for
     :param md5_file: the file to read an expected m5 sum from
+    :return: the verified md5 sum
     """
     actual_md5 = compute_md5_for_file(blob_file)
-    expected_md5 = read_md5_from_md5_file(md5_file)
-    if actual_md5.lower() != expected_md5.lower():
-        raise MismatchedMd5Exception(actual_md5, expected_md5)
+    verify_md5(actual_md5, md5_file)
+    return actual_md5
+
+
+def parse_work_line(raw_line: str) -> WorkItem:
+    """
+    Parses one line of a list of blobs to download. A line is either just a blob name, or else a line of an index built
+    with `build_index.py`. In the latter case, the index's md5 sum is used (if present) instead of the `.md5` file.
+
+    Raises a `MalformedLineException` if the line has tabs but is not an index line.
+
+    :param raw_line: the line to parse
+    :return: the name of the blob and its expected md5 sum, if known
+    """
+    line = raw_line.strip()
+    if '\t' not in line:
+        return WorkItem(line)
+    row = raw_line.rstrip('\r\n').split('\t')
+    if len(row) not in (3, 5):
+        raise MalformedLineException(len(row))
+    entry = parse_index_row(row)
+    return WorkItem(entry.name, entry.md5)
 
 
 def raise_exception(exception: Exception):
@@ -209,17 +660,199 @@ def raise_exception(exception: Exception):
 ####
 
 
-def download_blobs(blob_names_file: Optional[str], download_dir: str):
+def get_store_path(store_dir: str, md5: str) -> str:
+    """
+    Produces the path at which the content-addressed store keeps the blob with the given md5 sum. Blobs are spread over
+    two levels of directories named by the first four hexadecimal digits of the sum, to keep the directories small.
+
+    :param store_dir: the top-level directory of the store
+    :param md5: the md5 sum of the blob
+    :return: the path of the blob within the store
+    """
+    md5 = md5.lower()
+    return join(store_dir, md5[0:2], md5[2:4], md5)
+
+
+def link_into_place(src: str, dest: str):
+    """
+    Atomically makes `dest` a hard link to `src`, replacing whatever file was at `dest`.
+
+    :param src: the existing file to link to
+    :param dest: the path to put the link at
+    """
+    make_dirs_for_path(dirname(dest))
+    link_file = dest + LINK_SUFFIX
+    remove_if_exists(link_file)
+    os.link(src, link_file)
+    os.replace(link_file, dest)
+
+
+def add_to_store(store_dir: str, blob_file: str, md5: str):
+    """
+    Adds a verified blob to the content-addressed store. If the store already holds a blob with the same md5 sum, the
+    given file is replaced by a hard link to that blob, so identical blobs only take up space once.
+
+    :param store_dir: the top-level directory of the store
+    :param blob_file: the verified blob
+    :param md5: the md5 sum of the blob
+    """
+    stored_file = get_store_path(store_dir, md5)
+    make_dirs_for_path(dirname(stored_file))
+    try:
+        os.link(blob_file, stored_file)
+    except FileExistsError:
+        if not os.path.samefile(blob_file, stored_file):
+            link_into_place(stored_file, blob_file)
+
+
+def download_blob(session: DownloadSession, base_url: str, download_dir: str, blob_name: str,
+                  expected_md5: Optional[str]=None, store_dir: Optional[str]=None) -> str:
+    """
+    Downloads a single blob into `download_dir` (unless it is already present) and verifies it, as `fetch_blob` does.
+
+    If `store_dir` is given, blobs are also kept in a content-addressed store there, and the files in `download_dir` are
+    hard links into it. When the expected md5 sum is known and the store already has a blob with that sum, the blob is
+    linked into place without downloading anything.
+
+    :param session: the current open HTTP session
+    :param base_url: the URL that blob names are relative to
+    :param download_dir: the directory to download the blob into
+    :param blob_name: the name of the blob to download
+    :param expected_md5: the md5 sum the blob is expected to have, if known
+    :param store_dir: the top-level directory of the content-addressed store, if one is used
+    :return: the verified md5 sum of the blob
+    """
+    blob_dest_file = join(download_dir, blob_name)
+    if store_dir is not None and expected_md5 is not None:
+        stored_file = get_store_path(store_dir, expected_md5)
+        if isfile(stored_file):
+            if not (isfile(blob_dest_file) and os.path.samefile(blob_dest_file, stored_file)):
+                link_into_place(stored_file, blob_dest_file)
+            return expected_md5.lower()
+    md5 = fetch_blob(session, base_url, download_dir, blob_name, expected_md5)
+    if store_dir is not None:
+        add_to_store(store_dir, blob_dest_file, md5)
+    return md5
+
+
+def fetch_blob(session: DownloadSession, base_url: str, download_dir: str, blob_name: str,
+               expected_md5: Optional[str]=None) -> str:
+    """
+    Downloads a single blob and its `.md5` file into `download_dir` (unless they are already present) and verifies that
+    the blob's actual md5 sum matches the expected sum. A newly downloaded blob is only saved if the sums match.
+
+    If `expected_md5` is given (such as from the index), the blob is verified against it directly, and no `.md5` file is
+    downloaded.
+
+    :param session: the current open HTTP session
+    :param base_url: the URL that blob names are relative to
+    :param download_dir: the directory to download the blob into
+    :param blob_name: the name of the blob to download
+    :param expected_md5: the md5 sum the blob is expected to have, if known
+    :return: the verified md5 sum of the blob
+    """
+    # Generate blob-related names.
+    blob_url = base_url + blob_name
+    blob_dest_file = join(download_dir, blob_name)
+    if expected_md5 is not None:
+        if isfile(blob_dest_file):
+            actual_md5 = compute_md5_for_file(blob_dest_file)
+            compare_md5(actual_md5, expected_md5)
+            return actual_md5
+        return download_file(session, blob_url, blob_dest_file,
+                             lambda: raise_exception(NoSuchBlobException()),
+                             lambda actual_md5: compare_md5(actual_md5, expected_md5))
+    # Generate md5-related names.
+    md5_name = blob_name + '.md5'
+    md5_url = base_url + md5_name
+    md5_dest_file = join(download_dir, blob_dest_file + '.md5')
+    # Check whether the blob has previously been downloaded. If it has, check for a corresponding md5 file. Download
+    # that md5 file if it is missing. If the blob has not been downloaded, download it and its md5.
+    if isfile(blob_dest_file):
+        if not isfile(md5_dest_file):
+            download_file(session, md5_url, md5_dest_file,
+                          lambda: raise_exception(NoSuchMd5BlobException(md5_name)))
+        # Verify md5 sums are equivalent.
+        return verify_downloaded_blob(blob_dest_file, md5_dest_file)
+    else:
+        # The blob is hashed while it is streamed to disk, and only committed once the md5 file agrees with it.
+        def check_md5(actual_md5: str):
+            download_file(session, md5_url, md5_dest_file,
+                          lambda: raise_exception(NoSuchMd5BlobException(md5_name)))
+            verify_md5(actual_md5, md5_dest_file)
+
+        return download_file(session, blob_url, blob_dest_file,
+                             lambda: raise_exception(NoSuchBlobException()), check_md5)
+
+
+def process_blob(session: DownloadSession, base_url: str, download_dir: str, store_dir: Optional[str],
+                 name_filter: Optional['NameFilter'], item: WorkItem) -> BlobOutcome:
+    """
+    Downloads a single blob within an error context, capturing any error messages instead of printing them.
+
+    :param session: the current open HTTP session
+    :param base_url: the URL that blob names are relative to
+    :param download_dir: the directory to download the blob into
+    :param store_dir: the top-level directory of the content-addressed store, if one is used
+    :param name_filter: the names in the index, to skip blobs that do not exist without requesting them, if given
+    :param item: the name of the blob to download and its expected md5 sum, if known
+    :return: the outcome of the download, including any error output produced for the blob
+    """
+    err_output = io.StringIO()
+    md5 = None
+    size = None
+    missing = None
+    with error_context(item.name, err_output):
+        if name_filter is not None and item.name not in name_filter:
+            raise NotInIndexException()
+        try:
+            md5 = download_blob(session, base_url, download_dir, item.name, item.md5, store_dir)
+            size = os.path.getsize(join(download_dir, item.name))
+        except (NoSuchBlobException, NoSuchMd5BlobException) as e:
+            missing = type(e).__name__
+            raise
+    return BlobOutcome(item.name, err_output.getvalue(), md5, size, missing)
+
+
+def download_blobs(blob_names_file: Optional[str], download_dir: str, workers: int=1, base_url: str=BASE_URL,
+                   use_journal: bool=True, retry_missing: bool=False, retry_policy: RetryPolicy=RetryPolicy(),
+                   requests_per_second: Optional[float]=None, bytes_per_second: Optional[float]=None,
+                   store_dir: Optional[str]=None, name_filter_file: Optional[str]=None,
+                   timeout: Tuple[float, float]=(CONNECT_TIMEOUT, READ_TIMEOUT)):
     """
     Reads names of blobs from the given file and attempts to download each of them, verifying that their actual md5 sums
     match the expected sums given by that file's corresponding `.md5` file. The downloaded contents will be stored in
     the designated `download_dir`, preserving path structure as expected (i.e., blob `/foo/bar/baz.jar` will be saved in
     `download_dir/foo/bar/baz.jar`).
 
-    The `blob_names_file` should just be a text file with a blob name on each line and nothing more.
+    The `blob_names_file` should just be a text file with a blob name on each line and nothing more. Alternatively, it
+    may contain lines of an index built with `build_index.py`, in which case the md5 sums recorded in the index are used
+    instead of downloading `.md5` files.
 
-    :param blob_names_file: the file of blob names, separated by newlines
+    With more than one worker, blobs are downloaded concurrently by a pool of threads sharing one connection pool. Error
+    messages are still reported in the order of the input lines.
+
+    Unless disabled, a `DownloadJournal` in `download_dir` records each verified blob and each blob found to be missing,
+    and later runs skip those blobs entirely. Missing blobs are tried again if `retry_missing` is set.
+
+    If `store_dir` is given, the blobs are deduplicated through a content-addressed store (see `download_blob`). It must
+    be on the same file system as `download_dir`, since the downloaded files are hard links into it.
+
+    If `name_filter_file` is given, blobs whose names are not in that filter (see `name_filter.py`) are reported as not
+    being in the index, without making any requests for them.
+
+    :param blob_names_file: the file of blob names (or index lines), separated by newlines
     :param download_dir: the directory to download the blobs into
+    :param workers: the number of blobs to download concurrently
+    :param base_url: the URL that blob names are relative to
+    :param use_journal: whether to skip and record finished blobs using the journal
+    :param retry_missing: whether to try blobs the journal records as missing again
+    :param retry_policy: how to retry requests that fail transiently
+    :param requests_per_second: the maximum rate of requests across all workers, or `None` for no limit
+    :param bytes_per_second: the maximum rate of downloaded bytes across all workers, or `None` for no limit
+    :param store_dir: the top-level directory of the content-addressed store, or `None` to not use one
+    :param name_filter_file: a filter of the names in the index, or `None` to try every blob
+    :param timeout: the number of seconds to wait for a connection and for each read, respectively
     """
     # If no `blob_names_file` is given, read from stdin. Otherwise, open the file.
     if blob_names_file is None:
@@ -227,45 +860,197 @@ def download_blobs(blob_names_file: Optional[str], download_dir: str):
     else:
         f = open(blob_names_file)
     download_dir = abspath(download_dir)
+    if store_dir is not None:
+        store_dir = abspath(store_dir)
+    workers = max(workers, 1)
     line_no = 0
-    session = requests.Session()
-    try:
+    session = make_session(workers, retry_policy, requests_per_second, bytes_per_second, timeout)
+    journal = None
+    if use_journal:
+        make_dirs_for_path(download_dir)
+        journal = DownloadJournal(join(download_dir, JOURNAL_FILE))
+    name_filter = None
+    if name_filter_file is not None:
+        # Imported here because `name_filter` itself builds on this module.
+        from name_filter import NameFilter
+        name_filter = NameFilter(name_filter_file)
+
+    def read_items() -> Iterator[Union[WorkItem, BlobOutcome]]:
+        nonlocal line_no
         for raw_line in f:
             line_no += 1
-            # Generate blob-related names.
-            blob_name = raw_line.strip()
-            blob_url = BASE_URL + blob_name
-            blob_dest_file = join(download_dir, blob_name)
-            # Generate md5-related names.
-            md5_name = blob_name + '.md5'
-            md5_url = BASE_URL + md5_name
-            md5_dest_file = join(download_dir, blob_dest_file + '.md5')
             # Print progress output onto a single line.
             if line_no % 1000 == 0:
                 print(f"\rProcessing line: {line_no}", end='')
-            # Open an error context for the current blob.
-            with error_context(blob_name):
-                # Check whether the blob has previously been downloaded. If it has, check for a corresponding md5 file.
-                # Download that md5 file if it is missing. If the blob has not been downloaded, download it and its md5.
-                if isfile(blob_dest_file):
-                    if not isfile(md5_dest_file):
-                        download_file(session, md5_url, md5_dest_file,
-                                      lambda: raise_exception(NoSuchMd5BlobException(md5_name)))
-                else:
-                    download_file(session, blob_url, blob_dest_file,
-                                  lambda: raise_exception(NoSuchBlobException()))
-                    download_file(session, md5_url, md5_dest_file,
-                                  lambda: raise_exception(NoSuchMd5BlobException(md5_name)))
-                # Verify md5 sums are equivalent.
-                verify_downloaded_blob(blob_dest_file, md5_dest_file)
+            err_output = io.StringIO()
+            item = None
+            with error_context(raw_line.strip(), err_output):
+                item = parse_work_line(raw_line)
+            if item is None:
+                # A malformed line is reported in order with the blobs around it, and the run carries on.
+                yield BlobOutcome(raw_line.strip(), err_output.getvalue())
+                continue
+            if journal is not None and journal.should_skip(item.name, retry_missing):
+                continue
+            yield item
+
+    def process_item(item: Union[WorkItem, BlobOutcome]) -> BlobOutcome:
+        if isinstance(item, BlobOutcome):
+            return item
+        return process_blob(session, base_url, download_dir, store_dir, name_filter, item)
+
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if executor is None:
+            results = map(process_item, read_items())
+        else:
+            results = map_ordered(executor, process_item, read_items(), workers * IN_FLIGHT_PER_WORKER)
+        for outcome in results:
+            if outcome.errors:
+                ERR_OUTPUT.write(outcome.errors)
+            if journal is not None:
+                journal.record(outcome)
     except Exception:
         show(f"Processing interrupted on line {line_no}.")
         raise
     finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if journal is not None:
+            journal.close()
+        if name_filter is not None:
+            name_filter.close()
+        session.close()
         f.close()
         print()
 
 
+def walk_download_dir(download_dir: str) -> Iterator[WorkItem]:
+    """
+    Finds every blob that has been downloaded into `download_dir`, skipping `.md5` files, unfinished `.part` and `.link`
+    files, and the download journal.
+
+    :param download_dir: the directory the blobs were downloaded into
+    :return: an iterator over the blobs' names, relative to `download_dir`
+    """
+    for dir_path, dir_names, file_names in os.walk(download_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.endswith(('.md5', PART_SUFFIX, LINK_SUFFIX)) or file_name.startswith(JOURNAL_FILE):
+                continue
+            yield WorkItem(relpath(join(dir_path, file_name), download_dir))
+
+
+def verify_blob(download_dir: str, item: WorkItem,
+                journal: Optional[DownloadJournal]=None) -> Optional[VerifyFailure]:
+    """
+    Checks a previously downloaded blob against its expected md5 sum, which is taken from `item` if known and from the
+    blob's `.md5` file otherwise. Blobs downloaded from index lines have no `.md5` file, so for those the sum recorded
+    in the download journal is used, if there is one.
+
+    :param download_dir: the directory the blob was downloaded into
+    :param item: the name of the blob and its expected md5 sum, if known
+    :param journal: the download journal of `download_dir`, if it has one
+    :return: a description of the problem, or `None` if the blob is intact
+    """
+    blob_file = join(download_dir, item.name)
+    md5_file = blob_file + '.md5'
+    expected_md5 = item.md5
+    try:
+        if not isfile(blob_file):
+            raise MissingBlobFileException()
+        if expected_md5 is None and not isfile(md5_file):
+            if journal is not None:
+                expected_md5 = journal.lookup_md5(item.name)
+            if expected_md5 is None:
+                raise MissingMd5FileException()
+        actual_md5 = compute_md5_for_file(blob_file)
+        if expected_md5 is None:
+            verify_md5(actual_md5, md5_file)
+        else:
+            compare_md5(actual_md5, expected_md5)
+    except MavenIndexingException as e:
+        return VerifyFailure(item.name, type(e).__name__, e.message)
+    except OSError as e:
+        return VerifyFailure(item.name, type(e).__name__, str(e))
+    return None
+
+
+def verify_blob_batch(download_dir: str, items: List[WorkItem]) -> List[VerifyFailure]:
+    journal_file = join(download_dir, JOURNAL_FILE)
+    journal = DownloadJournal(journal_file) if isfile(journal_file) else None
+    try:
+        return [failure for failure in (verify_blob(download_dir, item, journal) for item in items)
+                if failure is not None]
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def verify_blobs(blob_names_file: Optional[str], download_dir: str, jobs: Optional[int]=None,
+                 report_file: Optional[str]=None):
+    """
+    Re-verifies previously downloaded blobs against their md5 sums without downloading anything, spreading the hashing
+    across a pool of processes. The blobs to check are read from `blob_names_file` (which may also contain index lines)
+    if it is given, or else found by walking `download_dir`.
+
+    A JSON report is written to `report_file` (or `OUTPUT`), holding the number of blobs checked and the problems found,
+    grouped by the name of the exception describing them.
+
+    :param blob_names_file: the file of blob names (or index lines), or `None` to check everything in `download_dir`
+    :param download_dir: the directory the blobs were downloaded into
+    :param jobs: the number of processes to use, defaulting to the number of CPUs
+    :param report_file: the file to write the report to
+    """
+    download_dir = abspath(download_dir)
+    jobs = jobs or os.cpu_count() or 1
+    checked = 0
+    failures: Dict[str, List[Dict[str, str]]] = {}
+
+    def read_items(lines: TextIO) -> Iterator[WorkItem]:
+        for raw_line in lines:
+            try:
+                yield parse_work_line(raw_line)
+            except MalformedLineException as e:
+                # Malformed lines are reported along with the problems found, rather than ending the check.
+                failures.setdefault(type(e).__name__, []).append({'name': raw_line.strip(), 'message': e.message})
+
+    if blob_names_file is None:
+        f = None
+        items = walk_download_dir(download_dir)
+    else:
+        f = open(blob_names_file)
+        items = read_items(f)
+
+    def count_items() -> Iterator[WorkItem]:
+        nonlocal checked
+        for item in items:
+            checked += 1
+            if checked % 1000 == 0:
+                print(f"\rVerifying blob: {checked}", end='', file=ERR_OUTPUT)
+            yield item
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            batches = batched(count_items(), VERIFY_BATCH_SIZE)
+            for batch_failures in map_ordered(executor, functools.partial(verify_blob_batch, download_dir), batches,
+                                              jobs * IN_FLIGHT_PER_WORKER):
+                for failure in batch_failures:
+                    failures.setdefault(failure.exception, []).append({'name': failure.name,
+                                                                       'message': failure.message})
+    finally:
+        if f is not None:
+            f.close()
+        print(file=ERR_OUTPUT)
+    report = {'checked': checked, 'failures': failures}
+    if report_file is None:
+        json.dump(report, OUTPUT, indent=2)
+        show()
+    else:
+        with open(report_file, 'w') as rf:
+            json.dump(report, rf, indent=2)
+
+
 ########
 # main
 ####
@@ -276,6 +1061,26 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--blob-names-file', '-f', default=None)
     parser.add_argument('--download-dir', '-d', default='.')
+    parser.add_argument('--workers', '-w', type=int, default=1)
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--no-journal', action='store_true')
+    parser.add_argument('--retry-missing', action='store_true')
+    parser.add_argument('--max-retries', type=int, default=RetryPolicy().max_retries)
+    parser.add_argument('--max-requests-per-second', type=float, default=None)
+    parser.add_argument('--max-bytes-per-second', type=float, default=None)
+    parser.add_argument('--connect-timeout', type=float, default=CONNECT_TIMEOUT)
+    parser.add_argument('--read-timeout', type=float, default=READ_TIMEOUT)
+    parser.add_argument('--store-dir', '-s', default=None)
+    parser.add_argument('--verify-only', action='store_true')
+    parser.add_argument('--jobs', '-j', type=int, default=None)
+    parser.add_argument('--report', default=None)
+    parser.add_argument('--name-filter', default=None)
     args = parser.parse_args()
 
-    download_blobs(args.blob_names_file, args.download_dir)
+    if args.verify_only:
+        verify_blobs(args.blob_names_file, args.download_dir, args.jobs, args.report)
+    else:
+        download_blobs(args.blob_names_file, args.download_dir, args.workers, args.base_url, not args.no_journal,
+                       args.retry_missing, RetryPolicy(max_retries=args.max_retries), args.max_requests_per_second,
+                       args.max_bytes_per_second, args.store_dir, args.name_filter,
+                       (args.connect_timeout, args.read_timeout))
@@ -69,18 +69,27 @@ However, there are also `maven-metadata.xml` files for each version. These gener
 
 
 The information we need is <groupId>, <artifactId>, and <latest> (or <version> if <latest> is not available), so these
-are extracted via XML parsing with lxml and the path for the expected `.pom` file is constructed.
+are extracted via XML parsing with lxml and the path for the expected `.pom` file is constructed. Only the start of each
+file is parsed where possible (see `xml_header.py`), and the fields are matched regardless of any XML namespace.
+Truncated files are still reported as errors, but files that are malformed after their first few fields in some other
+way are not.
 """
 
-from download_blobs import *
-
+import io
+import os
 import sys
 
-# noinspection PyUnresolvedReferences
-from lxml import etree  # For some reason, `etree` can't be found by PyCharm.
+from concurrent.futures import ProcessPoolExecutor
+from download_blobs import (ERR_OUTPUT, IN_FLIGHT_PER_WORKER, MavenIndexingException, batched, error_context,
+                            map_ordered, show)
+from name_filter import NameFilter
 from os.path import abspath, join
+from typing import List, Optional, Tuple
+from xml_header import extract_metadata_header
 
 BLOB_BASE = 'repos/central/data/'
+# The number of `maven-metadata.xml` files handed to a worker process at a time.
+METADATA_BATCH_SIZE = 256
 
 
 class XmlParseException(MavenIndexingException):
@@ -102,6 +111,11 @@ class NoLatestVersionException(XmlParseException):
         super().__init__("Could not find latest version.")
 
 
+class PomNotInIndexException(MavenIndexingException):
+    def __init__(self, pom_name: str):
+        super().__init__(f"Could not find expected POM in index: {pom_name}.")
+
+
 def process_metadata_xml(xml_file: str) -> str:
     """
     Opens an XML file and constructs the expected name of the `.pom` file that corresponds to the latest version of the
@@ -115,56 +129,96 @@ def process_metadata_xml(xml_file: str) -> str:
     :param xml_file: the path to the XML file to read
     :return: the name of the `.pom` file expected to exist for the latest version of the library
     """
-    xml = etree.parse(xml_file)
-    versioning = xml.find('versioning')
-    if versioning is None:
+    # Only the first few fields of the file are parsed, which are usually all that is needed.
+    header = extract_metadata_header(xml_file)
+    if ('versioning',) not in header:
         # The <versioning> tag is required to differentiate artifact-level maven-metadata.xml files from version-level.
         raise NoLatestVersionException()
-    latest_version = versioning.find('latest')
-    if latest_version is None:
-        latest_version = xml.find('latest')
-        if latest_version is None:
-            latest_version = xml.find('version')
-            if latest_version is None:
-                raise NoLatestVersionException()
-    latest_version = latest_version.text
-    group_id = xml.find('groupId')
-    if group_id is None:
+    for path in [('versioning', 'latest'), ('latest',), ('version',)]:
+        if path in header:
+            latest_version = header[path]
+            break
+    else:
+        raise NoLatestVersionException()
+    if ('groupId',) not in header:
         raise NoGroupIdException()
-    group_id = group_id.text.replace('.', '/')
-    artifact_id = xml.find('artifactId')
-    if artifact_id is None:
+    group_id = header[('groupId',)].replace('.', '/')
+    if ('artifactId',) not in header:
         raise NoArtifactIdException()
-    artifact_id = artifact_id.text
+    artifact_id = header[('artifactId',)]
     # Construct the `.pom` file's name.
     pom_name = join(BLOB_BASE, group_id, artifact_id, latest_version, f'{artifact_id}-{latest_version}.pom')
     return pom_name
 
 
-def extract_expected_poms(metadata_xml_names_file: Optional[str], download_dir: str):
+def process_metadata_batch(xml_names: List[str]) -> List[Tuple[str, Optional[str], str]]:
+    """
+    Runs `process_metadata_xml` on each of a batch of files within an error context, capturing any error messages
+    instead of printing them, so that a worker process's results can be reported in input order.
+
+    :param xml_names: the paths to the XML files to read
+    :return: the name of each file, the expected `.pom` file's name for it (or `None` if there was an error), and its
+             error output
+    """
+    results = []
+    for xml_name in xml_names:
+        err_output = io.StringIO()
+        expected_pom = None
+        with error_context(xml_name, err_output):
+            expected_pom = process_metadata_xml(xml_name)
+        results.append((xml_name, expected_pom, err_output.getvalue()))
+    return results
+
+
+def extract_expected_poms(metadata_xml_names_file: Optional[str], download_dir: str,
+                          name_filter_file: Optional[str]=None, jobs: int=1):
     """
     Builds a list of expected `.pom` files based on a given list of `maven-metadata.xml` files in the Maven repository.
 
+    With more than one job, the files are parsed by a pool of processes in batches, and the results are reported in
+    input order, so the output is the same as with one.
+
     :param metadata_xml_names_file: the input file to read `maven-metadata.xml` file names from
     :param download_dir: the top-level directory to read the `maven-metadata.xml` files
+    :param name_filter_file: a filter of the names in the index (see `name_filter.py`), to report the expected `.pom`
+                             files that do not exist instead of listing them, or `None` to list them all
+    :param jobs: the number of processes to parse the files with, or 0 for one per CPU
     """
     if metadata_xml_names_file is None:
         f = sys.stdin
     else:
         f = open(metadata_xml_names_file)
     download_dir = abspath(download_dir)
+    name_filter = None if name_filter_file is None else NameFilter(name_filter_file)
+    jobs = jobs or os.cpu_count() or 1
     line_no = 0
+    xml_names = (join(download_dir, raw_line.strip()) for raw_line in f)
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
     try:
-        for raw_line in f:
-            line_no += 1
-            xml_name = join(download_dir, raw_line.strip())
-            with error_context(xml_name):
-                expected_pom = process_metadata_xml(xml_name)
-                print(expected_pom)
+        batches = batched(xml_names, METADATA_BATCH_SIZE)
+        if executor is None:
+            results = map(process_metadata_batch, batches)
+        else:
+            results = map_ordered(executor, process_metadata_batch, batches, jobs * IN_FLIGHT_PER_WORKER)
+        for batch_results in results:
+            for xml_name, expected_pom, errors in batch_results:
+                line_no += 1
+                if errors:
+                    ERR_OUTPUT.write(errors)
+                if expected_pom is None:
+                    continue
+                with error_context(xml_name):
+                    if name_filter is not None and expected_pom not in name_filter:
+                        raise PomNotInIndexException(expected_pom)
+                    print(expected_pom)
     except Exception:
         show(f"Processing interrupted on line {line_no}.")
         raise
     finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if name_filter is not None:
+            name_filter.close()
         f.close()
 
 
@@ -173,6 +227,9 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--xml-names-file', '-f', default=None)
     parser.add_argument('--download-dir', '-d', default='.')
+    parser.add_argument('--name-filter', default=None)
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="The number of processes to parse the files with, or 0 for one per CPU.")
     args = parser.parse_args()
 
-    extract_expected_poms(args.xml_names_file, args.download_dir)
+    extract_expected_poms(args.xml_names_file, args.download_dir, args.name_filter, args.jobs)
@@ -1,12 +1,234 @@
+#!/usr/bin/env python3
+import array
 import csv
-from typing import Callable
+import gzip
+import io
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, NamedTuple, Optional, Sequence, TextIO, Tuple
+
+if TYPE_CHECKING:
+    from binary_index import BinaryIndex
 
 
 INDEX_FILE = 'index.tsv'
+BATCH_SIZE = 65536
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
 
 
-def iterate_index(func: Callable[[str, str, str], None], index_file: str=INDEX_FILE):
-    with open(index_file, newline='') as f:
+class IndexEntry(NamedTuple):
+    blob_id: str
+    name: str
+    size: str
+    md5: Optional[str] = None
+    crc32c: Optional[str] = None
+
+
+def parse_index_row(row: List[str]) -> IndexEntry:
+    """
+    Converts the fields of one line of the index into an `IndexEntry`. Older indexes only have the three columns
+    `blob_no`, `name`, and `size`; newer ones also have `md5` and `crc32c` columns holding hexadecimal checksums, either
+    of which may be empty if the storage listing did not provide it.
+
+    :param row: the tab-separated fields of the line
+    :return: the corresponding `IndexEntry`, with `None` for any missing checksum
+    """
+    if len(row) == 3:
+        return IndexEntry(*row)
+    blob_id, name, size, md5, crc32c = row
+    return IndexEntry(blob_id, name, size, md5 or None, crc32c or None)
+
+
+def format_index_row(entry: IndexEntry) -> str:
+    """
+    Converts an `IndexEntry` back into a line of the index, always using the newer five-column format.
+
+    :param entry: the entry to convert
+    :return: the line, including its trailing newline
+    """
+    return '\t'.join([entry.blob_id, entry.name, entry.size, entry.md5 or '', entry.crc32c or '']) + '\n'
+
+
+def open_index_text(index_file: str) -> TextIO:
+    """
+    Opens a TSV index for reading, decompressing it on the fly if it was compressed with gzip or zstd.
+
+    :param index_file: the index to open
+    :return: the index as a text file
+    """
+    with open(index_file, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(index_file, 'rt', newline='')
+    if magic == ZSTD_MAGIC:
+        # Imported here so that the zstd library is only needed for zstd-compressed indexes.
+        import zstandard
+        return io.TextIOWrapper(zstandard.open(index_file, 'rb'), newline='')
+    return open(index_file, newline='')
+
+
+def read_index(index_file: str=INDEX_FILE) -> Iterator[IndexEntry]:
+    """
+    Reads the entries of an index, which may be either a TSV index built with `build_index.py` (optionally compressed
+    with gzip or zstd) or a binary index converted by `binary_index.py`.
+
+    :param index_file: the index to read
+    :return: an iterator over the entries of the index, in order
+    """
+    # Imported here because `binary_index` itself builds on this module.
+    from binary_index import BinaryIndex, is_binary_index
+    if is_binary_index(index_file):
+        with BinaryIndex(index_file) as index:
+            yield from index
+        return
+    with open_index_text(index_file) as f:
         r = csv.reader(f, delimiter='\t')
-        for blob_id, name, size in r:
-            func(blob_id, name, size)
+        for row in r:
+            yield parse_index_row(row)
+
+
+def iterate_index(func: Callable[[str, str, str], None], index_file: str=INDEX_FILE):
+    for entry in read_index(index_file):
+        func(entry.blob_id, entry.name, entry.size)
+
+
+########
+# Batched iteration
+####
+
+
+class IndexBatch(NamedTuple):
+    """
+    A batch of consecutive index entries. The blob numbers and sizes are `array('Q')` buffers, or NumPy `uint64` arrays
+    if they were asked for, so that they can be summed or compared without converting each entry.
+    """
+    ids: Sequence[int]
+    sizes: Sequence[int]
+    names: List[str]
+
+
+# The blob numbers, sizes, and names of a batch, before conversion to an `IndexBatch`.
+RawBatch = Tuple[array.array, array.array, List[str]]
+
+
+def normalize_extensions(extensions: Optional[Iterable[str]]) -> Optional[Tuple[str, ...]]:
+    if extensions is None:
+        return None
+    return tuple(extension if extension.startswith('.') else '.' + extension for extension in extensions)
+
+
+def make_batch(ids: array.array, sizes: array.array, names: List[str], as_numpy: bool) -> IndexBatch:
+    if as_numpy:
+        # Imported here so that NumPy is only needed by the callers that ask for NumPy arrays.
+        import numpy
+        return IndexBatch(numpy.frombuffer(ids, dtype=numpy.uint64), numpy.frombuffer(sizes, dtype=numpy.uint64),
+                          names)
+    return IndexBatch(ids, sizes, names)
+
+
+def iterate_text_batches(index_file: str, batch_size: int, extensions: Optional[Tuple[str, ...]], prefix: str,
+                         min_size: int, max_size: Optional[int]) -> Iterator[RawBatch]:
+    ids, sizes, names = array.array('Q'), array.array('Q'), []
+    with open_index_text(index_file) as f:
+        for row in csv.reader(f, delimiter='\t'):
+            name = row[1]
+            if not name.startswith(prefix):
+                if name > prefix:
+                    # The index is sorted by name, so there are no more names with the prefix.
+                    break
+                continue
+            if extensions is not None and not name.endswith(extensions):
+                continue
+            size = int(row[2])
+            if size < min_size or (max_size is not None and size > max_size):
+                continue
+            ids.append(int(row[0]))
+            sizes.append(size)
+            names.append(name)
+            if len(names) == batch_size:
+                yield ids, sizes, names
+                ids, sizes, names = array.array('Q'), array.array('Q'), []
+    if names:
+        yield ids, sizes, names
+
+
+def iterate_binary_batches(index: 'BinaryIndex', batch_size: int, extensions: Optional[Tuple[str, ...]], prefix: str,
+                           min_size: int, max_size: Optional[int]) -> Iterator[RawBatch]:
+    # The prefix is found by binary search, so only the entries with the prefix are read at all.
+    start, stop = index.prefix_range(prefix) if prefix else (0, len(index))
+    filtered = extensions is not None or min_size > 0 or max_size is not None
+    for batch_start in range(start, stop, batch_size):
+        batch_stop = min(batch_start + batch_size, stop)
+        names = [raw_name.decode('utf-8') for raw_name in index.iter_raw_names(batch_start, batch_stop)]
+        ids, sizes = array.array('Q'), array.array('Q')
+        if not filtered:
+            # Copied straight out of the memory-mapped arrays.
+            ids.frombytes(index.ids[batch_start:batch_stop].cast('B'))
+            sizes.frombytes(index.sizes[batch_start:batch_stop].cast('B'))
+            yield ids, sizes, names
+            continue
+        kept = []
+        for i, name in enumerate(names, start=batch_start):
+            if extensions is not None and not name.endswith(extensions):
+                continue
+            size = index.sizes[i]
+            if size < min_size or (max_size is not None and size > max_size):
+                continue
+            ids.append(index.ids[i])
+            sizes.append(size)
+            kept.append(name)
+        if kept:
+            yield ids, sizes, kept
+
+
+def iterate_index_batches(index_file: str=INDEX_FILE, batch_size: int=BATCH_SIZE,
+                          extensions: Optional[Iterable[str]]=None, prefix: str='', min_size: int=0,
+                          max_size: Optional[int]=None, as_numpy: bool=False) -> Iterator[IndexBatch]:
+    """
+    Reads the entries of an index in batches, keeping only those that match all of the given filters. The filters are
+    applied while the index is read, so the entries that do not match are never converted. Since the index is sorted
+    by name, a prefix only reads the part of the index with that prefix. For example, the total size of the POM files
+    of Apache projects is:
+
+        sum(batch.sizes.sum() for batch in iterate_index_batches(index_file, extensions=['pom'],
+                                                                 prefix='repos/central/data/org/apache/',
+                                                                 as_numpy=True))
+
+    :param index_file: the index to read, in any of the forms accepted by `read_index`
+    :param batch_size: the maximum number of entries in each batch
+    :param extensions: if given, only the names ending in one of these extensions (such as `pom` or `jar.sha1`)
+    :param prefix: only the names starting with this prefix
+    :param min_size: only the blobs of at least this many bytes
+    :param max_size: if given, only the blobs of at most this many bytes
+    :param as_numpy: whether to return the blob numbers and sizes as NumPy arrays, which requires NumPy
+    :return: an iterator over the non-empty batches, in index order
+    """
+    # Imported here because `binary_index` itself builds on this module.
+    from binary_index import BinaryIndex, is_binary_index
+    extensions = normalize_extensions(extensions)
+    if is_binary_index(index_file):
+        with BinaryIndex(index_file) as index:
+            for ids, sizes, names in iterate_binary_batches(index, batch_size, extensions, prefix, min_size, max_size):
+                yield make_batch(ids, sizes, names, as_numpy)
+    else:
+        for ids, sizes, names in iterate_text_batches(index_file, batch_size, extensions, prefix, min_size, max_size):
+            yield make_batch(ids, sizes, names, as_numpy)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Counts the blobs in an index that match the filters, and their total "
+                                                 "size in bytes.")
+    parser.add_argument('index_file', nargs='?', default=INDEX_FILE)
+    parser.add_argument('--extension', '-e', action='append', dest='extensions', default=None)
+    parser.add_argument('--prefix', '-p', default='')
+    parser.add_argument('--min-size', type=int, default=0)
+    parser.add_argument('--max-size', type=int, default=None)
+    args = parser.parse_args()
+
+    count = 0
+    total_size = 0
+    for batch in iterate_index_batches(args.index_file, extensions=args.extensions, prefix=args.prefix,
+                                       min_size=args.min_size, max_size=args.max_size):
+        count += len(batch.names)
+        total_size += sum(batch.sizes)
+    print(f"{count}\t{total_size}")
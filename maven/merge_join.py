@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Compares any number of sorted lists in a single pass, in the way that `comm` compares two. Each line of each input is
+reduced to a key, and the keys of all the inputs are merged in order, so that for every key it is known which inputs
+have it. From that, these relations are written to an output directory, numbering the inputs from 1:
+
+    intersection.txt    the keys that are in every input
+    only-N.txt          the keys that are in input N and in no other input
+    missing-N.txt       the keys that are in some other input but not in input N
+
+With two inputs A and B, for example, `only-1.txt` is A - B, `only-2.txt` is B - A, and `intersection.txt` is A & B.
+
+The key of a line is the whole line by default. With `--field`, it is a single tab-separated field instead, either of
+every input (`--field 2`) or of a single one (`--field 1:2` selects the names in the index when it is the first input,
+and can be repeated for other inputs). Lines without that field are reported and skipped. With `--strip-suffix` (which
+can be repeated), one of the given suffixes is removed from the end of the key. The inputs must be sorted by key, in
+byte order (as with `LC_ALL=C sort`); duplicate keys are allowed. Stripping suffixes generally leaves the keys only
+nearly sorted, though, so `--sort` sorts each input's keys first, with the external sort of `uniqsemisort.py`.
+
+The inputs are read in large blocks (optionally through `mmap`), rather than a line at a time.
+"""
+
+import heapq
+import itertools
+import mmap
+import os
+import sys
+import tempfile
+
+from download_blobs import MavenIndexingException, error_context, eshow
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+from uniqsemisort import uniqsemisort
+
+
+BLOCK_SIZE = 4 * 1024 * 1024
+INTERSECTION_FILE = 'intersection.txt'
+
+
+class UnsortedInputException(MavenIndexingException):
+    def __init__(self, input_file: str, key: bytes):
+        super().__init__(f"Input is not sorted at key {key.decode('utf-8', 'replace')} in: {input_file}.")
+
+
+class MissingFieldException(MavenIndexingException):
+    def __init__(self, field: int, line: bytes):
+        super().__init__(f"Line has no field {field}: {line.decode('utf-8', 'replace')}")
+
+
+def iter_blocks(input_file: str, block_size: int=BLOCK_SIZE, use_mmap: bool=False) -> Iterator[List[bytes]]:
+    """
+    Reads the lines of a file in blocks.
+
+    :param input_file: the file to read
+    :param block_size: the approximate number of bytes in each block
+    :param use_mmap: whether to read the file through `mmap` instead of reading it into buffers
+    :return: an iterator over blocks of lines, without their newlines
+    """
+    with open(input_file, 'rb') as f:
+        if use_mmap and os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                size = len(mm)
+                pos = 0
+                while pos < size:
+                    # End each block after the last newline within it (or, for a very long line, the next one).
+                    end = mm.rfind(b'\n', pos, pos + block_size) + 1 or mm.find(b'\n', pos + block_size) + 1 or size
+                    lines = mm[pos:end].split(b'\n')
+                    if lines[-1] == b'':
+                        lines.pop()
+                    yield lines
+                    pos = end
+        else:
+            carry = b''
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                lines = (carry + block).split(b'\n')
+                carry = lines.pop()
+                yield lines
+            if carry:
+                yield [carry]
+
+
+def make_key_function(field: Optional[int]=None, strip_suffixes: Sequence[str]=()) -> Callable[[bytes], bytes]:
+    """
+    :param field: the tab-separated field to use as the key, numbered from 1, or `None` for the whole line
+    :param strip_suffixes: suffixes to remove from the end of the key, if it has one
+    :return: a function to extract the key from a line, which raises `MissingFieldException` for a non-empty line that
+             does not have the field
+    """
+    suffixes = tuple(suffix.encode('utf-8') for suffix in strip_suffixes)
+
+    def get_key(line: bytes) -> bytes:
+        key = line.rstrip()
+        if field is not None and key:
+            fields = key.split(b'\t', field)
+            if len(fields) < field:
+                raise MissingFieldException(field, key)
+            key = fields[field - 1]
+        if suffixes and key.endswith(suffixes):
+            for suffix in suffixes:
+                if key.endswith(suffix):
+                    return key[:-len(suffix)]
+        return key
+
+    return get_key
+
+
+def get_keys(input_file: str, lines: List[bytes], get_key: Callable[[bytes], bytes]) -> List[bytes]:
+    """
+    :return: the keys of a block of lines, leaving out (and reporting) the lines that have no key
+    """
+    try:
+        return list(map(get_key, lines))
+    except MissingFieldException:
+        keys = []
+        for line in lines:
+            with error_context(input_file):
+                keys.append(get_key(line))
+        return keys
+
+
+def read_keys(input_file: str, get_key: Callable[[bytes], bytes]=bytes.rstrip, block_size: int=BLOCK_SIZE,
+              use_mmap: bool=False) -> Iterator[bytes]:
+    """
+    Reads the distinct keys of a sorted input, skipping empty keys.
+
+    :param input_file: the file to read
+    :param get_key: the function to extract the key from a line
+    :param block_size: the approximate number of bytes to read at once
+    :param use_mmap: whether to read the file through `mmap`
+    :return: an iterator over the keys, in order
+    """
+    previous = b''
+    for lines in iter_blocks(input_file, block_size, use_mmap):
+        for key in get_keys(input_file, lines, get_key):
+            if key > previous:
+                yield key
+                previous = key
+            elif key and key != previous:
+                raise UnsortedInputException(input_file, key)
+
+
+def sort_keys(input_file: str, get_key: Callable[[bytes], bytes], tmp_dir: str, block_size: int=BLOCK_SIZE,
+              use_mmap: bool=False) -> str:
+    """
+    Writes the sorted, distinct keys of an input to a temporary file.
+
+    :return: the file of sorted keys, which can be read with `read_keys` without a key function
+    """
+    fd, keys_file = tempfile.mkstemp(dir=tmp_dir, suffix='.keys')
+    with open(fd, 'wb') as f:
+        for lines in iter_blocks(input_file, block_size, use_mmap):
+            keys = get_keys(input_file, lines, get_key)
+            keys.append(b'')
+            f.write(b'\n'.join(keys))
+    sorted_file = keys_file + '.sorted'
+    uniqsemisort(keys_file, output_file=sorted_file, temp_dir=tmp_dir)
+    os.remove(keys_file)
+    return sorted_file
+
+
+def merge_join(inputs: List[Iterator[bytes]]) -> Iterator[Tuple[bytes, int]]:
+    """
+    Merges sorted streams of distinct keys.
+
+    :param inputs: the streams of keys
+    :return: an iterator over every key of any input, in order, along with a bit mask of the inputs that have it (bit
+             `i` for `inputs[i]`)
+    """
+    tagged = [zip(keys, itertools.repeat(1 << i)) for i, keys in enumerate(inputs)]
+    current = None
+    members = 0
+    for key, bit in heapq.merge(*tagged):
+        if key != current:
+            if current is not None:
+                yield current, members
+            current = key
+            members = 0
+        members |= bit
+    if current is not None:
+        yield current, members
+
+
+def join_files(input_files: List[str], output_dir: str, fields: Optional[Sequence[Optional[int]]]=None,
+               strip_suffixes: Sequence[str]=(), sort: bool=False, block_size: int=BLOCK_SIZE, use_mmap: bool=False,
+               temp_dir: Optional[str]=None):
+    """
+    Writes the relations between the inputs described in the module documentation.
+
+    :param input_files: the files to compare
+    :param output_dir: the directory to write the relations into
+    :param fields: the tab-separated field of each input to use as its key, numbered from 1, or `None` for the whole
+                   line (which is the default for every input)
+    :param strip_suffixes: suffixes to remove from the end of the keys
+    :param sort: whether to sort the inputs' keys first, rather than requiring them to be sorted already
+    :param block_size: the approximate number of bytes to read at once
+    :param use_mmap: whether to read the inputs through `mmap`
+    :param temp_dir: the directory for the sorted keys, if the inputs are sorted, or `None` for the system's default
+    """
+    if fields is None:
+        fields = [None] * len(input_files)
+    key_functions = [make_key_function(field, strip_suffixes) for field in fields]
+    all_members = (1 << len(input_files)) - 1
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = []
+    with tempfile.TemporaryDirectory(dir=temp_dir) as tmp_dir:
+        try:
+            if sort:
+                inputs = [read_keys(sort_keys(input_file, get_key, tmp_dir, block_size, use_mmap), bytes.rstrip,
+                                    block_size, use_mmap)
+                          for input_file, get_key in zip(input_files, key_functions)]
+            else:
+                inputs = [read_keys(input_file, get_key, block_size, use_mmap)
+                          for input_file, get_key in zip(input_files, key_functions)]
+            intersection = open(os.path.join(output_dir, INTERSECTION_FILE), 'wb')
+            outputs.append(intersection)
+            only = []
+            missing = []
+            for n in range(1, len(input_files) + 1):
+                only.append(open(os.path.join(output_dir, f"only-{n}.txt"), 'wb'))
+                missing.append(open(os.path.join(output_dir, f"missing-{n}.txt"), 'wb'))
+                outputs += [only[-1], missing[-1]]
+            counts = [0] * len(outputs)
+            for key, members in merge_join(inputs):
+                line = key + b'\n'
+                if members == all_members:
+                    intersection.write(line)
+                    counts[0] += 1
+                    continue
+                for i in range(len(input_files)):
+                    if members == 1 << i:
+                        only[i].write(line)
+                        counts[1 + 2 * i] += 1
+                    elif not members & (1 << i):
+                        missing[i].write(line)
+                        counts[2 + 2 * i] += 1
+        finally:
+            for output in outputs:
+                output.close()
+    for output, count in zip(outputs, counts):
+        eshow(f"{os.path.basename(output.name)}\t{count}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_files', nargs='+')
+    parser.add_argument('--output-dir', '-o', required=True)
+    parser.add_argument('--field', '-k', action='append', dest='fields', default=[],
+                        help="The tab-separated field to use as the key, numbered from 1, as `N` for every input or "
+                             "`INPUT:N` for the input numbered `INPUT` from 1. Can be repeated.")
+    parser.add_argument('--strip-suffix', '-s', action='append', dest='strip_suffixes', default=[])
+    parser.add_argument('--sort', action='store_true', help="Sort each input's keys first.")
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    parser.add_argument('--mmap', action='store_true')
+    parser.add_argument('--temp-dir', '-T', default=None)
+    args = parser.parse_args()
+
+    # A field given for a single input takes precedence over one given for every input.
+    default_field = None
+    input_fields = {}
+    for spec in args.fields:
+        input_no, _, field = spec.rpartition(':')
+        if not field.isdigit() or int(field) < 1 or input_no and not input_no.isdigit():
+            parser.error(f"invalid --field: {spec}")
+        if not input_no:
+            default_field = int(field)
+        elif 1 <= int(input_no) <= len(args.input_files):
+            input_fields[int(input_no)] = int(field)
+        else:
+            parser.error(f"--field {spec} refers to input {input_no}, but there are {len(args.input_files)} inputs")
+    fields = [input_fields.get(n, default_field) for n in range(1, len(args.input_files) + 1)]
+
+    try:
+        join_files(args.input_files, args.output_dir, fields, args.strip_suffixes, args.sort, args.block_size,
+                   args.mmap, args.temp_dir)
+    except UnsortedInputException as e:
+        eshow(f"{e.message} Use --sort to sort the inputs first.")
+        sys.exit(1)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+A persistent set of the blob names in the index, for checking whether blobs exist without sorting anything or making
+any requests. The filter is built once from the index and is then memory-mapped, so opening it is instant and each
+check reads only a few bytes of it.
+
+The filter is an open-addressed hash table of 64-bit hashes of the names, with linear probing, stored as:
+
+    header    magic, version, slot count, name count (padded to 32 bytes)
+    slots     uint64[slot count]    the hashes of the names, or zero for an empty slot
+
+Since only the hashes are stored, two different names could in principle share a hash; with 64-bit hashes, the odds of
+a false positive over millions of checks are negligible. Where they are not, the filter can be given the binary index
+converted by `binary_index.py`, and every name the filter finds is then confirmed by a binary search of the index.
+Names that the filter does not find are never in the index.
+"""
+
+import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+from binary_index import BinaryIndex, is_binary_index
+from download_blobs import error_context, eshow, parse_work_line
+from iterate_index import INDEX_FILE, read_index
+from typing import Optional
+
+
+FILTER_FILE = 'index.filter'
+MAGIC = b'JADENSF\0'
+VERSION = 1
+# magic, version, slot count, name count
+HEADER = struct.Struct('<8sIQQ')
+SLOTS_OFFSET = 32
+# The table is kept at most half full, so that probe sequences stay short.
+MAX_LOAD_FACTOR = 0.5
+
+
+def hash_name(name: str) -> int:
+    """
+    :param name: a blob name
+    :return: the 64-bit hash of the name, which is never zero since zero marks an empty slot
+    """
+    value = int.from_bytes(hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest(), 'little')
+    return value or 1
+
+
+def build_filter(index_file: str, filter_file: str):
+    """
+    Builds a filter of the names in an index.
+
+    :param index_file: the index, in any of the forms accepted by `read_index`
+    :param filter_file: the filter to write
+    """
+    hashes = array.array('Q', (hash_name(entry.name) for entry in read_index(index_file)))
+    slot_count = 1
+    while slot_count * MAX_LOAD_FACTOR < max(len(hashes), 1):
+        slot_count *= 2
+    mask = slot_count - 1
+    slots = array.array('Q', bytes(8 * slot_count))
+    count = 0
+    for value in hashes:
+        i = value & mask
+        while slots[i] != 0 and slots[i] != value:
+            i = (i + 1) & mask
+        if slots[i] == 0:
+            slots[i] = value
+            count += 1
+    del hashes
+    with open(filter_file + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, slot_count, count).ljust(SLOTS_OFFSET, b'\0'))
+        slots.tofile(f)
+    os.replace(filter_file + '.tmp', filter_file)
+
+
+class NameFilter:
+    """
+    A memory-mapped filter of the names in an index. Use `name in name_filter` to check whether a blob exists.
+    """
+    def __init__(self, filter_file: str, index_file: Optional[str]=None):
+        """
+        :param filter_file: the filter built with `build_filter`
+        :param index_file: a binary index of the same names, to confirm the names the filter finds, or `None` to rely
+                           on the filter alone
+        """
+        if sys.byteorder != 'little':
+            raise RuntimeError("The name filter can only be memory-mapped on little-endian machines.")
+        if index_file is not None and not is_binary_index(index_file):
+            raise ValueError(f"Names can only be confirmed with a binary index: {index_file}.")
+        with open(filter_file, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, slot_count, self.count = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f"Not a name filter: {filter_file}.")
+        if version != VERSION:
+            raise ValueError(f"Unsupported name filter version {version} in: {filter_file}.")
+        self.mask = slot_count - 1
+        self.slots = memoryview(self.mmap)[SLOTS_OFFSET:SLOTS_OFFSET + 8 * slot_count].cast('Q')
+        self.index = None if index_file is None else BinaryIndex(index_file)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, name: str) -> bool:
+        value = hash_name(name)
+        slots = self.slots
+        i = value & self.mask
+        while True:
+            slot = slots[i]
+            if slot == value:
+                return self.index is None or self.index.find(name) is not None
+            if slot == 0:
+                return False
+            i = (i + 1) & self.mask
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+        self.slots.release()
+        self.mmap.close()
+
+    def __enter__(self) -> 'NameFilter':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def filter_names(filter_file: str, blob_names_file: Optional[str], index_file: Optional[str], missing: bool):
+    """
+    Prints the lines of a list of blobs whose names are in the filter (or, if `missing` is set, are not). Malformed
+    lines are reported and skipped.
+
+    :param filter_file: the filter built with `build_filter`
+    :param blob_names_file: the file of blob names (or index lines), or `None` to read from stdin
+    :param index_file: a binary index to confirm the names the filter finds, if any
+    :param missing: whether to print the lines whose names are not in the filter instead
+    """
+    f = sys.stdin if blob_names_file is None else open(blob_names_file)
+    try:
+        with NameFilter(filter_file, index_file) as name_filter:
+            for raw_line in f:
+                name = None
+                with error_context(raw_line.strip()):
+                    name = parse_work_line(raw_line).name
+                if name and (name in name_filter) != missing:
+                    sys.stdout.write(raw_line)
+    finally:
+        f.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    build_parser = subparsers.add_parser('build', help="Build a filter of the names in an index.")
+    build_parser.add_argument('index_file', nargs='?', default=INDEX_FILE)
+    build_parser.add_argument('filter_file', nargs='?', default=FILTER_FILE)
+    filter_parser = subparsers.add_parser('filter', help="Print the blobs of a list that are in the index.")
+    filter_parser.add_argument('filter_file', nargs='?', default=FILTER_FILE)
+    filter_parser.add_argument('--blob-names-file', '-f', default=None)
+    filter_parser.add_argument('--index-file', '-i', default=None,
+                               help="A binary index to confirm the names that the filter finds.")
+    filter_parser.add_argument('--missing', action='store_true', help="Print the blobs that are not in the index.")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_filter(args.index_file, args.filter_file)
+        with NameFilter(args.filter_file) as built:
+            eshow(f"Built a filter of {len(built)} names.")
+    else:
+        filter_names(args.filter_file, args.blob_names_file, args.index_file, args.missing)
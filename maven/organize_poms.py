@@ -10,8 +10,8 @@ import os.path
 import shutil
 import sys
 
-from lxml import etree
-from typing import ContextManager, Iterator, NamedTuple, Optional, Type, Union
+from typing import ContextManager, Iterator, NamedTuple, Optional, Type
+from xml_header import Header, extract_pom_header
 
 
 ########
@@ -24,16 +24,6 @@ OUTPUT = sys.stdout
 ERR_OUTPUT = sys.stderr
 
 
-def _make_tag(tag: str) -> str:
-    return '{*}' + tag
-
-
-PARENT_TAG = _make_tag('parent')
-MODEL_TAG = _make_tag('modelVersion')
-GROUP_ID_TAG = _make_tag('groupId')
-ARTIFACT_ID_TAG = _make_tag('artifactId')
-VERSION_TAG = _make_tag('version')
-
 SUPPORTED_MODEL_VERSIONS = {'4.0.0'}
 
 
@@ -42,11 +32,6 @@ SUPPORTED_MODEL_VERSIONS = {'4.0.0'}
 ####
 
 
-# Provide short names and reduce number of warnings due to accessing protected members.
-Element = etree._Element
-ElementTree = etree._ElementTree
-
-
 class PomTuple(NamedTuple):
     group_id: str
     artifact_id: str
@@ -61,10 +46,6 @@ def tup_to_path(tup: PomTuple) -> str:
     return os.path.join(grp, art, ver, filename)
 
 
-def elems_to_tup(group_id_elem: Element, artifact_id_elem: Element, version_elem: Element) -> PomTuple:
-    return PomTuple(group_id_elem.text, artifact_id_elem.text, version_elem.text)
-
-
 ########
 # Custom printing functions
 ####
@@ -167,14 +148,6 @@ def scandir(dir_path: Optional[str]) -> ContextManager[Iterator[os.DirEntry]]:
     return os.scandir(dir_path)
 
 
-def parse(path: str) -> ElementTree:
-    return etree.parse(path)
-
-
-def find(base: Union[ElementTree, Element], path: str) -> Optional[Element]:
-    return base.find(path)
-
-
 def relocate(src: str, dest: str):
     if os.path.isfile(dest):
         raise DestinationFileExists(dest)
@@ -185,59 +158,58 @@ def relocate(src: str, dest: str):
         shutil.move(src, dest)
 
 
-def find_tag_text(xml: ElementTree, parent: Optional[Element], search_tag: str, tag: str,
-                  missing_exception: Type[Exception]) -> Element:
-    elem = find(xml, search_tag)
+def find_tag_text(header: Header, search_tag: str, tag: str, missing_exception: Type[Exception]) -> str:
+    text = header.get((search_tag,))
     check_parent = False
-    if elem is not None:
-        if '$' in elem.text:
+    if (search_tag,) in header:
+        if '$' in text:
             check_parent = True
         else:
-            return elem
-    if check_parent or elem is None:
-        if parent is None:
+            return text
+    if check_parent or (search_tag,) not in header:
+        if ('parent',) not in header:
             raise NoParentTagException()
-        elem = find(parent, search_tag)
-        if elem is None:
+        if ('parent', search_tag) not in header:
             raise missing_exception()
-        if '$' in elem.text:
+        text = header[('parent', search_tag)]
+        if '$' in text:
             raise VariableInTextException(tag)
         else:
-            return elem
+            return text
     raise missing_exception()
 
 
-def find_group_id(xml: ElementTree, parent: Optional[Element]) -> Element:
-    return find_tag_text(xml, parent, GROUP_ID_TAG, "<groupId>", NoGroupIdTagException)
+def find_group_id(header: Header) -> str:
+    return find_tag_text(header, 'groupId', "<groupId>", NoGroupIdTagException)
 
 
-def find_artifact_id(xml: ElementTree, parent: Optional[Element]) -> Element:
-    return find_tag_text(xml, parent, ARTIFACT_ID_TAG, "<artifactId>", NoArtifactIdTagException)
+def find_artifact_id(header: Header) -> str:
+    return find_tag_text(header, 'artifactId', "<artifactId>", NoArtifactIdTagException)
 
 
-def find_version(xml: ElementTree, parent: Optional[Element]) -> Element:
-    return find_tag_text(xml, parent, VERSION_TAG, "<version>", NoVersionTagException)
+def find_version(header: Header) -> str:
+    return find_tag_text(header, 'version', "<version>", NoVersionTagException)
 
 
-def verify_model_version(xml: ElementTree):
-    model = find(xml, MODEL_TAG)
-    if model is None:
+def verify_model_version(header: Header):
+    if ('modelVersion',) not in header:
         # There should always be a <modelVersion> tag.
         raise NoModelVersionTagException()
-    model_version = model.text.strip()
+    model_version = header[('modelVersion',)].strip()
     if model_version not in SUPPORTED_MODEL_VERSIONS:
         # We only know how to parse version 4.0.0.
         raise WrongModelVersionException(model_version)
 
 
 def extract_tup_from_pom(pom_path: str) -> PomTuple:
-    xml = parse(pom_path)
-    verify_model_version(xml)
-    parent = find(xml, PARENT_TAG)
-    group_id = find_group_id(xml, parent)
-    artifact_id = find_artifact_id(xml, parent)
-    version = find_version(xml, parent)
-    return elems_to_tup(group_id, artifact_id, version)
+    # Only the first few fields of the POM are parsed, unless some of them are missing there. A POM that is truncated
+    # still raises an error, but one that is malformed after those fields in some other way does not.
+    header = extract_pom_header(pom_path)
+    verify_model_version(header)
+    group_id = find_group_id(header)
+    artifact_id = find_artifact_id(header)
+    version = find_version(header)
+    return PomTuple(group_id, artifact_id, version)
 
 
 ########
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Plans a run of `download_blobs.py`. The blobs in a work list are looked up in the index to find their sizes, and are
+then reordered so that large blobs are spread evenly among the small ones. Many small downloads in flight keep the
+connection pool busy, while the large ones keep the disk busy.
+
+The schedule is limited to a byte budget, which defaults to the free space on the download volume (less a reserve), so
+that a run stops cleanly instead of filling the disk. Blobs that do not fit can be written to a separate file to be
+scheduled in a later run. The projected number of bytes and an estimated duration are printed before the schedule is
+written, and so before anything is downloaded.
+
+The schedule is written as index lines, which `download_blobs.py` accepts directly (and which let it verify blobs
+against the md5 sums in the index).
+"""
+
+import shutil
+import sys
+
+from download_blobs import error_context, eshow, parse_work_line
+from iterate_index import INDEX_FILE, IndexEntry, format_index_row, read_index
+from typing import Iterator, List, Optional, Set
+
+
+# Blobs of at least this many bytes are considered large.
+LARGE_BLOB_SIZE = 16 * 1024 * 1024
+# When the budget is taken from the free space on the download volume, this much space is left free.
+DEFAULT_RESERVE = 10 * 1024 * 1024 * 1024
+DEFAULT_BANDWIDTH = 50 * 1024 * 1024
+DEFAULT_REQUESTS_PER_SECOND = 100.0
+
+
+def format_size(size: float) -> str:
+    for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+        if size < 1024 or unit == 'TiB':
+            break
+        size /= 1024
+    return f"{size:.1f} {unit}"
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02}m{seconds:02}s"
+
+
+def join_with_index(blob_names_file: Optional[str], index_file: str) -> List[IndexEntry]:
+    """
+    Looks up each blob of the work list in the index. Blobs that are not in the index are reported and dropped, since
+    they cannot be downloaded anyway, and so are malformed lines.
+
+    :param blob_names_file: the file of blob names (or index lines), or `None` to read from stdin
+    :param index_file: the index built with `build_index.py`
+    :return: the index entries of the blobs in the work list, in index order
+    """
+    f = sys.stdin if blob_names_file is None else open(blob_names_file)
+    wanted: Set[str] = set()
+    try:
+        for raw_line in f:
+            with error_context(raw_line.strip()):
+                wanted.add(parse_work_line(raw_line).name)
+    finally:
+        f.close()
+    wanted.discard('')
+    entries = []
+    for entry in read_index(index_file):
+        if entry.name in wanted:
+            wanted.remove(entry.name)
+            entries.append(entry)
+    for name in sorted(wanted):
+        eshow(f"{name}\tCould not find blob in index.")
+    return entries
+
+
+def interleave(entries: List[IndexEntry], large_blob_size: int) -> Iterator[IndexEntry]:
+    """
+    Orders the entries so that the large ones, biggest first, are spread evenly among the small ones. The small ones
+    keep their original (index) order, so that blobs from the same directory stay together.
+
+    :param entries: the entries to order
+    :param large_blob_size: the size from which a blob is considered large
+    :return: an iterator over the entries in their new order
+    """
+    small = [entry for entry in entries if int(entry.size) < large_blob_size]
+    large = sorted((entry for entry in entries if int(entry.size) >= large_blob_size),
+                   key=lambda entry: (-int(entry.size), entry.name))
+    large_it = iter(large)
+    large_emitted = 0
+    for small_emitted, entry in enumerate(small):
+        # Emit large entries at the rate needed to run out of both lists at the same time.
+        while large_emitted * len(small) < small_emitted * len(large):
+            yield next(large_it)
+            large_emitted += 1
+        yield entry
+    yield from large_it
+
+
+def schedule_blobs(blob_names_file: Optional[str], index_file: str, output_file: Optional[str],
+                   deferred_file: Optional[str], max_bytes: Optional[int], download_dir: str, reserve: int,
+                   large_blob_size: int, bandwidth: float, requests_per_second: float):
+    """
+    Writes a schedule for downloading the blobs in a work list. See the module documentation for details.
+
+    :param blob_names_file: the file of blob names (or index lines), or `None` to read from stdin
+    :param index_file: the index built with `build_index.py`
+    :param output_file: the file to write the schedule to, or `None` to write to stdout
+    :param deferred_file: the file to write the blobs that did not fit in the budget to, if any
+    :param max_bytes: the maximum number of bytes to schedule, or `None` to use the free space in `download_dir`
+    :param download_dir: the directory the blobs will be downloaded into
+    :param reserve: the number of bytes to leave free when the budget is taken from the free space
+    :param large_blob_size: the size from which a blob is considered large
+    :param bandwidth: the expected download rate in bytes per second, for estimating the duration
+    :param requests_per_second: the expected request rate, for estimating the duration
+    """
+    if max_bytes is None:
+        max_bytes = max(shutil.disk_usage(download_dir).free - reserve, 0)
+    entries = join_with_index(blob_names_file, index_file)
+    # Decide which blobs fit in the budget first, so that the projection is printed before the schedule is written.
+    schedule = []
+    deferred_entries = []
+    scheduled_bytes = 0
+    deferred_bytes = 0
+    for entry in interleave(entries, large_blob_size):
+        size = int(entry.size)
+        if scheduled_bytes + size <= max_bytes:
+            schedule.append(entry)
+            scheduled_bytes += size
+        else:
+            # Blobs that would overrun the budget are deferred, but smaller ones after them may still fit.
+            deferred_entries.append(entry)
+            deferred_bytes += size
+    eta = max(scheduled_bytes / bandwidth, len(schedule) / requests_per_second)
+    eshow(f"Scheduled {len(schedule)} blobs ({format_size(scheduled_bytes)}) of a budget of "
+          f"{format_size(max_bytes)}. Estimated time: {format_duration(eta)}.")
+    if deferred_entries:
+        eshow(f"Deferred {len(deferred_entries)} blobs ({format_size(deferred_bytes)}) that did not fit in the budget.")
+    out = sys.stdout if output_file is None else open(output_file, 'w')
+    try:
+        out.writelines(map(format_index_row, schedule))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if deferred_file is not None:
+        with open(deferred_file, 'w') as deferred:
+            deferred.writelines(map(format_index_row, deferred_entries))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--blob-names-file', '-f', default=None)
+    parser.add_argument('--index-file', '-i', default=INDEX_FILE)
+    parser.add_argument('--output-file', '-o', default=None)
+    parser.add_argument('--deferred-file', default=None)
+    parser.add_argument('--max-bytes', type=int, default=None)
+    parser.add_argument('--download-dir', '-d', default='.')
+    parser.add_argument('--reserve', type=int, default=DEFAULT_RESERVE)
+    parser.add_argument('--large-blob-size', type=int, default=LARGE_BLOB_SIZE)
+    parser.add_argument('--bandwidth', type=float, default=DEFAULT_BANDWIDTH)
+    parser.add_argument('--requests-per-second', type=float, default=DEFAULT_REQUESTS_PER_SECOND)
+    args = parser.parse_args()
+
+    schedule_blobs(args.blob_names_file, args.index_file, args.output_file, args.deferred_file, args.max_bytes,
+                   args.download_dir, args.reserve, args.large_blob_size, args.bandwidth, args.requests_per_second)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Splits a list of blobs into shards that can be downloaded on separate machines. Rather than splitting by line count
+(which can leave one shard with all of the large distribution archives), the shards are balanced by their total size in
+bytes, as given by the index.
+
+All of the blobs under the same groupId directory are kept on the same shard, so that each machine ends up with whole
+projects, along with their `maven-metadata.xml` files at every level. The groups are assigned largest first, each to the
+shard with the fewest bytes so far, and ties are broken by name, so the same inputs always produce the same shards.
+Within a shard, lines keep their original order.
+"""
+
+import heapq
+import io
+import os.path
+
+from collections import defaultdict
+from download_blobs import error_context, eshow, parse_work_line
+from iterate_index import INDEX_FILE, format_index_row, read_index
+from typing import Dict, Iterator, List, Optional, Set, TextIO, Tuple
+
+
+METADATA_FILE = 'maven-metadata.xml'
+
+
+def group_dir(name: str, artifact_dirs: Set[str]) -> str:
+    """
+    Determines the groupId directory that a blob belongs to. Files of a particular version of an artifact live in
+    `group/artifact/version/`, while the artifact's own metadata lives in `group/artifact/`. Some versions also have
+    their own metadata next to their files, in `group/artifact/version/`, so a metadata file in a directory that also
+    holds other files in the index belongs to the same group as those files.
+
+    :param name: the name of the blob
+    :param artifact_dirs: the directories that hold files other than metadata in the index
+    :return: the directory of the blob's group, or the blob's own directory if it is too shallow to be in a group
+    """
+    parts = name.split('/')
+    if parts[-1].startswith(METADATA_FILE) and os.path.dirname(name) not in artifact_dirs:
+        depth = 2
+    else:
+        depth = 3
+    if len(parts) <= depth:
+        depth = 1
+    return '/'.join(parts[:-depth])
+
+
+def assign_groups(group_sizes: Dict[str, int], shard_count: int) -> Dict[str, int]:
+    """
+    Assigns groups to shards, largest first, each to the shard with the fewest bytes so far.
+
+    :param group_sizes: the total size of each group
+    :param shard_count: the number of shards
+    :return: the shard number of each group
+    """
+    shards = [(0, shard) for shard in range(shard_count)]
+    assignments = {}
+    for group, size in sorted(group_sizes.items(), key=lambda item: (-item[1], item[0])):
+        load, shard = heapq.heappop(shards)
+        assignments[group] = shard
+        heapq.heappush(shards, (load + size, shard))
+    return assignments
+
+
+def shard_blobs(blob_names_file: Optional[str], index_file: str, shard_count: int, output_prefix: str):
+    """
+    Splits a list of blobs into `shard_count` shards balanced by size. See the module documentation for details.
+
+    :param blob_names_file: the file of blob names (or index lines), or `None` to shard the whole index
+    :param index_file: the index built with `build_index.py`, which may be compressed or binary
+    :param shard_count: the number of shards to produce
+    :param output_prefix: the prefix of the shard files' names, which end in the shard number and `.txt`
+    """
+    def read_list(err_output: Optional[TextIO]=None) -> Iterator[Tuple[str, str]]:
+        """
+        :param err_output: where to report malformed lines, which are skipped, instead of `eshow`
+        :return: an iterator over the name of each listed blob along with its line, which comes from the index if no
+                 list of blobs was given
+        """
+        if blob_names_file is None:
+            for entry in read_index(index_file):
+                yield entry.name, format_index_row(entry)
+        else:
+            with open(blob_names_file) as f:
+                for raw_line in f:
+                    name = None
+                    with error_context(raw_line.strip(), err_output):
+                        name = parse_work_line(raw_line).name
+                    if name:
+                        yield name, raw_line
+
+    listed: Optional[Set[str]] = None
+    if blob_names_file is not None:
+        listed = {name for name, _ in read_list()}
+    # Total up the sizes of the listed blobs from the index, along with the directories holding versions' files, so that
+    # the metadata next to those files can be kept with them. Until every such directory is known, the sizes of metadata
+    # files are only totalled by their directory.
+    artifact_dirs: Set[str] = set()
+    group_sizes: Dict[str, int] = defaultdict(int)
+    metadata_dir_sizes: Dict[str, int] = defaultdict(int)
+    for entry in read_index(index_file):
+        is_metadata = os.path.basename(entry.name).startswith(METADATA_FILE)
+        if not is_metadata:
+            artifact_dirs.add(os.path.dirname(entry.name))
+        if listed is not None:
+            if entry.name not in listed:
+                continue
+            listed.remove(entry.name)
+        if is_metadata:
+            metadata_dir_sizes[os.path.dirname(entry.name)] += int(entry.size)
+        else:
+            group_sizes[group_dir(entry.name, artifact_dirs)] += int(entry.size)
+    for directory, size in metadata_dir_sizes.items():
+        group_sizes[group_dir(os.path.join(directory, METADATA_FILE), artifact_dirs)] += size
+    del metadata_dir_sizes
+    # Listed blobs that are not in the index still need a shard, if an empty one.
+    for name in listed or ():
+        group_sizes.setdefault(group_dir(name, artifact_dirs), 0)
+    del listed
+    assignments = assign_groups(group_sizes, shard_count)
+    shard_sizes: List[int] = [0] * shard_count
+    for group, shard in assignments.items():
+        shard_sizes[shard] += group_sizes[group]
+    # Write each line to its group's shard, in the original order.
+    width = len(str(shard_count - 1))
+    outputs = [open(f"{output_prefix}{shard:0{width}}.txt", 'w') for shard in range(shard_count)]
+    try:
+        # Malformed lines were already reported above.
+        for name, line in read_list(io.StringIO()):
+            outputs[assignments[group_dir(name, artifact_dirs)]].write(line)
+    finally:
+        for output in outputs:
+            output.close()
+    for shard, size in enumerate(shard_sizes):
+        eshow(f"{os.path.basename(outputs[shard].name)}\t{size}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('shard_count', type=int)
+    parser.add_argument('--blob-names-file', '-f', default=None)
+    parser.add_argument('--index-file', '-i', default=INDEX_FILE)
+    parser.add_argument('--output-prefix', '-o', default='shard-')
+    args = parser.parse_args()
+    if args.shard_count < 1:
+        parser.error("shard_count must be at least 1")
+
+    shard_blobs(args.blob_names_file, args.index_file, args.shard_count, args.output_prefix)
@@ -1,139 +1,960 @@
-import csv
+#!/usr/bin/env python3
+import bisect
+import heapq
+import itertools
+import mmap
+import os
 import pickle
 import re
-from typing import Dict, Optional, Set, Sequence
+import shutil
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from iterate_index import INDEX_FILE, read_index
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Sequence, Tuple, Union
+
+
+# Marks a missing node, leaf, or segment in the trie's arrays.
+NONE = 0xFFFFFFFF
+ROOT = 0
+# The minimum size of a node with no leaves under it.
+NO_MIN_SIZE = 0xFFFFFFFFFFFFFFFF
+# Nodes with up to this many children find them by walking the list of children; wider nodes use `CompactTrie.edges`.
+MAX_LISTED_CHILDREN = 8
+
+# Names are split into segments at every run of characters other than letters, digits, and underscores.
+WORD_PATTERN = re.compile(r'\w+')
+# When building a trie in parallel, names are sharded by at most this many of their first segments.
+MAX_SHARD_DEPTH = 8
+# The shards are planned from a sample of every this-many-th name.
+SHARD_SAMPLE_INTERVAL = 16
+
+TRIE_MAGIC = b'JADETRIE'
+TRIE_VERSION = 1
+# magic, version, the number of the node that was dumped, and the numbers of nodes, leaves, and strings
+TRIE_HEADER = struct.Struct('<8sIIQQQ')
+TRIE_HEADER_SIZE = 64
+
+
+class CompactTrie:
+    """
+    The storage behind `TrieNode`. Rather than one Python object per node (each with its own dicts), the whole trie is
+    kept in a few flat arrays indexed by node number, which take a few dozen bytes per node:
+
+    * Segments are interned: each distinct segment is stored once in `strings`, and nodes refer to it by number.
+    * Each node has its segment, its parent, its number of children, its first child and next sibling (so the children
+      of a node form a linked list), and its first leaf.
+    * Each node also has aggregates of all of the leaves in its subtree (including its own): their number, their total
+      size, and their minimum and maximum sizes. Adding a leaf updates these on the path up to the root, so they are
+      always current and any node's can be read in constant time.
+    * Most nodes have only one or two children, which are found by walking the list. For nodes with more than
+      `MAX_LISTED_CHILDREN` children, `edges` maps the node and the segment of each child (as `node * 2**32 +
+      segment`) to that child instead.
+    * Leaves are kept in their own arrays of blob numbers and sizes, linked into a list for each node.
+
+    Node 0 is the root, which has no segment and no parent.
+    """
+    def __init__(self):
+        self.strings: List[str] = []
+        self.string_ids: Dict[str, int] = {}
+        self.segments = array('I', [NONE])
+        self.parents = array('I', [NONE])
+        self.child_counts = array('I', [0])
+        self.first_children = array('I', [NONE])
+        self.next_siblings = array('I', [NONE])
+        self.first_leaves = array('I', [NONE])
+        self.leaf_counts = array('Q', [0])
+        self.total_sizes = array('Q', [0])
+        self.min_sizes = array('Q', [NO_MIN_SIZE])
+        self.max_sizes = array('Q', [0])
+        self.edges: Dict[int, int] = {}
+        self.leaf_blob_ids = array('Q')
+        self.leaf_sizes = array('Q')
+        self.next_leaves = array('I')
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def intern(self, segment: str) -> int:
+        string_id = self.string_ids.get(segment)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(segment)
+            self.string_ids[segment] = string_id
+        return string_id
+
+    def segment(self, node: int) -> Optional[str]:
+        string_id = self.segments[node]
+        return None if string_id == NONE else self.strings[string_id]
+
+    def parent(self, node: int) -> Optional[int]:
+        parent = self.parents[node]
+        return None if parent == NONE else parent
+
+    def find_child(self, node: int, string_id: int) -> Optional[int]:
+        if self.child_counts[node] > MAX_LISTED_CHILDREN:
+            return self.edges.get(node << 32 | string_id)
+        segments = self.segments
+        next_siblings = self.next_siblings
+        child = self.first_children[node]
+        while child != NONE:
+            if segments[child] == string_id:
+                return child
+            child = next_siblings[child]
+        return None
+
+    def child(self, node: int, segment: str) -> Optional[int]:
+        string_id = self.string_ids.get(segment)
+        if string_id is None:
+            return None
+        return self.find_child(node, string_id)
+
+    def add_child(self, node: int, segment: str) -> int:
+        """
+        :return: the child of `node` with the given segment, which is created if it does not exist yet
+        """
+        string_id = self.intern(segment)
+        child = self.find_child(node, string_id)
+        if child is not None:
+            return child
+        return self.append_child(node, string_id)
+
+    def append_child(self, node: int, string_id: int) -> int:
+        """
+        Adds a new child to `node`, which must not already have a child with the given segment.
+
+        :return: the new child
+        """
+        child = len(self.segments)
+        self.segments.append(string_id)
+        self.parents.append(node)
+        self.child_counts.append(0)
+        self.first_children.append(NONE)
+        self.next_siblings.append(NONE)
+        self.first_leaves.append(NONE)
+        self.leaf_counts.append(0)
+        self.total_sizes.append(0)
+        self.min_sizes.append(NO_MIN_SIZE)
+        self.max_sizes.append(0)
+        self.link_child(node, child)
+        return child
+
+    def link_child(self, node: int, child: int):
+        """
+        Adds an existing node to the list of children of `node`.
+        """
+        self.next_siblings[child] = self.first_children[node]
+        self.first_children[node] = child
+        count = self.child_counts[node] + 1
+        self.child_counts[node] = count
+        if count > MAX_LISTED_CHILDREN + 1:
+            self.edges[node << 32 | self.segments[child]] = child
+        elif count == MAX_LISTED_CHILDREN + 1:
+            # The node has become too wide to walk its children, so index all of them.
+            for sibling in self.iter_children(node):
+                self.edges[node << 32 | self.segments[sibling]] = sibling
+
+    def child_count(self, node: int) -> int:
+        return self.child_counts[node]
+
+    def iter_children(self, node: int) -> Iterator[int]:
+        """
+        :return: an iterator over the children of the node, in the order they were added
+        """
+        # The list is kept most recent first, so that adding a child is constant time.
+        children = []
+        child = self.first_children[node]
+        while child != NONE:
+            children.append(child)
+            child = self.next_siblings[child]
+        return reversed(children)
+
+    def add_leaf(self, node: int, blob_id: int, size: int):
+        """
+        Adds a leaf to a node (or changes its size, if the node already has a leaf for the blob), and updates the
+        aggregates of the node and all of its ancestors.
+        """
+        leaf = self.first_leaves[node]
+        while leaf != NONE:
+            if self.leaf_blob_ids[leaf] == blob_id:
+                old_size = self.leaf_sizes[leaf]
+                if old_size != size:
+                    self.leaf_sizes[leaf] = size
+                    self.resize_leaf(node, old_size, size)
+                return
+            leaf = self.next_leaves[leaf]
+        self.append_leaf(node, blob_id, size)
+        parents = self.parents
+        leaf_counts = self.leaf_counts
+        total_sizes = self.total_sizes
+        min_sizes = self.min_sizes
+        max_sizes = self.max_sizes
+        while node != NONE:
+            leaf_counts[node] += 1
+            total_sizes[node] += size
+            if size < min_sizes[node]:
+                min_sizes[node] = size
+            if size > max_sizes[node]:
+                max_sizes[node] = size
+            node = parents[node]
+
+    def append_leaf(self, node: int, blob_id: int, size: int):
+        """
+        Adds a leaf to a node without checking for an existing leaf for the blob or updating any aggregates.
+        """
+        self.leaf_blob_ids.append(blob_id)
+        self.leaf_sizes.append(size)
+        self.next_leaves.append(self.first_leaves[node])
+        self.first_leaves[node] = len(self.leaf_blob_ids) - 1
+
+    def resize_leaf(self, node: int, old_size: int, size: int):
+        """
+        Updates the aggregates of a node and its ancestors after one of the node's leaves changed size. The minimum or
+        maximum may have been that leaf, so they are recomputed from each node's own leaves and its children's.
+        """
+        while node != NONE:
+            self.total_sizes[node] += size - old_size
+            min_size = NO_MIN_SIZE
+            max_size = 0
+            for _, leaf_size in self.iter_leaves(node):
+                min_size = min(min_size, leaf_size)
+                max_size = max(max_size, leaf_size)
+            for child in self.iter_children(node):
+                min_size = min(min_size, self.min_sizes[child])
+                max_size = max(max_size, self.max_sizes[child])
+            self.min_sizes[node] = min_size
+            self.max_sizes[node] = max_size
+            node = self.parents[node]
+
+    def compute_aggregates(self):
+        """
+        Recomputes the aggregates of every node from scratch, in a single pass. Every child is numbered after its
+        parent, so visiting the nodes in reverse order sees each subtree before its root.
+        """
+        node_count = len(self.segments)
+        self.leaf_counts = array('Q', bytes(8 * node_count))
+        self.total_sizes = array('Q', bytes(8 * node_count))
+        self.min_sizes = array('Q', [NO_MIN_SIZE]) * node_count
+        self.max_sizes = array('Q', bytes(8 * node_count))
+        for node in reversed(range(node_count)):
+            for _, size in self.iter_leaves(node):
+                self.leaf_counts[node] += 1
+                self.total_sizes[node] += size
+                self.min_sizes[node] = min(self.min_sizes[node], size)
+                self.max_sizes[node] = max(self.max_sizes[node], size)
+            parent = self.parents[node]
+            if parent != NONE:
+                self.leaf_counts[parent] += self.leaf_counts[node]
+                self.total_sizes[parent] += self.total_sizes[node]
+                self.min_sizes[parent] = min(self.min_sizes[parent], self.min_sizes[node])
+                self.max_sizes[parent] = max(self.max_sizes[parent], self.max_sizes[node])
+
+    def has_leaves(self, node: int) -> bool:
+        return self.first_leaves[node] != NONE
+
+    def graft(self, other: 'CompactTrie'):
+        """
+        Merges another trie into this one, root to root. Only the nodes the tries have in common are merged one by one;
+        every other node of the other trie is copied, keeping its order, to the end of this trie's arrays in bulk.
+        Grafting the tries built from the shards of an index, whose names differ from the first few segments on, is
+        therefore mostly a linear copy.
+        """
+        string_map = array('I', (self.intern(string) for string in other.strings))
+        merged = {ROOT: ROOT}
+        stack = [ROOT]
+        while stack:
+            other_node = stack.pop()
+            for other_child in other.iter_children(other_node):
+                child = self.find_child(merged[other_node], string_map[other.segments[other_child]])
+                if child is not None:
+                    merged[other_child] = child
+                    stack.append(other_child)
+        # The runs of nodes between the merged ones are copied.
+        runs = []
+        start = 0
+        for other_node in sorted(merged) + [len(other.segments)]:
+            if other_node > start:
+                runs.append((start, other_node))
+            start = other_node + 1
+        node_map = array('I', [NONE]) * len(other.segments)
+        next_node = len(self.segments)
+        for start, end in runs:
+            node_map[start:end] = array('I', range(next_node, next_node + end - start))
+            next_node += end - start
+        for other_node, node in merged.items():
+            node_map[other_node] = node
+        leaf_offset = len(self.leaf_blob_ids)
+        for start, end in runs:
+            self.segments.extend(string_map[string_id] for string_id in other.segments[start:end])
+            self.parents.extend(node_map[parent] for parent in other.parents[start:end])
+            self.child_counts.extend(other.child_counts[start:end])
+            self.first_children.extend(NONE if child == NONE else node_map[child]
+                                       for child in other.first_children[start:end])
+            self.next_siblings.extend(NONE if sibling == NONE else node_map[sibling]
+                                      for sibling in other.next_siblings[start:end])
+            self.first_leaves.extend(NONE if leaf == NONE else leaf + leaf_offset
+                                     for leaf in other.first_leaves[start:end])
+            self.leaf_counts.extend(other.leaf_counts[start:end])
+            self.total_sizes.extend(other.total_sizes[start:end])
+            self.min_sizes.extend(other.min_sizes[start:end])
+            self.max_sizes.extend(other.max_sizes[start:end])
+        self.leaf_blob_ids.extend(other.leaf_blob_ids)
+        self.leaf_sizes.extend(other.leaf_sizes)
+        self.next_leaves.extend(NONE if leaf == NONE else leaf + leaf_offset for leaf in other.next_leaves)
+        for key, other_child in other.edges.items():
+            other_node = key >> 32
+            if other_node not in merged:
+                self.edges[node_map[other_node] << 32 | string_map[key & NONE]] = node_map[other_child]
+        # Link the copied nodes and leaves into the merged nodes, whose totals now also cover the other trie's.
+        needs_aggregates = False
+        for other_node, node in merged.items():
+            self.leaf_counts[node] += other.leaf_counts[other_node]
+            self.total_sizes[node] += other.total_sizes[other_node]
+            self.min_sizes[node] = min(self.min_sizes[node], other.min_sizes[other_node])
+            self.max_sizes[node] = max(self.max_sizes[node], other.max_sizes[other_node])
+            own_blob_ids = {blob_id for blob_id, _ in self.iter_leaves(node)}
+            other_leaf = other.first_leaves[other_node]
+            while other_leaf != NONE:
+                blob_id = other.leaf_blob_ids[other_leaf]
+                if blob_id in own_blob_ids:
+                    # Both tries have this leaf, so the totals above counted it twice.
+                    needs_aggregates = True
+                    self.add_leaf(node, blob_id, other.leaf_sizes[other_leaf])
+                else:
+                    leaf = other_leaf + leaf_offset
+                    self.next_leaves[leaf] = self.first_leaves[node]
+                    self.first_leaves[node] = leaf
+                other_leaf = other.next_leaves[other_leaf]
+            for other_child in other.iter_children(other_node):
+                if other_child not in merged:
+                    self.link_child(node, node_map[other_child])
+        if needs_aggregates:
+            self.compute_aggregates()
+
+    def iter_leaves(self, node: int) -> Iterator[Tuple[int, int]]:
+        """
+        :return: an iterator over the blob numbers and sizes of the node's leaves, in the order they were added
+        """
+        leaves = []
+        leaf = self.first_leaves[node]
+        while leaf != NONE:
+            leaves.append((self.leaf_blob_ids[leaf], self.leaf_sizes[leaf]))
+            leaf = self.next_leaves[leaf]
+        return reversed(leaves)
+
+
+########
+# The memory-mapped trie format
+####
+
+
+def trie_sections(node_count: int, leaf_count: int, string_count: int) -> List[Tuple[str, str, int]]:
+    """
+    Lays out the arrays of a trie file, which follow the header in this order. Each array starts at a multiple of 8
+    bytes, and the UTF-8 bytes of the strings come last.
+
+    :return: the name, array type code, and length of each array
+    """
+    return [('segments', 'I', node_count), ('parents', 'I', node_count), ('first_children', 'I', node_count),
+            ('child_counts', 'I', node_count), ('leaf_starts', 'I', node_count + 1), ('leaf_counts', 'Q', node_count),
+            ('total_sizes', 'Q', node_count), ('min_sizes', 'Q', node_count), ('max_sizes', 'Q', node_count),
+            ('leaf_blob_ids', 'Q', leaf_count), ('leaf_sizes', 'Q', leaf_count),
+            ('string_starts', 'Q', string_count + 1)]
+
+
+def align(offset: int) -> int:
+    return offset + -offset % 8
+
+
+def write_trie(trie: CompactTrie, node_id: int, filename: str):
+    """
+    Writes a trie in the memory-mapped format read by `MappedTrie`. The strings are sorted, and the nodes are numbered
+    breadth first with each node's children in the order of their segments, so that the children of every node are
+    numbered consecutively and can be found by binary search.
+
+    :param trie: the trie to write
+    :param node_id: the node to open when the file is loaded
+    :param filename: the file to write
+    """
+    string_order = sorted(range(len(trie.strings)), key=trie.strings.__getitem__)
+    new_string_ids = array('I', bytes(4 * len(string_order)))
+    for new_string_id, string_id in enumerate(string_order):
+        new_string_ids[string_id] = new_string_id
+    order = array('I', [ROOT])
+    new_ids = array('I', [NONE]) * len(trie)
+    new_ids[ROOT] = ROOT
+    first_children = array('I')
+    for node in order:  # The loop sees the nodes appended to `order` as it runs.
+        children = sorted(trie.iter_children(node), key=lambda child: new_string_ids[trie.segments[child]])
+        first_children.append(len(order) if children else NONE)
+        for child in children:
+            new_ids[child] = len(order)
+            order.append(child)
+    leaf_starts = array('I', [0])
+    leaf_blob_ids = array('Q')
+    leaf_sizes = array('Q')
+    for node in order:
+        for blob_id, size in trie.iter_leaves(node):
+            leaf_blob_ids.append(blob_id)
+            leaf_sizes.append(size)
+        leaf_starts.append(len(leaf_blob_ids))
+    strings = [trie.strings[string_id].encode('utf-8') for string_id in string_order]
+    string_starts = array('Q', [0])
+    for string in strings:
+        string_starts.append(string_starts[-1] + len(string))
+    arrays = {
+        'segments': array('I', (NONE if node == ROOT else new_string_ids[trie.segments[node]] for node in order)),
+        'parents': array('I', (NONE if node == ROOT else new_ids[trie.parents[node]] for node in order)),
+        'first_children': first_children,
+        'child_counts': array('I', (trie.child_counts[node] for node in order)),
+        'leaf_starts': leaf_starts,
+        'leaf_counts': array('Q', (trie.leaf_counts[node] for node in order)),
+        'total_sizes': array('Q', (trie.total_sizes[node] for node in order)),
+        'min_sizes': array('Q', (trie.min_sizes[node] for node in order)),
+        'max_sizes': array('Q', (trie.max_sizes[node] for node in order)),
+        'leaf_blob_ids': leaf_blob_ids,
+        'leaf_sizes': leaf_sizes,
+        'string_starts': string_starts,
+    }
+    with open(filename + '.tmp', 'wb') as f:
+        header = TRIE_HEADER.pack(TRIE_MAGIC, TRIE_VERSION, new_ids[node_id], len(order), len(leaf_blob_ids),
+                                  len(strings))
+        f.write(header.ljust(TRIE_HEADER_SIZE, b'\0'))
+        for name, _, _ in trie_sections(len(order), len(leaf_blob_ids), len(strings)):
+            arrays[name].tofile(f)
+            f.write(b'\0' * (-f.tell() % 8))
+        f.writelines(strings)
+    os.replace(filename + '.tmp', filename)
+
+
+class MappedTrie:
+    """
+    A read-only trie in the format written by `write_trie`, which is memory-mapped rather than loaded. Its arrays are
+    zero-copy views of the file, so opening it takes constant time and memory, and only the pages that are used are
+    ever read. It provides the same read methods as `CompactTrie`, so that `TrieNode` can view either.
+    """
+    def __init__(self, filename: str):
+        if sys.byteorder != 'little':
+            raise RuntimeError("Tries can only be memory-mapped on little-endian machines.")
+        with open(filename, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.root, node_count, leaf_count, string_count = TRIE_HEADER.unpack_from(self.mmap)
+        if magic != TRIE_MAGIC:
+            raise ValueError(f"Not a trie file: {filename}.")
+        if version != TRIE_VERSION:
+            raise ValueError(f"Unsupported trie file version {version} in: {filename}. Rebuild it with this version.")
+        self.filename = filename
+        self.view = memoryview(self.mmap)
+        self.arrays = []
+        offset = TRIE_HEADER_SIZE
+        for name, typecode, count in trie_sections(node_count, leaf_count, string_count):
+            size = array(typecode).itemsize * count
+            view = self.view[offset:offset + size].cast(typecode)
+            setattr(self, name, view)
+            self.arrays.append(view)
+            offset = align(offset + size)
+        self.string_data = self.view[offset:offset + self.string_starts[string_count]]
+        self.arrays.append(self.string_data)
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def close(self):
+        for view in self.arrays:
+            view.release()
+        self.view.release()
+        self.mmap.close()
+
+    def string(self, string_id: int) -> bytes:
+        return self.string_data[self.string_starts[string_id]:self.string_starts[string_id + 1]].tobytes()
+
+    def find_string(self, segment: str) -> Optional[int]:
+        key = segment.encode('utf-8')
+        lo, hi = 0, len(self.string_starts) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.string(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.string_starts) - 1 and self.string(lo) == key:
+            return lo
+        return None
+
+    def segment(self, node: int) -> Optional[str]:
+        string_id = self.segments[node]
+        return None if string_id == NONE else self.string(string_id).decode('utf-8')
+
+    def parent(self, node: int) -> Optional[int]:
+        parent = self.parents[node]
+        return None if parent == NONE else parent
+
+    def child(self, node: int, segment: str) -> Optional[int]:
+        string_id = self.find_string(segment)
+        if string_id is None or self.child_counts[node] == 0:
+            return None
+        first = self.first_children[node]
+        end = first + self.child_counts[node]
+        child = bisect.bisect_left(self.segments, string_id, first, end)
+        if child < end and self.segments[child] == string_id:
+            return child
+        return None
+
+    def child_count(self, node: int) -> int:
+        return self.child_counts[node]
+
+    def iter_children(self, node: int) -> Iterator[int]:
+        """
+        :return: an iterator over the children of the node, in the order of their segments
+        """
+        count = self.child_counts[node]
+        if count == 0:
+            return iter(())
+        first = self.first_children[node]
+        return iter(range(first, first + count))
+
+    def has_leaves(self, node: int) -> bool:
+        return self.leaf_starts[node + 1] > self.leaf_starts[node]
+
+    def iter_leaves(self, node: int) -> Iterator[Tuple[int, int]]:
+        for leaf in range(self.leaf_starts[node], self.leaf_starts[node + 1]):
+            yield self.leaf_blob_ids[leaf], self.leaf_sizes[leaf]
+
+    def copy_to(self, filename: str, node_id: int):
+        shutil.copyfile(self.filename, filename)
+        with open(filename, 'r+b') as f:
+            f.seek(len(TRIE_MAGIC) + 4)
+            f.write(struct.pack('<I', node_id))
+
+
+########
+# Tries pickled by older versions
+####
+
+
+class LegacyTrieNode:
+    """
+    Stands in for the `TrieNode` and `RootNode` classes when unpickling tries pickled before `CompactTrie` existed,
+    whose nodes were objects with `segment`, `parent`, `children`, `leaves`, `min_size`, and `max_size` attributes.
+    """
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    def find_class(self, module: str, name: str):
+        if module in ('suffix_trie', '__main__') and name in ('TrieNode', 'RootNode'):
+            return LegacyTrieNode
+        return super().find_class(module, name)
+
+
+def convert_legacy_trie(legacy_node: LegacyTrieNode) -> 'TrieNode':
+    """
+    Copies an unpickled legacy trie into a `CompactTrie`, without recursion. The legacy sizes are not copied, since
+    they were not kept up to date; the aggregates are computed from the leaves instead.
+
+    :param legacy_node: the unpickled node, which may be any node of the legacy trie
+    :return: the corresponding node of the new trie
+    """
+    legacy_root = legacy_node
+    while legacy_root.parent is not None:
+        legacy_root = legacy_root.parent
+    trie = CompactTrie()
+    node_id = ROOT
+    stack = [(legacy_root, ROOT)]
+    while stack:
+        legacy, node = stack.pop()
+        if legacy is legacy_node:
+            node_id = node
+        for blob_id, size in legacy.leaves.items():
+            trie.add_leaf(node, blob_id, size)
+        for segment, legacy_child in legacy.children.items():
+            stack.append((legacy_child, trie.add_child(node, segment)))
+    return TrieNode(trie, node_id)
 
 
 class TrieNode:
-    def __init__(self, segment: Optional[str], parent: Optional['TrieNode']):
-        self.segment = segment
-        self.parent = parent
-        self.children: Dict[str, TrieNode] = {}
-        self.leaves: Dict[int, int] = {}
-        self.min_size = float('inf')
-        self.max_size = 0
+    """
+    A node of a trie, which is a lightweight view of one node of a `CompactTrie` (or of a read-only `MappedTrie`). Views
+    of the same node compare equal.
+    """
+    __slots__ = ('trie', 'node_id')
+
+    def __init__(self, trie: Union[CompactTrie, MappedTrie], node_id: int):
+        self.trie = trie
+        self.node_id = node_id
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, TrieNode) and self.trie is other.trie and self.node_id == other.node_id
+
+    def __hash__(self) -> int:
+        return hash((id(self.trie), self.node_id))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.get_full_name()!r})"
+
+    @property
+    def segment(self) -> Optional[str]:
+        return self.trie.segment(self.node_id)
+
+    @property
+    def parent(self) -> Optional['TrieNode']:
+        parent = self.trie.parent(self.node_id)
+        return None if parent is None else TrieNode(self.trie, parent)
+
+    @property
+    def children(self) -> Dict[str, 'TrieNode']:
+        children = [TrieNode(self.trie, child) for child in self.trie.iter_children(self.node_id)]
+        return {child.segment: child for child in children}
+
+    @property
+    def leaves(self) -> Dict[int, int]:
+        return dict(self.trie.iter_leaves(self.node_id))
+
+    @property
+    def leaf_count(self) -> int:
+        """
+        The number of leaves in the subtree of this node, including its own.
+        """
+        return self.trie.leaf_counts[self.node_id]
+
+    @property
+    def total_size(self) -> int:
+        """
+        The total size of the leaves in the subtree of this node.
+        """
+        return self.trie.total_sizes[self.node_id]
+
+    @property
+    def min_size(self) -> float:
+        """
+        The smallest size of a leaf in the subtree of this node, or infinity if there are none.
+        """
+        min_size = self.trie.min_sizes[self.node_id]
+        return float('inf') if min_size == NO_MIN_SIZE else min_size
+
+    @property
+    def max_size(self) -> int:
+        """
+        The largest size of a leaf in the subtree of this node, or 0 if there are none.
+        """
+        return self.trie.max_sizes[self.node_id]
 
     def __getitem__(self, key: str) -> 'TrieNode':
-        return self.children[key]
+        child = self.trie.child(self.node_id, key)
+        if child is None:
+            raise KeyError(key)
+        return TrieNode(self.trie, child)
 
     def __len__(self) -> int:
-        return len(self.children)
+        return self.trie.child_count(self.node_id)
 
     @property
     def is_leaf(self) -> bool:
-        return bool(self.leaves)
+        return self.trie.has_leaves(self.node_id)
 
     def count_leaves(self) -> int:
-        return len(self.leaves) + sum(map(lambda n: n.count_leaves(), self.children.values()))
-
-    def update_min_size(self, potential_new_min_size: int):
-        self.min_size = min(self.min_size, potential_new_min_size)
-
-    def update_max_size(self, potential_new_max_size: int):
-        self.max_size = max(self.max_size, potential_new_max_size)
+        return self.leaf_count
 
-    def update_sizes(self, size: int):
-        self.update_min_size(size)
-        self.update_max_size(size)
+    def walk(self) -> Iterator['TrieNode']:
+        """
+        :return: an iterator over this node and all of its descendants, in depth-first pre-order, without recursion
+        """
+        trie = self.trie
+        stack = [self.node_id]
+        while stack:
+            node = stack.pop()
+            yield TrieNode(trie, node)
+            children = list(trie.iter_children(node))
+            children.reverse()
+            stack.extend(children)
 
-    def add_child(self, child: 'TrieNode'):
-        if child.segment in self.children:
-            # Fail quietly when duplicate child is created. Otherwise, raise an error.
-            if self.children[child.segment] == child:
-                return
-            else:
-                print(f"Could not add {type(child).__name__} because {type(self.children[child.segment]).__name__} "
-                      f"already exists at path: {child.segment}/{self.get_full_name()}")
-                return
-                # TODO: Fix this.
-                # raise ValueError(f"Different child already exists for: {child.segment}/{self.get_full_name()}")
-        self.children[child.segment] = child
+    def add_child(self, segment: str) -> 'TrieNode':
+        """
+        :param segment: the segment of the child
+        :return: the child with that segment, which is created if it does not exist yet
+        """
+        return TrieNode(self.trie, self.trie.add_child(self.node_id, segment))
 
     def add_leaf(self, blob_id: int, size: int):
-        self.leaves[blob_id] = size
+        self.trie.add_leaf(self.node_id, blob_id, size)
 
     def add_descendant_leaf(self, segments: Sequence[str], blob_id: int, size: int, reverse: bool=True):
         if reverse:
             segments = reversed(segments)
-        node = self
+        trie = self.trie
+        node = self.node_id
         for segment in segments:
-            if segment in node.children:
-                node = node.children[segment]
-                continue
-            child = TrieNode(segment, node)
-            node.add_child(child)
-            node.update_sizes(size)
-            node = child
-        node.add_leaf(blob_id, size)
+            node = trie.add_child(node, segment)
+        trie.add_leaf(node, blob_id, size)
 
     def get_full_name(self) -> str:
-        node = self
+        trie = self.trie
+        node = self.node_id
         parts = []
-        while node is not None and node.segment is not None:  # The root node has a None segment and a None parent.
-            parts.append(node.segment)
-            node = node.parent
+        while node != ROOT:  # The root node has no segment and no parent.
+            parts.append(trie.segment(node))
+            node = trie.parents[node]
         return '/'.join(parts)
 
     def get_depth(self) -> int:
-        depth = 0
-        node = self
-        while node is not None:
+        depth = 1
+        node = self.node_id
+        while node != ROOT:
             depth += 1
-            node = node.parent
+            node = self.trie.parents[node]
         return depth
 
     def dump_to_file(self, filename: str):
-        with open(filename, 'wb') as f:
-            pickle.dump(self, f)
+        """
+        Writes the whole trie in the memory-mapped format, so that `load_from_file` opens it at this node.
+        """
+        if isinstance(self.trie, MappedTrie):
+            self.trie.copy_to(filename, self.node_id)
+        else:
+            write_trie(self.trie, self.node_id, filename)
 
     @staticmethod
     def load_from_file(filename: str) -> 'TrieNode':
+        """
+        Opens a trie written by `dump_to_file`, which is memory-mapped and read-only. Tries pickled by older versions
+        are also accepted; they are loaded into memory and converted.
+        """
         with open(filename, 'rb') as f:
-            node = pickle.load(f)
-        assert isinstance(node, TrieNode)
-        return node
+            magic = f.read(len(TRIE_MAGIC))
+        if magic == TRIE_MAGIC:
+            trie = MappedTrie(filename)
+            return TrieNode(trie, trie.root)
+        with open(filename, 'rb') as f:
+            loaded = LegacyUnpickler(f).load()
+        if not isinstance(loaded, LegacyTrieNode):
+            raise ValueError(f"Not a trie file: {filename}.")
+        return convert_legacy_trie(loaded)
 
 
 class RootNode(TrieNode):
+    """
+    The root of a new, empty trie.
+    """
+    __slots__ = ()
+
     def __init__(self):
-        super().__init__(None, None)
+        super().__init__(CompactTrie(), ROOT)
 
 
-def build_trie_from_index(index_file: str, exclusions: Set[str]=None, reverse: bool=True) -> TrieNode:
-    if exclusions is None:
-        exclusions = set()
-    root = RootNode()
+########
+# Building tries
+####
+
+
+def split_name(name: str, reverse: bool) -> List[str]:
+    """
+    :return: the segments of a name, in the order they are added to the trie
+    """
+    segments = WORD_PATTERN.findall(name)
+    if reverse:
+        segments.reverse()
+    return segments
+
+
+def add_names(trie: CompactTrie, entries: Iterable[Tuple[str, str, str]], exclusions: Set[str], reverse: bool):
+    """
+    Adds names to a trie in bulk. Consecutive names in a sorted index usually start with the same segments, so the
+    nodes for the segments a name shares with the previous one are reused rather than looked up again. This helps
+    prefix tries the most; in a suffix trie, consecutive names share fewer segments.
+
+    :param trie: the trie to add to
+    :param entries: the name, blob number, and size of each blob
+    :param exclusions: the last segments (extensions) of the names to skip
+    :param reverse: whether to add the segments of each name from last to first, to build a suffix trie
+    """
+    # The nodes for the segments of the previous name, starting with the root.
+    path = [ROOT]
+    previous: List[str] = []
     line_no = 0
     try:
-        with open(index_file) as f:
-            reader = csv.reader(f, delimiter='\t')
-            for blob_id, name, size in reader:
-                line_no += 1
-                segments = re.findall('\w+', name)
-                if segments[-1] in exclusions:
-                    # Skip certain extensions.
-                    continue
-                blob_id = int(blob_id)
-                size = int(size)
-                root.add_descendant_leaf(segments, blob_id, size, reverse=reverse)
+        for name, blob_id, size in entries:
+            line_no += 1
+            segments = WORD_PATTERN.findall(name)
+            if segments[-1] in exclusions:
+                # Skip certain extensions.
+                continue
+            if reverse:
+                segments.reverse()
+            shared = 0
+            limit = min(len(segments), len(previous))
+            while shared < limit and segments[shared] == previous[shared]:
+                shared += 1
+            del path[shared + 1:]
+            node = path[-1]
+            for segment in segments[shared:]:
+                node = trie.add_child(node, segment)
+                path.append(node)
+            trie.add_leaf(node, int(blob_id), int(size))
+            previous = segments
     except ValueError as e:
         raise ValueError(f"Error on line {line_no}: {e.args[0]}")
-    return root
+
+
+def iter_index_entries(index_file: str) -> Iterator[Tuple[str, str, str]]:
+    return ((entry.name, entry.blob_id, entry.size) for entry in read_index(index_file))
+
+
+def shard_key(name: str, depth: int, reverse: bool) -> Tuple[str, ...]:
+    """
+    :return: the first `depth` segments of a name, in the order they are added to the trie, found without splitting the
+             rest of the name
+    """
+    if reverse:
+        # The words of the reversed name are the reversed words of the name, from last to first.
+        matches = itertools.islice(WORD_PATTERN.finditer(name[::-1]), depth)
+        return tuple(match.group()[::-1] for match in matches)
+    return tuple(match.group() for match in itertools.islice(WORD_PATTERN.finditer(name), depth))
+
+
+def last_segment(name: str) -> Optional[str]:
+    match = WORD_PATTERN.search(name[::-1])
+    return None if match is None else match.group()[::-1]
+
+
+def shard_of(key: Tuple[str, ...], assignments: Dict[Tuple[str, ...], int], jobs: int) -> int:
+    """
+    :return: the shard assigned to a key, or for the keys that were not in the sample, a shard chosen by its hash
+    """
+    shard = assignments.get(key)
+    if shard is None:
+        shard = zlib.crc32('/'.join(key).encode('utf-8')) % jobs
+    return shard
+
+
+def plan_trie_shards(index_file: str, exclusions: Set[str], reverse: bool, jobs: int,
+                     shard_depth: Optional[int]) -> Tuple[int, Dict[Tuple[str, ...], int]]:
+    """
+    Splits the names of an index into shards of roughly equal numbers of names. Each name's shard is determined by its
+    first `shard_depth` segments (in the order they are added to the trie, so its extension comes first in a suffix
+    trie), so that the shards' tries only overlap in their first `shard_depth` levels. The depth is the smallest that
+    keeps every key in a sample of the names below `1 / jobs` of the sample, unless it is given.
+
+    :return: the shard depth, and the shard assigned to each key seen in the sample
+    """
+    depths = [shard_depth] if shard_depth is not None else range(1, MAX_SHARD_DEPTH + 1)
+    counts: Dict[int, Counter] = {depth: Counter() for depth in depths}
+    sampled = 0
+    for i, entry in enumerate(read_index(index_file)):
+        if i % SHARD_SAMPLE_INTERVAL != 0 or last_segment(entry.name) in exclusions:
+            continue
+        sampled += 1
+        key = shard_key(entry.name, depths[-1], reverse)
+        for depth in depths:
+            counts[depth][key[:depth]] += 1
+    depth = depths[-1]
+    for candidate in depths:
+        if max(counts[candidate].values(), default=0) * jobs <= sampled:
+            depth = candidate
+            break
+    # Give the largest remaining key to the least loaded shard.
+    loads = [(0, shard) for shard in range(jobs)]
+    assignments = {}
+    for key, count in counts[depth].most_common():
+        load, shard = heapq.heappop(loads)
+        assignments[key] = shard
+        heapq.heappush(loads, (load + count, shard))
+    return depth, assignments
+
+
+def split_index(index_file: str, exclusions: Set[str], reverse: bool, shard_depth: int,
+                assignments: Dict[Tuple[str, ...], int], shard_files: List[str]):
+    """
+    Writes the name, blob number, and size of each blob in an index to the file of its shard, keeping the index's order.
+    Only the first few segments of each name are found here, so that the rest of the work of splitting names is left
+    to the worker processes.
+    """
+    jobs = len(shard_files)
+    outputs = [open(shard_file, 'w') for shard_file in shard_files]
+    try:
+        for entry in read_index(index_file):
+            if last_segment(entry.name) in exclusions:
+                continue
+            shard = shard_of(shard_key(entry.name, shard_depth, reverse), assignments, jobs)
+            outputs[shard].write(f"{entry.name}\t{entry.blob_id}\t{entry.size}\n")
+    finally:
+        for output in outputs:
+            output.close()
+
+
+def build_trie_shard(shard_file: str, reverse: bool) -> CompactTrie:
+    """
+    Builds the trie of the names in one shard file written by `split_index`. This runs in a worker process.
+    """
+    trie = CompactTrie()
+    with open(shard_file) as f:
+        add_names(trie, (line.rstrip('\n').split('\t') for line in f), set(), reverse)
+    return trie
+
+
+def build_trie_from_index(index_file: str, exclusions: Set[str]=None, reverse: bool=True, jobs: int=1,
+                          shard_depth: Optional[int]=None) -> TrieNode:
+    """
+    Builds a trie of the names in an index.
+
+    :param index_file: the index built with `build_index.py`, in any of the forms accepted by `read_index`
+    :param exclusions: the last segments (extensions) of the names to skip
+    :param reverse: whether to build a suffix trie, rather than a prefix trie
+    :param jobs: the number of processes to build the trie with (see `plan_trie_shards`), or 0 for one per CPU
+    :param shard_depth: the number of segments that determine the shard of a name, or `None` to choose it
+    :return: the root of the trie
+    """
+    if exclusions is None:
+        exclusions = set()
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        root = RootNode()
+        add_names(root.trie, iter_index_entries(index_file), exclusions, reverse)
+        return root
+    shard_depth, assignments = plan_trie_shards(index_file, exclusions, reverse, jobs, shard_depth)
+    with tempfile.TemporaryDirectory() as shard_dir:
+        shard_files = [os.path.join(shard_dir, f"shard-{shard}.tsv") for shard in range(jobs)]
+        split_index(index_file, exclusions, reverse, shard_depth, assignments, shard_files)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(build_trie_shard, shard_file, reverse) for shard_file in shard_files]
+            trie = futures[0].result()
+            for future in futures[1:]:
+                trie.graft(future.result())
+    return TrieNode(trie, ROOT)
 
 
 def build_trie_from_file(filename: str, exclusions: Set[str]=None, reverse: bool=True) -> TrieNode:
     if exclusions is None:
         exclusions = set()
     root = RootNode()
-    line_no = 0
-    try:
-        with open(filename) as f:
-            for line in f:
-                line_no += 1
-                segments = re.findall('\w+', line.strip())
-                if segments[-1] in exclusions:
-                    continue
-                root.add_descendant_leaf(segments, 0, 0, reverse=reverse)
-    except ValueError as e:
-        raise ValueError(f"Error on line {line_no}: {e.args[0]}")
+    with open(filename) as f:
+        add_names(root.trie, ((line.strip(), 0, 0) for line in f), exclusions, reverse)
     return root
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    build_parser = subparsers.add_parser('build', help="Build a trie of the names in an index and save it.")
+    build_parser.add_argument('index_file', nargs='?', default=INDEX_FILE)
+    build_parser.add_argument('trie_file')
+    build_parser.add_argument('--forward', action='store_true', help="Build a prefix trie instead of a suffix trie.")
+    build_parser.add_argument('--jobs', '-j', type=int, default=1,
+                              help="The number of processes to build the trie with, or 0 for one per CPU.")
+    build_parser.add_argument('--shard-depth', type=int, default=None,
+                              help="The number of segments that determine the shard of a name.")
+    convert_parser = subparsers.add_parser('convert', help="Convert a pickled trie to the memory-mapped format.")
+    convert_parser.add_argument('pickle_file')
+    convert_parser.add_argument('trie_file')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        root = build_trie_from_index(args.index_file, reverse=not args.forward, jobs=args.jobs,
+                                     shard_depth=args.shard_depth)
+        root.dump_to_file(args.trie_file)
+    else:
+        TrieNode.load_from_file(args.pickle_file).dump_to_file(args.trie_file)
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Answers questions about the files in the repository from a trie built with `suffix_trie.py`, rather than by rescanning
+the index. Every node of a trie knows the number and total size of the leaves below it, so most questions only need to
+look at the top few levels of the trie.
+
+The names in a trie are split into words (the runs of letters, digits, and underscores), so a name like
+`org/example/foo/1.0/foo-1.0-sources.jar` is stored as `org/example/foo/1/0/foo/1/0/sources/jar`. A suffix trie
+(built with `reverse=True`, the default) stores the words from the end of each name, so its first level is the
+extensions; a prefix trie (built with `--forward`) stores them from the start. Every query works on both kinds, but
+suffix queries are much cheaper on suffix tries and prefix queries on prefix tries.
+
+* Extension histogram: the number and total size of the files, by their last word (or last few words, with
+  `--levels`).
+* Classifier histogram: the same, by the word before the extension, for the files that are not checksums or
+  signatures. This approximates the Maven classifier (`sources`, `javadoc`, `tests`, ...): it skips the words that are
+  only digits, which end a version number, but it also counts the last word of artifacts such as `maven-metadata.xml`.
+* Top subtrees: the `k` subtrees with the most bytes or files, among those whose names have a given number of words.
+* Pattern matches: the names that start or end with some words, which are produced lazily as they are found.
+
+`analyze` computes the histograms and the top subtrees together in a single traversal.
+"""
+
+import heapq
+import re
+
+from check_hashes import SIDECAR_SUFFIXES
+from suffix_trie import TrieNode
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+
+SIDECAR_WORDS = {suffix[1:] for suffix in SIDECAR_SUFFIXES}
+
+
+class Stats(NamedTuple):
+    count: int
+    total_size: int
+
+
+class Analysis(NamedTuple):
+    extensions: Dict[str, Stats]
+    classifiers: Dict[str, Stats]
+    top_by_size: List[Tuple[str, Stats]]
+    top_by_count: List[Tuple[str, Stats]]
+
+
+def split_words(pattern: str) -> List[str]:
+    """
+    :return: the words of a name or pattern, split in the same way as the names in a trie
+    """
+    return re.findall(r'\w+', pattern)
+
+
+def is_version_word(word: str) -> bool:
+    return word.isdigit()
+
+
+def leaf_stats(node: TrieNode) -> Stats:
+    """
+    :return: the number and total size of the leaves of the node itself, not counting its descendants
+    """
+    sizes = [size for _, size in node.trie.iter_leaves(node.node_id)]
+    return Stats(len(sizes), sum(sizes))
+
+
+def subtree_stats(node: TrieNode) -> Stats:
+    return Stats(node.leaf_count, node.total_size)
+
+
+def add_stats(histogram: Dict[str, Stats], key: str, stats: Stats):
+    if stats.count:
+        count, total_size = histogram.get(key, (0, 0))
+        histogram[key] = Stats(count + stats.count, total_size + stats.total_size)
+
+
+def last_words(node: TrieNode, levels: int) -> List[str]:
+    """
+    :return: up to `levels` segments from the node towards the root, starting with the node's own
+    """
+    trie = node.trie
+    words = []
+    node_id = node.node_id
+    while len(words) < levels and trie.parent(node_id) is not None:
+        words.append(trie.segment(node_id))
+        node_id = trie.parent(node_id)
+    return words
+
+
+def full_name(node: TrieNode, reverse: bool) -> str:
+    """
+    :return: the node's name, in the original order of its words. `TrieNode.get_full_name` gives that order for a
+             suffix trie, but the reverse for a prefix trie.
+    """
+    if reverse:
+        return node.get_full_name()
+    return '/'.join(reversed(last_words(node, node.get_depth())))
+
+
+def path_matches(node: TrieNode, words: Sequence[str]) -> bool:
+    """
+    :return: whether the segments from the node towards the root start with the given words
+    """
+    trie = node.trie
+    node_id = node.node_id
+    for word in words:
+        if trie.parent(node_id) is None or trie.segment(node_id) != word:
+            return False
+        node_id = trie.parent(node_id)
+    return True
+
+
+class TopK:
+    """
+    Keeps the `k` largest items seen so far in a heap, so that finding them takes memory proportional to `k`.
+    """
+    def __init__(self, k: int, reverse: bool):
+        self.k = k
+        self.reverse = reverse
+        self.heap: List[Tuple[int, int, TrieNode]] = []
+        self.seen = 0
+
+    def add(self, key: int, node: TrieNode):
+        if self.k <= 0:
+            return
+        self.seen += 1
+        # The count breaks ties between equal keys, so that nodes are never compared.
+        item = (key, -self.seen, node)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+
+    def results(self) -> List[Tuple[str, Stats]]:
+        return [(full_name(node, self.reverse), subtree_stats(node)) for _, _, node in sorted(self.heap, reverse=True)]
+
+
+def analyze(root: TrieNode, k: int=20, levels: int=1, top_levels: int=2, reverse: bool=True) -> Analysis:
+    """
+    Computes the extension and classifier histograms and the top subtrees in a single, iterative traversal. For a
+    suffix trie, this only visits the nodes in the first `max(levels, top_levels, 2)` levels, since every node has the
+    totals for its subtree; for a prefix trie, it visits every node.
+
+    :param root: the root of the trie
+    :param k: the number of top subtrees to find
+    :param levels: the number of words at the end of a name that make up its extension
+    :param top_levels: the number of words in the names of the subtrees to rank
+    :param reverse: whether the trie is a suffix trie
+    :return: the histograms and the top subtrees, by total size and by number of files
+    """
+    extensions: Dict[str, Stats] = {}
+    classifiers: Dict[str, Stats] = {}
+    top_by_size = TopK(k, reverse)
+    top_by_count = TopK(k, reverse)
+    max_depth = max(levels, top_levels, 2) if reverse else None
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if depth == top_levels:
+            top_by_size.add(node.total_size, node)
+            top_by_count.add(node.leaf_count, node)
+        if reverse:
+            if depth > 0:
+                # The names that end here are shorter than the others that are counted at this level.
+                key_stats = subtree_stats(node) if depth == levels else leaf_stats(node) if depth < levels else None
+                if key_stats is not None:
+                    # Going up a suffix trie gives the words in their original order.
+                    add_stats(extensions, '.'.join(last_words(node, levels)), key_stats)
+            if depth == 2 and not is_version_word(node.segment) and node.parent.segment not in SIDECAR_WORDS:
+                add_stats(classifiers, node.segment, subtree_stats(node))
+        elif node.is_leaf:
+            stats = leaf_stats(node)
+            words = last_words(node, max(levels, 2))
+            add_stats(extensions, '.'.join(reversed(words[:levels])), stats)
+            if len(words) > 1 and not is_version_word(words[1]) and words[0] not in SIDECAR_WORDS:
+                add_stats(classifiers, words[1], stats)
+        if max_depth is None or depth < max_depth:
+            stack.extend((TrieNode(node.trie, child), depth + 1) for child in node.trie.iter_children(node.node_id))
+    return Analysis(extensions, classifiers, top_by_size.results(), top_by_count.results())
+
+
+def iter_named_leaves(node: TrieNode) -> Iterator[TrieNode]:
+    return (descendant for descendant in node.walk() if descendant.is_leaf)
+
+
+def descend(root: TrieNode, words: Sequence[str]) -> Optional[TrieNode]:
+    """
+    :return: the node reached by following the words down from the root, or `None` if there is no such node
+    """
+    node_id = root.node_id
+    for word in words:
+        node_id = root.trie.child(node_id, word)
+        if node_id is None:
+            return None
+    return TrieNode(root.trie, node_id)
+
+
+def match_words(root: TrieNode, words: List[str], reverse: bool, at_end: bool) -> Iterator[str]:
+    """
+    Finds the names that start or end with some words. When the words are at the end of the names that the trie is
+    built from (the end of a name in a suffix trie, or its start in a prefix trie), the matches are all under the single
+    node reached by following the words down from the root; otherwise, every node with leaves is checked.
+    """
+    if at_end == reverse:
+        node = descend(root, reversed(words) if reverse else words)
+        matches = iter_named_leaves(node) if node is not None else iter(())
+    else:
+        # Going up the trie from a node gives its words in their original order in a suffix trie, but backwards in a
+        # prefix trie.
+        expected = words if reverse else list(reversed(words))
+        matches = (match for match in iter_named_leaves(root) if path_matches(match, expected))
+    for match in matches:
+        yield full_name(match, reverse)
+
+
+def match_suffix(root: TrieNode, pattern: str, reverse: bool=True) -> Iterator[str]:
+    """
+    :param root: the root of the trie
+    :param pattern: the words the names must end with, such as `sources.jar`
+    :param reverse: whether the trie is a suffix trie
+    :return: an iterator over the full names of the nodes with leaves whose names end with the pattern
+    """
+    return match_words(root, split_words(pattern), reverse, at_end=True)
+
+
+def match_prefix(root: TrieNode, pattern: str, reverse: bool=True) -> Iterator[str]:
+    """
+    :param root: the root of the trie
+    :param pattern: the words the names must start with, such as `org/apache`
+    :param reverse: whether the trie is a suffix trie
+    :return: an iterator over the full names of the nodes with leaves whose names start with the pattern
+    """
+    return match_words(root, split_words(pattern), reverse, at_end=False)
+
+
+def show_histogram(histogram: Dict[str, Stats], limit: Optional[int]=None, by_count: bool=False):
+    rows = sorted(histogram.items(), key=lambda item: item[1].count if by_count else item[1].total_size, reverse=True)
+    for key, stats in rows[:limit]:
+        print(f"{key}\t{stats.count}\t{stats.total_size}")
+
+
+def show_top(top: List[Tuple[str, Stats]]):
+    for name, stats in top:
+        print(f"{name}\t{stats.count}\t{stats.total_size}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trie_file', help="A trie saved with `suffix_trie.py build`.")
+    parser.add_argument('--forward', action='store_true', help="The trie is a prefix trie, built with --forward.")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    for command, help_text in [('extensions', "Print the number and total size of the files by extension."),
+                               ('classifiers', "Print the number and total size of the files by classifier.")]:
+        histogram_parser = subparsers.add_parser(command, help=help_text)
+        histogram_parser.add_argument('--levels', type=int, default=1,
+                                      help="The number of words in an extension, such as 2 for `jar.sha1`.")
+        histogram_parser.add_argument('--limit', '-n', type=int, default=None)
+        histogram_parser.add_argument('--by-count', action='store_true', help="Sort by number of files, not bytes.")
+    top_parser = subparsers.add_parser('top', help="Print the subtrees with the most bytes or files.")
+    top_parser.add_argument('-k', type=int, default=20)
+    top_parser.add_argument('--levels', type=int, default=2, help="The number of words in the subtrees' names.")
+    top_parser.add_argument('--by-count', action='store_true', help="Rank by number of files, not bytes.")
+    match_parser = subparsers.add_parser('match', help="Print the names that start or end with some words.")
+    match_group = match_parser.add_mutually_exclusive_group(required=True)
+    match_group.add_argument('--prefix')
+    match_group.add_argument('--suffix')
+    analyze_parser = subparsers.add_parser('analyze', help="Print the histograms and top subtrees together.")
+    analyze_parser.add_argument('-k', type=int, default=20)
+    analyze_parser.add_argument('--levels', type=int, default=1)
+    analyze_parser.add_argument('--top-levels', type=int, default=2)
+    args = parser.parse_args()
+
+    root = TrieNode.load_from_file(args.trie_file)
+    reverse = not args.forward
+    if args.command in ('extensions', 'classifiers'):
+        analysis = analyze(root, k=0, levels=args.levels, top_levels=-1, reverse=reverse)
+        show_histogram(getattr(analysis, args.command), args.limit, args.by_count)
+    elif args.command == 'top':
+        analysis = analyze(root, k=args.k, levels=0, top_levels=args.levels, reverse=reverse)
+        show_top(analysis.top_by_count if args.by_count else analysis.top_by_size)
+    elif args.command == 'match':
+        if args.prefix is not None:
+            matches = match_prefix(root, args.prefix, reverse)
+        else:
+            matches = match_suffix(root, args.suffix, reverse)
+        try:
+            for name in matches:
+                print(name)
+        except BrokenPipeError:
+            pass
+    else:
+        analysis = analyze(root, args.k, args.levels, args.top_levels, reverse)
+        for title, histogram in [('Extensions', analysis.extensions), ('Classifiers', analysis.classifiers)]:
+            print(f"# {title}")
+            show_histogram(histogram, args.k)
+        for title, top in [('Top subtrees by size', analysis.top_by_size),
+                           ('Top subtrees by count', analysis.top_by_count)]:
+            print(f"# {title}")
+            show_top(top)
@@ -25,65 +25,188 @@ Solutions:
    correct place.
 4. Implement a custom `uniq` and `sort` in a single pass.
 
-We're going with option 3 for now.
+We first went with option 3, but it failed whenever the input was more out of order than its buffer, and its list
+operations were linear in the length of the buffer. This is now an external sort with deduplication, which is correct
+for any input and which takes advantage of the input being nearly sorted:
+
+* Lines are read in runs of at most `--max-buffer-length` lines. Each run is sorted in memory, which is close to linear
+  for nearly sorted input, and its duplicates (now adjacent) are dropped.
+* If the whole input fits in one run, it is written out directly. Otherwise the runs are spilled to temporary files and
+  then merged, dropping duplicates as they meet.
+* If there are more runs than can be merged at once (`--fan-in`), they are merged in several passes.
+
+Lines are handled as bytes throughout, so the output is in the same order as that of `LC_ALL=C sort -u`.
 """
 
+import bisect
+import itertools
+import os
 import sys
+import tempfile
+
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+RUN_LENGTH = 1000000
+MERGE_FAN_IN = 64
+# Lines are read and written in blocks of about this many bytes, rather than one at a time.
+IO_BLOCK_SIZE = 1024 * 1024
+BLOCK_LINES = 10000
+
+
+def sorted_unique(lines: List[bytes]) -> List[bytes]:
+    lines.sort()
+    return [line for previous, line in zip(itertools.chain([None], lines), lines) if line != previous]
+
+
+def unique_merge(runs: List[Iterator[List[bytes]]]) -> Iterator[List[bytes]]:
+    """
+    Merges sorted runs of lines, dropping duplicates. Rather than comparing the lines one at a time, the runs are merged
+    a block at a time: every line up to the smallest of the last lines of the runs' current blocks is taken from all of
+    the blocks at once and sorted together. Since the input is nearly sorted, the runs barely overlap and these sorts
+    mostly just concatenate sorted lists.
+
+    :param runs: the sorted runs, each free of duplicates, as iterators over blocks of lines
+    :return: an iterator over blocks of the distinct lines of all the runs, in order
+    """
+    # The current block of each run that has lines left, and the position of its first unmerged line.
+    current: Dict[int, Tuple[List[bytes], int]] = {}
+
+    def advance(run_no: int):
+        for block in runs[run_no]:
+            if block:
+                current[run_no] = (block, 0)
+                return
+        current.pop(run_no, None)
+
+    for run_no in range(len(runs)):
+        advance(run_no)
+    while current:
+        bound = min(block[-1] for block, _ in current.values())
+        merged = []
+        for run_no, (block, pos) in list(current.items()):
+            end = bisect.bisect_right(block, bound, pos)
+            merged += block[pos:end]
+            if end == len(block):
+                advance(run_no)
+            else:
+                current[run_no] = (block, end)
+        # Every line left in the runs is greater than `bound`, so duplicates can only be within this block.
+        yield sorted_unique(merged)
+
 
+def read_blocks(f: BinaryIO) -> Iterator[List[bytes]]:
+    while True:
+        lines = f.readlines(IO_BLOCK_SIZE)
+        if not lines:
+            return
+        yield lines
 
-def uniqsemisort(basename_file: str, buffer_length: int):
-    buffer = []
 
-    def evict():
-        print(buffer.pop(0))
+def read_run(run_file: BinaryIO) -> Iterator[List[bytes]]:
+    for lines in read_blocks(run_file):
+        yield [line[:-1] for line in lines]
 
-    def process_line(line: str):
-        if not buffer:
-            buffer.append(line)
-            return
-        i = -1
-        while abs(i) <= len(buffer) and line < buffer[i]:
-            i -= 1
-        if abs(i) > len(buffer):
-            raise RuntimeError(f"Could not process line '{line}'")
-        if line == buffer[i]:
-            # If the lines are equal then we don't need to add it again. This is the `uniq` portion of the sort.
-            return
-        else:
-            if i + 1 == 0:
-                buffer.append(line)
-            else:
-                buffer.insert(i + 1, line)
-            # If we're beyond the maximum length, perform eviction.
-            if len(buffer) > buffer_length:
-                evict()
 
+def split_blocks(lines: List[bytes]) -> Iterator[List[bytes]]:
+    for start in range(0, len(lines), BLOCK_LINES):
+        yield lines[start:start + BLOCK_LINES]
+
+
+def write_blocks(blocks: Iterable[List[bytes]], out: BinaryIO):
+    for block in blocks:
+        if block:
+            out.write(b'\n'.join(block))
+            out.write(b'\n')
+
+
+def merge_run_files(run_files: List[str], out: BinaryIO):
+    files = [open(run_file, 'rb') for run_file in run_files]
+    try:
+        write_blocks(unique_merge([read_run(f) for f in files]), out)
+    finally:
+        for f in files:
+            f.close()
+        for run_file in run_files:
+            os.remove(run_file)
+
+
+def uniqsemisort(basename_file: Optional[str], buffer_length: int=RUN_LENGTH, output_file: Optional[str]=None,
+                 temp_dir: Optional[str]=None, fan_in: int=MERGE_FAN_IN):
+    """
+    Sorts the lines of a file and removes duplicates, like `sort | uniq`, in bounded memory. See the module
+    documentation for details.
+
+    :param basename_file: the file to sort, or `None` to read from stdin
+    :param buffer_length: the maximum number of lines to hold in memory at once
+    :param output_file: the file to write the sorted lines to, or `None` to write to stdout
+    :param temp_dir: the directory to spill sorted runs into, or `None` for the system's default
+    :param fan_in: the maximum number of runs to merge at once
+    """
+    fan_in = max(fan_in, 2)
+    buffer_length = max(buffer_length, 1)
     line_no = 0
     if basename_file is not None:
-        bf = open(basename_file)
+        bf = open(basename_file, 'rb')
     else:
-        bf = sys.stdin
+        bf = sys.stdin.buffer
+    out = sys.stdout.buffer if output_file is None else open(output_file, 'wb')
     try:
-        for raw_line in bf:
-            process_line(raw_line.strip())
-            line_no += 1
-    except:
-        print(file=sys.stderr)
-        print(f"Processed {line_no} lines before being interrupted.", file=sys.stderr)
-        print(file=sys.stderr)
-        raise
+        with tempfile.TemporaryDirectory(dir=temp_dir) as tmp_dir:
+            run_files: List[str] = []
+            buffer: List[bytes] = []
+            try:
+                for raw_lines in read_blocks(bf):
+                    buffer.extend(map(bytes.strip, raw_lines))
+                    line_no += len(raw_lines)
+                    if len(buffer) >= buffer_length:
+                        run_file = os.path.join(tmp_dir, f"run-{len(run_files)}")
+                        with open(run_file, 'wb') as f:
+                            write_blocks(split_blocks(sorted_unique(buffer)), f)
+                        run_files.append(run_file)
+                        buffer = []
+            except:
+                print(file=sys.stderr)
+                print(f"Processed {line_no} lines before being interrupted.", file=sys.stderr)
+                print(file=sys.stderr)
+                raise
+            last_run = sorted_unique(buffer)
+            del buffer
+            if not run_files:
+                write_blocks(split_blocks(last_run), out)
+                return
+            # Merge in passes until the remaining runs (along with the last one, still in memory) can be merged at once.
+            pass_no = 0
+            while len(run_files) >= fan_in:
+                pass_no += 1
+                merged_files = []
+                for start in range(0, len(run_files), fan_in):
+                    merged_file = os.path.join(tmp_dir, f"pass-{pass_no}-{len(merged_files)}")
+                    with open(merged_file, 'wb') as f:
+                        merge_run_files(run_files[start:start + fan_in], f)
+                    merged_files.append(merged_file)
+                run_files = merged_files
+            files = [open(run_file, 'rb') for run_file in run_files]
+            try:
+                write_blocks(unique_merge([*(read_run(f) for f in files), split_blocks(last_run)]), out)
+            finally:
+                for f in files:
+                    f.close()
     finally:
         bf.close()
-
-    while buffer:
-        evict()
+        if out is not sys.stdout.buffer:
+            out.close()
 
 
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--basename-file', '-f', default=None)
-    parser.add_argument('--max-buffer-length', '-l', type=int, default=100)
+    parser.add_argument('--output-file', '-o', default=None)
+    parser.add_argument('--max-buffer-length', '-l', type=int, default=RUN_LENGTH,
+                        help="The maximum number of lines to hold in memory at once.")
+    parser.add_argument('--temp-dir', '-T', default=None)
+    parser.add_argument('--fan-in', type=int, default=MERGE_FAN_IN)
     args = parser.parse_args()
 
-    uniqsemisort(args.basename_file, args.max_buffer_length)
+    uniqsemisort(args.basename_file, args.max_buffer_length, args.output_file, args.temp_dir, args.fan_in)
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Reads the few top-level fields of a POM or `maven-metadata.xml` file without building the whole document.
+
+Both kinds of files start with the fields we need (`groupId`, `artifactId`, `version`, and the `parent` or `versioning`
+elements), followed by the bulk of the document: dependencies, build configuration, or long lists of versions. Rather
+than parse the whole file into a tree and then look up the fields, the file is fed to lxml's incremental pull parser a
+chunk at a time, and parsing stops as soon as every field the caller needs has been found. Files are read a chunk at a
+time too, so apart from its last few hundred bytes (see below), the rest of a file is never even read.
+
+Fields can be missing from the header, though, and still come later, such as the `groupId` of a POM that inherits its
+group from its parent. Parsing incrementally also stops at the first top-level element other than the fields, or after
+the first couple of kilobytes, and such files are then parsed in full. These files take somewhat longer than with a
+plain full parse, so the overall speedup depends on how many files have their fields in the header.
+
+Fields are identified by their paths of local names below the root element, ignoring namespaces, such as `('groupId',)`
+or `('parent', 'version')`. Only the first occurrence of each path is kept. The text of the fields is the same as the
+`.text` of the corresponding elements in a full parse.
+
+Documents the pull parser rejects, and files that cannot be read, are parsed in full instead, so that they raise the
+same errors as before. Since parsing stops early, the rest of a file is only checked for truncation: if it does not end
+with the end tag of its root element, it is parsed in full too. A file that is otherwise malformed after its header,
+such as one with mismatched tags among its dependencies, is not noticed, and its fields are returned where a full parse
+would raise an error.
+
+Run as a script, this compares the throughput of the incremental extraction against a full parse, either on the given
+files or on a generated corpus of realistically shaped POMs and metadata files:
+
+    ./xml_header.py --generate 2000
+    ./xml_header.py path/to/*.pom
+"""
+
+import io
+import time
+
+# noinspection PyUnresolvedReferences
+from lxml import etree  # For some reason, `etree` can't be found by PyCharm.
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+
+# The number of bytes to parse before checking whether the fields have been found. The push parser is somewhat slower
+# per byte than parsing a whole document at once, so this is small enough to stop soon after the fields. Sizes up to a
+# kilobyte made no measurable difference for POMs, whose fields end about a kilobyte in, while the fields of metadata
+# files are usually within the first chunk.
+CHUNK_SIZE = 256
+# The fields are usually within the first kilobyte or two of a file. If they have not all been found by then, the whole
+# file is parsed at once instead, and the fields are looked up in the resulting tree.
+HEADER_SIZE = 2048
+# The number of bytes read from the end of a file to find the end tag of its root element.
+TAIL_SIZE = 256
+
+Path = Tuple[str, ...]
+Header = Dict[Path, Optional[str]]
+
+POM_PATHS = [('modelVersion',), ('groupId',), ('artifactId',), ('version',), ('parent',), ('parent', 'groupId'),
+             ('parent', 'artifactId'), ('parent', 'version')]
+POM_ID_TAGS = ['groupId', 'artifactId', 'version']
+METADATA_PATHS = [('groupId',), ('artifactId',), ('version',), ('latest',), ('versioning',), ('versioning', 'latest')]
+
+
+def local_name(element) -> str:
+    return element.tag.rpartition('}')[2]
+
+
+def container_paths(paths: Iterable[Path]) -> Iterable[Path]:
+    """
+    :return: the paths that contain other paths, such as `('parent',)`, whose elements are only noted as present
+    """
+    return {path[:1] for path in paths if len(path) > 1} & set(paths)
+
+
+def open_source(source: Union[str, bytes]) -> BinaryIO:
+    return io.BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')
+
+
+def iter_chunks(f: BinaryIO, chunk_size: int, header_size: int) -> Iterator[bytes]:
+    """
+    :return: an iterator over chunks of the document's first `header_size` bytes
+    """
+    size = 0
+    while size < header_size:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        size += len(chunk)
+        yield chunk
+
+
+def ends_with_end_tag(f: BinaryIO, root) -> bool:
+    """
+    :param root: the root element of the document, as far as it has been parsed
+    :return: whether the document ends with the end tag of its root element, followed only by whitespace, as a complete
+             document usually does
+    """
+    name = local_name(root) if root.prefix is None else f"{root.prefix}:{local_name(root)}"
+    f.seek(0, io.SEEK_END)
+    f.seek(max(0, f.tell() - TAIL_SIZE))
+    return f.read().rstrip().endswith(f"</{name}>".encode('utf-8'))
+
+
+def extract_header_from_tree(root, paths: Iterable[Sequence[str]]) -> Header:
+    """
+    Finds the fields in a fully parsed document.
+
+    :param root: the root element of the document
+    :param paths: the paths of the fields to find
+    :return: the text of each field that was found, by path
+    """
+    paths = {tuple(path) for path in paths}
+    containers = container_paths(paths)
+    header = {}
+    # Searching with `find` stays in lxml's C code, which is much faster than walking over the children in Python.
+    for path in sorted(paths, key=len):
+        parent = root if len(path) == 1 else root.find('{*}' + path[0])
+        element = None if parent is None else parent.find('{*}' + path[-1])
+        if element is not None:
+            header[path] = None if path in containers else element.text
+    return header
+
+
+def extract_header(source: Union[str, bytes], paths: Iterable[Sequence[str]],
+                   done: Optional[Callable[[Header], bool]]=None, chunk_size: int=CHUNK_SIZE,
+                   header_size: int=HEADER_SIZE) -> Header:
+    """
+    Finds some of the top-level fields of an XML document, parsing only as much of it as needed.
+
+    :param source: the path to the document, or its contents
+    :param paths: the paths of the fields to find, one or two local names long
+    :param done: a function of the fields found so far that says whether the rest of the document can be skipped,
+                 which by default is when every field has been found
+    :param chunk_size: the number of bytes to read and parse at a time, within the first `header_size` bytes
+    :param header_size: the number of bytes to parse incrementally, before parsing the whole document instead
+    :return: the text of each field that was found, by path (the text of fields with no text, and of the fields that
+             contain other fields, is `None`)
+    """
+    paths = {tuple(path) for path in paths}
+    if done is None:
+        def done(found: Header) -> bool:
+            return len(found) == len(paths)
+    # The elements that contain other fields are noted when they start, before the fields within them, and the others
+    # when they end and their text is complete.
+    containers = container_paths(paths)
+    top_level_names = {path[0] for path in paths}
+    parser = etree.XMLPullParser(events=('start', 'end'))
+    header = {}
+    root = None
+    # The depth of the current element, counting the root as 1, and the local names of the open elements below the root,
+    # up to two levels deep. Keeping track of these is much cheaper than looking up each element's ancestors.
+    depth = 0
+    open_names: List[str] = []
+
+    def read_events() -> bool:
+        """
+        :return: whether to stop parsing, either because the caller is done, or because the header is over: a top-level
+                 element other than the fields has started
+        """
+        nonlocal root, depth
+        for event, element in parser.read_events():
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    root = element
+                elif depth <= 3:
+                    del open_names[depth - 2:]
+                    open_names.append(local_name(element))
+                    path = tuple(open_names)
+                    if depth == 2 and path[0] not in top_level_names:
+                        return True
+                    if path in containers and path not in header:
+                        header[path] = None
+            else:
+                depth -= 1
+                # The element was below the root, and at most two levels deep.
+                if 1 <= depth <= 2:
+                    path = tuple(open_names[:depth])
+                    if path in paths and path not in containers and path not in header:
+                        header[path] = element.text
+        return done(header)
+
+    try:
+        with open_source(source) as f:
+            for chunk in iter_chunks(f, chunk_size, header_size):
+                parser.feed(chunk)
+                if read_events():
+                    break
+            # The rest of the document is not parsed, but a truncated one, which would fail to parse, is still noticed
+            # by its missing end tag.
+            if done(header) and root is not None and ends_with_end_tag(f, root):
+                return header
+    except (etree.LxmlError, OSError):
+        # The document is malformed, unusual, or missing. The full parse below raises the same error it always did.
+        pass
+    # Some of the fields are missing from the header, such as the group of a POM that inherits it from its parent, and
+    # could still come later in the document. Carrying on with the pull parser through the rest of the document is much
+    # slower than starting over with a full parse, and looking the fields up in the tree.
+    if isinstance(source, bytes):
+        root = etree.parse(io.BytesIO(source)).getroot()
+    else:
+        root = etree.parse(source).getroot()
+    return extract_header_from_tree(root, paths)
+
+
+def pom_header_done(header: Header) -> bool:
+    """
+    Whether every field `organize_poms.py` needs from a POM has been found. The parent's fields are only needed for the
+    fields whose values refer to variables.
+    """
+    if ('modelVersion',) not in header:
+        return False
+    for tag in POM_ID_TAGS:
+        if (tag,) not in header:
+            return False
+        text = header[(tag,)]
+        if text is not None and '$' in text and ('parent', tag) not in header:
+            return False
+    return True
+
+
+def metadata_header_done(header: Header) -> bool:
+    """
+    Whether every field `extract_latest_version_pom_names.py` needs from a `maven-metadata.xml` file has been found. The
+    top-level `latest` and `version` fields are only needed if there is no `latest` field within `versioning`.
+    """
+    return (('groupId',) in header and ('artifactId',) in header and ('versioning',) in header
+            and ('versioning', 'latest') in header)
+
+
+def extract_pom_header(source: Union[str, bytes]) -> Header:
+    return extract_header(source, POM_PATHS, pom_header_done)
+
+
+def extract_metadata_header(source: Union[str, bytes]) -> Header:
+    return extract_header(source, METADATA_PATHS, metadata_header_done)
+
+
+########
+# Benchmark
+####
+
+
+LICENSE_COMMENT = """<!--
+  Licensed to the Apache Software Foundation (ASF) under one or more contributor license agreements. See the NOTICE
+  file distributed with this work for additional information regarding copyright ownership. The ASF licenses this
+  file to you under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance
+  with the License. You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0
+-->"""
+
+
+def generate_pom(n: int) -> bytes:
+    """
+    :return: a POM shaped like a typical one in Maven Central: a license comment, the header fields, and then a long
+             tail of properties, dependencies, and build plugins
+    """
+    dependencies = ''.join(f"""
+    <dependency>
+      <groupId>org.example.dep{i}</groupId>
+      <artifactId>library-{i}</artifactId>
+      <version>{i}.{n % 10}.0</version>
+      <scope>{'test' if i % 3 == 0 else 'compile'}</scope>
+    </dependency>""" for i in range(10 + n % 30))
+    plugins = ''.join(f"""
+      <plugin>
+        <groupId>org.apache.maven.plugins</groupId>
+        <artifactId>maven-plugin-{i}</artifactId>
+        <version>3.{i}.0</version>
+        <configuration><source>1.8</source><target>1.8</target></configuration>
+      </plugin>""" for i in range(5))
+    # Every third POM inherits its group from its parent.
+    group_id = '' if n % 3 == 0 else f"\n  <groupId>org.example.group{n % 50}</groupId>"
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+{LICENSE_COMMENT}
+<project xmlns="http://maven.apache.org/POM/4.0.0" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+         xsi:schemaLocation="http://maven.apache.org/POM/4.0.0 http://maven.apache.org/xsd/maven-4.0.0.xsd">
+  <modelVersion>4.0.0</modelVersion>
+  <parent>
+    <groupId>org.example.group{n % 50}</groupId>
+    <artifactId>parent</artifactId>
+    <version>1.{n % 7}</version>
+  </parent>{group_id}
+  <artifactId>artifact-{n}</artifactId>
+  <version>1.{n % 7}.{n}</version>
+  <packaging>jar</packaging>
+  <name>Artifact {n}</name>
+  <description>A generated artifact for benchmarking.</description>
+  <properties>
+    <project.build.sourceEncoding>UTF-8</project.build.sourceEncoding>
+  </properties>
+  <dependencies>{dependencies}
+  </dependencies>
+  <build>
+    <plugins>{plugins}
+    </plugins>
+  </build>
+</project>
+""".encode('utf-8')
+
+
+def generate_metadata(n: int) -> bytes:
+    """
+    :return: an artifact-level `maven-metadata.xml` file, with a list of versions of varying length
+    """
+    versions = ''.join(f"\n      <version>1.{i // 10}.{i % 10}</version>" for i in range(5 + n % 200))
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<metadata>
+  <groupId>org.example.group{n % 50}</groupId>
+  <artifactId>artifact-{n}</artifactId>
+  <versioning>
+    <latest>1.9.9</latest>
+    <release>1.9.9</release>
+    <versions>{versions}
+    </versions>
+    <lastUpdated>20200101000000</lastUpdated>
+  </versioning>
+</metadata>
+""".encode('utf-8')
+
+
+def full_parse_header(data: bytes, paths: Sequence[Path]) -> Header:
+    """
+    Extracts the fields the way the scripts did before, by parsing the whole document.
+    """
+    return extract_header_from_tree(etree.fromstring(data), paths)
+
+
+def benchmark(name: str, corpus: List[bytes], paths: Sequence[Path], extract: Callable[[bytes], Header], repeat: int):
+    total_size = sum(map(len, corpus))
+    functions = [('full parse', lambda data: full_parse_header(data, paths)), ('incremental', extract)]
+    # The two are timed alternately, and the best of the runs is kept, so that a noisy machine affects both alike.
+    timings = [float('inf')] * len(functions)
+    results = []
+    for _ in range(repeat):
+        results = []
+        for i, (label, function) in enumerate(functions):
+            start = time.perf_counter()
+            results.append([function(data) for data in corpus])
+            timings[i] = min(timings[i], time.perf_counter() - start)
+    for (label, _), elapsed in zip(functions, timings):
+        print(f"{name}\t{label}\t{len(corpus) / elapsed:.0f} files/s\t{total_size / elapsed / 2**20:.1f} MiB/s")
+    # The incremental extraction may stop before it reaches fields that were not needed.
+    for full, incremental in zip(*results):
+        assert all(full[path] == text for path, text in incremental.items())
+    print(f"{name}\tspeedup\t{timings[0] / timings[1]:.2f}x")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*',
+                        help="The files to benchmark on, which are POMs unless named `maven-metadata.xml`.")
+    parser.add_argument('--generate', type=int, default=None, help="Generate this many of each kind of file instead.")
+    parser.add_argument('--repeat', type=int, default=5, help="Time each approach this many times, keeping the best.")
+    args = parser.parse_args()
+
+    if args.generate is not None:
+        poms = [generate_pom(n) for n in range(args.generate)]
+        metadata = [generate_metadata(n) for n in range(args.generate)]
+    else:
+        poms = []
+        metadata = []
+        for file_name in args.files:
+            with open(file_name, 'rb') as f:
+                (metadata if file_name.endswith('maven-metadata.xml') else poms).append(f.read())
+    if poms:
+        benchmark('pom', poms, POM_PATHS, extract_pom_header, args.repeat)
+    if metadata:
+        benchmark('metadata', metadata, METADATA_PATHS, extract_metadata_header, args.repeat)